@@ -0,0 +1,106 @@
+# social_media/actions.py
+"""
+Idempotent likes and follows.
+
+An action sets a relation to a state (liked or not, following or not)
+instead of toggling it, so a client can replay it safely.  Actions are
+applied per kind through the user's side of the many-to-many
+(``user.liked_posts`` and friends): one query for the targets, one indexed
+query for the rows already there, then at most one add and one remove,
+whatever the number of likers or followers.  The m2m_changed receivers keep
+counters, notifications, timelines and caches in step as usual.
+
+Every row an action writes belongs to the acting user, so ``apply`` first
+locks that user's row: concurrent requests from one user (a double-tapped
+like, a retried follow) queue behind each other instead of both reading the
+row as missing and both inserting it.  The rows found present are then
+exact, and the receivers only see rows that were really added or removed.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from .models import Comment, Post, Profile
+
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+# kind -> (target model, the user's related manager, through-table column)
+KINDS = {
+    'like_post': (Post, 'liked_posts', 'post_id'),
+    'like_comment': (Comment, 'liked_comments', 'comment_id'),
+    'follow': (Profile, 'following', 'profile_id'),
+}
+
+
+def batch_limit():
+    return getattr(settings, 'ACTIONS_BATCH_LIMIT', 100)
+
+
+def _targets(kind, target_ids):
+    """
+    ``{target_id: related pk}`` for the targets that exist; follows are
+    addressed by user id but stored against the profile
+    """
+    model = KINDS[kind][0]
+    if kind == 'follow':
+        return dict(Profile.objects.filter(user_id__in=target_ids).values_list('user_id', 'id'))
+    return {pk: pk for pk in model.objects.filter(pk__in=target_ids).values_list('pk', flat=True)}
+
+
+def _lock(user):
+    """
+    Hold ``user``'s row until the transaction ends; NO KEY where supported,
+    so rows referencing the user can still be inserted meanwhile
+    """
+    no_key = connection.features.has_select_for_no_key_update
+    list(User.objects.select_for_update(no_key=no_key).filter(pk=user.pk).values_list('pk', flat=True))
+
+
+def _apply_kind(user, kind, wanted):
+    _, related_name, column = KINDS[kind]
+    manager = getattr(user, related_name)
+    targets = _targets(kind, list(wanted))
+    present = set(
+        manager.through.objects.filter(user_id=user.pk, **{f'{column}__in': list(targets.values())})
+        .values_list(column, flat=True)
+    )
+
+    results, added, removed = {}, [], []
+    for target_id, state in wanted.items():
+        related_id = targets.get(target_id)
+        if related_id is None:
+            results[target_id] = NOT_FOUND
+        elif kind == 'follow' and target_id == user.pk:
+            results[target_id] = INVALID
+        elif state == (related_id in present):
+            results[target_id] = UNCHANGED
+        else:
+            (added if state else removed).append(related_id)
+            results[target_id] = CHANGED
+    if added:
+        manager.add(*added)
+    if removed:
+        manager.remove(*removed)
+    return results
+
+
+def apply(user, actions):
+    """
+    Apply ``[(kind, target_id, state)]`` for ``user`` in one transaction
+
+    Returns one of CHANGED, UNCHANGED, NOT_FOUND or INVALID per action.  When
+    several actions name the same target, the last one wins.
+    """
+    wanted = {}
+    for kind, target_id, state in actions:
+        wanted.setdefault(kind, {})[target_id] = bool(state)
+    results = {}
+    with transaction.atomic():
+        _lock(user)
+        for kind, states in wanted.items():
+            for target_id, result in _apply_kind(user, kind, states).items():
+                results[kind, target_id] = result
+    return [results[kind, target_id] for kind, target_id, _ in actions]
@@ -24,22 +24,3 @@ class NotificationAdmin(admin.ModelAdmin):
     list_display = ['recipient', 'sender', 'notification_type', 'is_read', 'created_at']
     list_filter = ['notification_type', 'is_read', 'created_at']
     search_fields = ['recipient__username', 'sender__username']
-
-# ============================================================================
-# SIGNALS.PY (Auto-create profiles)
-# ============================================================================
-
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.contrib.auth.models import User
-from .models import Profile
-
-@receiver(post_save, sender=User)
-def create_profile(sender, instance, created, **kwargs):
-    if created:
-        Profile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
\ No newline at end of file
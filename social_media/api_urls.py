@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     # Profile endpoints
@@ -8,6 +8,8 @@ urlpatterns = [
     # Post endpoints
     path('posts/', views.PostListCreateView.as_view(), name='post-list-create'),
     path('posts/<int:pk>/', views.PostDetailView.as_view(), name='post-detail'),
+    path('posts/search/', views.PostSearchView.as_view(), name='post-search'),
+    path('tags/<str:tag>/posts/', views.TagFeedView.as_view(), name='tag-feed'),
     
     # Comment endpoints
     path('posts/<int:post_id>/comments/', views.CommentListCreateView.as_view(), name='comment-list-create'),
@@ -19,7 +21,33 @@ urlpatterns = [
     
     # Follow endpoints
     path('users/<int:user_id>/follow/', views.follow_user, name='follow-user'),
+    path('users/<int:user_id>/relationship/', views.user_relationship, name='user-relationship'),
+    
+    # Batched likes and follows
+    path('actions/batch/', views.batch_actions, name='batch-actions'),
+    
+    # Notification endpoints
+    path('notifications/', views.NotificationListView.as_view(), name='notification-list'),
+    path('notifications/unread-count/', views.unread_notifications_count, name='notification-unread-count'),
+    path('notifications/mark-read/', views.mark_notifications_read, name='notification-mark-read'),
     
     # Search endpoints
     path('search/users/', views.search_users_api, name='search-users'),
+    
+    # Trending endpoints
+    path('trending/', views.TrendingView.as_view(), name='trending'),
+    
+    # Async variants of the hot endpoints, for ASGI deployments
+    path('async/feed/', async_views.feed, name='async-feed'),
+    path('async/profiles/<str:username>/', async_views.profile, name='async-profile'),
+    path('async/search/users/', async_views.search_users, name='async-search-users'),
+    path('async/posts/<int:post_id>/like/', async_views.like_post, name='async-like-post'),
+    path('async/comments/<int:comment_id>/like/', async_views.like_comment, name='async-like-comment'),
+    path('async/users/<int:user_id>/follow/', async_views.follow_user, name='async-follow-user'),
+    
+    # Server-sent notification and feed events (ASGI)
+    path('stream/', async_views.event_stream, name='event-stream'),
+    
+    # Metrics endpoints (staff only)
+    path('metrics/', views.metrics_report, name='metrics-report'),
 ]
\ No newline at end of file
@@ -0,0 +1,204 @@
+# social_media/async_views.py
+"""
+Async JSON variants of the hot API endpoints.
+
+Under an ASGI server these views wait on the database without holding a
+worker thread, and the profile view starts its profile, posts and follow
+state lookups together with ``asyncio.gather``.  Reads use the async ORM.
+Code shared with the sync views that is itself synchronous -- the timeline
+and graph caches, user search and the like/follow transaction with its
+m2m receivers -- runs through ``sync_to_async``.  Note that Django still
+executes async ORM queries on a single thread per request, so gathered
+queries overlap their waiting on the event loop rather than running in
+parallel on the database.
+
+Responses have the same shapes as the DRF endpoints they mirror.
+``event_stream`` pushes notification and feed updates as server-sent events
+(see streaming.py).
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET, require_http_methods
+from rest_framework.utils.urls import replace_query_param
+
+from . import actions, graph, pagination, search, streaming, timeline
+from .models import Follow, Post, Profile
+from .serializers import PostSerializer, ProfileSerializer
+from .views import embedded_comments_limit, relation_response, search_limit, user_search_result
+
+PAGE_SIZE = pagination.KeysetCursorPagination.page_size
+MAX_PAGE_SIZE = pagination.KeysetCursorPagination.max_page_size
+
+
+def login_required_json(view):
+    """
+    Resolve ``request.user`` without blocking and answer 403 like the DRF
+    endpoints when nobody is logged in
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _page_size(request):
+    try:
+        size = int(request.GET['page_size'])
+    except (KeyError, ValueError):
+        return PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _link(request, cursor):
+    if cursor is None:
+        return None
+    return replace_query_param(request.build_absolute_uri(), 'cursor', cursor)
+
+
+def _paginated(request, page, data):
+    return {'next': _link(request, page.next_cursor), 'previous': _link(request, page.previous_cursor), 'results': data}
+
+
+def _invalid_cursor():
+    return JsonResponse({'detail': 'Invalid cursor'}, status=404)
+
+
+def _serialize_posts(request, posts):
+    return PostSerializer(posts, many=True, context={'request': request}).data
+
+
+async def _load_posts(request, post_ids):
+    """
+    Posts for ``post_ids`` in that order, eagerly loaded for PostSerializer
+    """
+    queryset = PostSerializer.setup_eager_loading(
+        Post.objects.filter(pk__in=post_ids), comments_limit=embedded_comments_limit(request.GET),
+    )
+    posts = {post.pk: post async for post in queryset}
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+async def _author_page(request, username, cursor):
+    """
+    KeysetPage of ``username``'s posts, newest first
+    """
+    key, direction = pagination.decode_cursor(cursor) if cursor else (None, pagination.NEXT)
+    size = _page_size(request)
+    queryset = PostSerializer.setup_eager_loading(
+        Post.objects.filter(author__username=username), comments_limit=embedded_comments_limit(request.GET),
+    )
+    rows = [post async for post in pagination.keyset_filter(queryset, key, direction)[:size + 1]]
+    return pagination.build_page(rows, size, key, direction, lambda post: (post.created_at, post.pk))
+
+
+@require_GET
+@login_required_json
+async def feed(request):
+    """
+    The requesting user's home timeline, paginated like /api/posts/
+    """
+    try:
+        page = await sync_to_async(timeline.read_timeline_keys)(
+            request.user, request.GET.get('cursor'), _page_size(request),
+        )
+    except pagination.InvalidCursor:
+        return _invalid_cursor()
+    posts = await _load_posts(request, [post_id for _, post_id in page])
+    return JsonResponse(_paginated(request, page, _serialize_posts(request, posts)))
+
+
+@require_GET
+@login_required_json
+async def profile(request, username):
+    """
+    A profile with its first page of posts and whether the requester
+    follows it, looked up concurrently
+    """
+    try:
+        profile, page, is_following = await asyncio.gather(
+            Profile.objects.select_related('user').aget(user__username=username),
+            _author_page(request, username, request.GET.get('cursor')),
+            Follow.objects.filter(user_id=request.user.pk, profile__user__username=username).aexists(),
+        )
+    except Profile.DoesNotExist:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    except pagination.InvalidCursor:
+        return _invalid_cursor()
+    context = {'request': request}
+    return JsonResponse({
+        'profile': ProfileSerializer(profile, context=context).data,
+        'is_following': is_following and profile.user_id != request.user.pk,
+        'posts': _paginated(request, page, _serialize_posts(request, page.object_list)),
+    })
+
+
+@require_GET
+@login_required_json
+async def search_users(request):
+    """
+    Same as /api/search/users/: ranked matches with the follow state of each
+    """
+    query = request.GET.get('query', '')
+    if not query:
+        return JsonResponse({'results': []})
+    ids = await sync_to_async(search.search_user_ids)(query, search_limit(request.GET), request.user.id)
+    users, following = await asyncio.gather(
+        User.objects.select_related('profile').ain_bulk(ids),
+        sync_to_async(graph.members)(request.user.id, ids),
+    )
+    results = [user_search_result(request, users[user_id], following) for user_id in ids if user_id in users]
+    return JsonResponse({'results': results})
+
+
+async def _set_relation(request, kind, target_id):
+    state = request.method != 'DELETE'
+    # One transaction with the m2m receivers, so it stays synchronous
+    [result] = await sync_to_async(actions.apply)(request.user, [(kind, target_id, state)])
+    body, status = relation_response(kind, request.method, result)
+    return JsonResponse(body, status=status)
+
+
+@require_http_methods(['POST', 'PUT', 'DELETE'])
+@login_required_json
+async def like_post(request, post_id):
+    return await _set_relation(request, 'like_post', post_id)
+
+
+@require_http_methods(['POST', 'PUT', 'DELETE'])
+@login_required_json
+async def like_comment(request, comment_id):
+    return await _set_relation(request, 'like_comment', comment_id)
+
+
+@require_http_methods(['POST', 'PUT', 'DELETE'])
+@login_required_json
+async def follow_user(request, user_id):
+    return await _set_relation(request, 'follow', user_id)
+
+
+@require_GET
+@login_required_json
+async def event_stream(request):
+    """
+    The requesting user's server-sent events, one long-lived connection in
+    place of polling the inbox
+
+    Under a WSGI server, which would hold a worker per open stream, the
+    stream ends after its first event and the client's reconnect delay
+    turns it back into polling.
+    """
+    once = not isinstance(request, ASGIRequest)
+    response = StreamingHttpResponse(streaming.events(request.user, once=once), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
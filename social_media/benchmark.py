@@ -0,0 +1,308 @@
+# social_media/benchmark.py
+"""
+Benchmark harness driving the views and API through the Django test client.
+
+Each scenario is requested repeatedly as a sample of users from the local
+database (see ``generate_social_graph``); per-request latency and query
+counts are recorded and summarized into a JSON-serializable result that
+``run_benchmark --compare`` diffs against a previous run.  Write scenarios
+leave the data as they found it: likes and follows are undone by the next
+request, and posts created are deleted when their scenario ends.
+
+HttpBenchmark sends the same scenarios over HTTP to a running server with
+many clients at once, to compare deployments rather than code: sync
+gunicorn workers against an ASGI server on the ``async-*`` endpoints, say.
+Query counts are not visible from outside the server and are left out.
+"""
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from .models import Comment, Post
+from .synthetic import TAGS, WORDS
+
+
+# Prefix of the content of posts created by the create-post scenario
+POST_MARKER = '[benchmark]'
+
+
+class Scenario:
+    def __init__(self, name, build, writes=False, cleanup=None):
+        self.name = name
+        # build(rng, user, fixtures) -> list of (method, path, data)
+        self.build = build
+        self.writes = writes
+        # cleanup(fixtures), run once the scenario has finished
+        self.cleanup = cleanup
+
+
+def _like_cycle(rng, user, fixtures):
+    path = reverse('like-post', args=[rng.choice(fixtures['post_ids'])])
+    return [('post', path, None), ('delete', path, None)]
+
+
+def _follow_cycle(rng, user, fixtures):
+    target = rng.choice(fixtures['user_ids'])
+    if target == user.id:
+        return []
+    path = reverse('follow-user', args=[target])
+    return [('post', path, None), ('delete', path, None)]
+
+
+def _async_like_cycle(rng, user, fixtures):
+    path = reverse('async-like-post', args=[rng.choice(fixtures['post_ids'])])
+    return [('put', path, None), ('delete', path, None)]
+
+
+def _async_follow_cycle(rng, user, fixtures):
+    target = rng.choice(fixtures['user_ids'])
+    if target == user.id:
+        return []
+    path = reverse('async-follow-user', args=[target])
+    return [('put', path, None), ('delete', path, None)]
+
+
+def _create_post(rng, user, fixtures):
+    content = ' '.join([POST_MARKER, *rng.sample(WORDS, 6)])
+    return [('post', reverse('post-list-create'), {'content': content})]
+
+
+def _delete_created_posts(fixtures):
+    Post.objects.filter(author_id__in=fixtures['user_ids'], content__startswith=POST_MARKER).delete()
+
+
+SCENARIOS = [
+    Scenario('home', lambda rng, user, f: [('get', reverse('home'), None)]),
+    Scenario('profile', lambda rng, user, f: [('get', reverse('profile', args=[rng.choice(f['usernames'])]), None)]),
+    Scenario('post-list', lambda rng, user, f: [('get', reverse('post-list-create'), None)]),
+    Scenario('post-detail', lambda rng, user, f: [('get', reverse('post-detail', args=[rng.choice(f['post_ids'])]), None)]),
+    Scenario('comment-list', lambda rng, user, f: [('get', reverse('comment-list-create', args=[rng.choice(f['post_ids'])]), None)]),
+    Scenario('search-users', lambda rng, user, f: [('get', reverse('search-users'), {'query': rng.choice(f['usernames'])[:4]})]),
+    Scenario('search-posts', lambda rng, user, f: [('get', reverse('post-search'), {'q': rng.choice(WORDS)})]),
+    Scenario('tag-feed', lambda rng, user, f: [('get', reverse('tag-feed', args=[rng.choice(TAGS).lstrip('#')]), None)]),
+    Scenario('trending', lambda rng, user, f: [('get', reverse('trending'), None)]),
+    Scenario('like-post', _like_cycle, writes=True),
+    Scenario('follow-user', _follow_cycle, writes=True),
+    Scenario('create-post', _create_post, writes=True, cleanup=_delete_created_posts),
+    Scenario('async-feed', lambda rng, user, f: [('get', reverse('async-feed'), None)]),
+    Scenario('async-profile', lambda rng, user, f: [('get', reverse('async-profile', args=[rng.choice(f['usernames'])]), None)]),
+    Scenario('async-search-users', lambda rng, user, f: [('get', reverse('async-search-users'), {'query': rng.choice(f['usernames'])[:4]})]),
+    Scenario('async-like-post', _async_like_cycle, writes=True),
+    Scenario('async-follow-user', _async_follow_cycle, writes=True),
+]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, queries, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(statistics.fmean(latencies), 3) if latencies else None,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_queries': round(statistics.fmean(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+class Benchmark:
+    def __init__(self, requests=200, sample_users=50, warmup=5, include_writes=False,
+                 only=None, seed=0, prefix=None):
+        self.requests = requests
+        self.warmup = warmup
+        self.include_writes = include_writes
+        self.only = set(only or [])
+        self.random = random.Random(seed)
+
+        users = User.objects.order_by('?')
+        if prefix:
+            users = users.filter(username__startswith=prefix)
+        self.users = list(users.select_related('profile')[:sample_users])
+        if not self.users:
+            raise ValueError('No users to benchmark with; run generate_social_graph first')
+        self.fixtures = {
+            'user_ids': [user.id for user in self.users],
+            'usernames': [user.username for user in self.users],
+            'post_ids': list(Post.objects.order_by('?').values_list('id', flat=True)[:500]) or [0],
+        }
+        self.clients = {}
+
+    def _client(self, user):
+        client = self.clients.get(user.id)
+        if client is None:
+            # A view that raises answers 500 and counts as an error instead
+            # of ending the run
+            client = self.clients[user.id] = Client(raise_request_exception=False)
+            client.force_login(user)
+        return client
+
+    def scenarios(self):
+        for scenario in SCENARIOS:
+            if self.only and scenario.name not in self.only:
+                continue
+            if scenario.writes and not self.include_writes:
+                continue
+            yield scenario
+
+    def _call(self, client, method, path, data):
+        if method == 'get':
+            return client.get(path, data or {})
+        return getattr(client, method)(path, data or {}, content_type='application/json')
+
+    def run_scenario(self, scenario):
+        latencies, queries, errors = [], [], 0
+        total = self.warmup + self.requests
+        started = None
+        for index in range(total):
+            if index == self.warmup:
+                started = time.perf_counter()
+            user = self.random.choice(self.users)
+            client = self._client(user)
+            for method, path, data in scenario.build(self.random, user, self.fixtures):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = self._call(client, method, path, data)
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                if index < self.warmup:
+                    continue
+                if response.status_code >= 500:
+                    errors += 1
+                latencies.append(round(elapsed_ms, 3))
+                queries.append(len(captured.captured_queries))
+        elapsed = time.perf_counter() - started if started else 0
+        result = summarize(latencies, queries, elapsed)
+        result['errors'] = errors
+        return result
+
+    def run(self, log=None):
+        results = {}
+        for scenario in self.scenarios():
+            try:
+                results[scenario.name] = self.run_scenario(scenario)
+            finally:
+                if scenario.cleanup:
+                    scenario.cleanup(self.fixtures)
+            if log:
+                log(scenario.name, results[scenario.name])
+        return {
+            'database': {'vendor': connection.vendor, 'users': User.objects.count(),
+                         'posts': Post.objects.count(), 'comments': Comment.objects.count()},
+            'results': results,
+        }
+
+
+class HttpBenchmark(Benchmark):
+    """
+    Run the scenarios against the server at ``base_url`` with
+    ``concurrency`` requests in flight
+
+    The server must use the same database: sessions are created here for the
+    sampled users and sent as cookies, with a CSRF token for writes.
+    """
+
+    def __init__(self, base_url, concurrency=50, timeout=30, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.csrf_token = get_random_string(32)
+        self.headers = {}
+
+    def _headers(self, user):
+        headers = self.headers.get(user.id)
+        if headers is None:
+            session = self._client(user).cookies[settings.SESSION_COOKIE_NAME].value
+            headers = self.headers[user.id] = {
+                'Cookie': f'{settings.SESSION_COOKIE_NAME}={session}; {settings.CSRF_COOKIE_NAME}={self.csrf_token}',
+                'X-CSRFToken': self.csrf_token,
+            }
+        return headers
+
+    def _send(self, headers, method, path, data):
+        """
+        ``(status, elapsed_ms)``; connection failures count as status 599
+        """
+        url, body = self.base_url + path, None
+        if method == 'get':
+            if data:
+                url += '?' + urlencode(data)
+        else:
+            body = json.dumps(data or {}).encode()
+            headers = {**headers, 'Content-Type': 'application/json'}
+        start = time.perf_counter()
+        try:
+            with urlopen(Request(url, body, headers, method=method.upper()), timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except HTTPError as e:
+            status = e.code
+        except (URLError, OSError):
+            status = 599
+        return status, (time.perf_counter() - start) * 1000
+
+    def _run_calls(self, calls):
+        def run(call):
+            headers, steps = call
+            return [self._send(headers, *step) for step in steps]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return [sent for sents in pool.map(run, calls) for sent in sents]
+
+    def run_scenario(self, scenario):
+        # Calls are drawn up front so the seeded generator gives every run
+        # the same requests however the threads interleave
+        calls = []
+        for _ in range(self.warmup + self.requests):
+            user = self.random.choice(self.users)
+            calls.append((self._headers(user), scenario.build(self.random, user, self.fixtures)))
+        self._run_calls(calls[:self.warmup])
+
+        started = time.perf_counter()
+        sent = self._run_calls(calls[self.warmup:])
+        elapsed = time.perf_counter() - started
+        result = summarize([round(elapsed_ms, 3) for _, elapsed_ms in sent], [], elapsed)
+        result['errors'] = sum(1 for status, _ in sent if status >= 500)
+        return result
+
+    def run(self, log=None):
+        results = super().run(log)
+        results['server'] = {'url': self.base_url, 'concurrency': self.concurrency}
+        return results
+
+
+def compare(current, baseline, keys=('p50_ms', 'p95_ms', 'mean_queries', 'throughput_rps')):
+    """
+    Return ``{scenario: {key: (baseline, current, percent_change)}}``
+    """
+    diff = {}
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        diff[name] = {}
+        for key in keys:
+            old, new = before.get(key), result.get(key)
+            change = round((new - old) / old * 100, 1) if old and new is not None else None
+            diff[name][key] = (old, new, change)
+    return diff
@@ -0,0 +1,143 @@
+# social_media/caching.py
+"""
+Versioned read-through cache.
+
+Cached reads are keyed on the generations of what they depend on: a post
+and its comments (``post``), a user's identity and profile (``user``),
+anything about an author's posts (``posts``), which posts an author has
+(``authored``) or a home timeline (``timeline``).  A write
+replaces the generation tokens of what it touched -- one ``set_many``
+however many entries used them -- and old entries are never read again and
+age out with READ_CACHE_TIMEOUT.  Generation changes are deferred to commit
+so no reader can cache pre-commit data under the new generation.
+
+A lost generation is recreated as a fresh random token rather than reset,
+so an evicted generation can never resurrect stale entries.  Entries are
+computed from the primary database, never a lagging replica, since every
+reader shares them.
+"""
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import routers
+
+MISSING = object()
+
+
+def enabled():
+    return getattr(settings, 'READ_CACHE_ENABLED', True)
+
+
+def timeout():
+    return getattr(settings, 'READ_CACHE_TIMEOUT', 300)
+
+
+def _generation_key(namespace, ident):
+    return f'gen:{namespace}:{ident}'
+
+
+def _token():
+    return secrets.token_hex(8)
+
+
+def generations(deps):
+    """
+    Current generation tokens of ``deps`` (``[(namespace, id), ...]``), in
+    one cache round trip when they all exist
+    """
+    keys = [_generation_key(namespace, ident) for namespace, ident in deps]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, _token(), None)
+        found.update(cache.get_many(missing))
+    return [found.get(key, '') for key in keys]
+
+
+def bump(namespace, *idents):
+    """
+    Invalidate everything cached against ``namespace`` ``idents`` once the
+    current transaction commits
+    """
+    idents = {ident for ident in idents if ident is not None}
+    if not idents:
+        return
+    values = {_generation_key(namespace, ident): _token() for ident in idents}
+    transaction.on_commit(lambda: cache.set_many(values, None))
+
+
+def versioned_key(name, parts, deps):
+    raw = repr((tuple(parts), tuple(deps), tuple(generations(deps))))
+    return f'rt:{name}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def read_through(name, parts, deps, compute, timeout_seconds=None):
+    """
+    ``compute()``, cached under ``name``/``parts`` until any of ``deps``
+    changes generation
+    """
+    if not enabled():
+        return compute()
+    key = versioned_key(name, parts, deps)
+    value = cache.get(key, MISSING)
+    if value is MISSING:
+        with routers.primary():
+            value = compute()
+            cache.set(key, value, timeout_seconds or timeout())
+    return value
+
+
+def post_author_ids(post_ids):
+    """
+    ``{post_id: author_id}``, cached without expiry since a post never
+    changes author
+    """
+    keys = {f'post-author:{post_id}': post_id for post_id in post_ids}
+    found = {keys[key]: author_id for key, author_id in cache.get_many(keys).items()}
+    missing = [post_id for post_id in keys.values() if post_id not in found]
+    if missing:
+        from .models import Post
+
+        with routers.primary():
+            loaded = dict(Post.objects.filter(pk__in=missing).values_list('id', 'author_id'))
+        cache.set_many({f'post-author:{post_id}': author_id for post_id, author_id in loaded.items()}, None)
+        found.update(loaded)
+    return found
+
+
+def post_author_id(post_id):
+    return post_author_ids([post_id]).get(post_id)
+
+
+def comment_author_ids(post_id):
+    """
+    Sorted ids of the users who commented on ``post_id``, cached against the
+    post's generation, so reads embedding comments can depend on their
+    authors' ``user`` generations too
+    """
+    from .models import Comment
+
+    return read_through(
+        'comment-authors', [post_id], [('post', post_id)],
+        lambda: sorted(set(Comment.objects.filter(post_id=post_id).values_list('author_id', flat=True))),
+    )
+
+
+def comment_deps(post_id):
+    return [('post', post_id), *(('user', author_id) for author_id in comment_author_ids(post_id))]
+
+
+def bump_posts(post_ids, author_ids=None):
+    """
+    Invalidate cached reads of ``post_ids`` and of their authors' post lists
+    """
+    post_ids = [post_id for post_id in post_ids if post_id is not None]
+    if author_ids is None:
+        author_ids = post_author_ids(post_ids).values()
+    bump('post', *post_ids)
+    bump('posts', *author_ids)
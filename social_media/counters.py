@@ -0,0 +1,117 @@
+# social_media/counters.py
+"""
+Denormalized like/comment/follow counters.
+
+The counter columns on Post, Comment and Profile are maintained with atomic
+``F()`` updates from the receivers in signals.py; ``reconcile`` recomputes
+them in bulk when they drift (raw SQL, bulk_create on the through tables,
+restored backups).
+"""
+from collections import Counter
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Post, Profile
+
+
+def _bump(queryset, field, deltas):
+    """
+    Apply ``{pk_or_key: delta}`` to ``field`` with one UPDATE per distinct delta
+    """
+    by_delta = {}
+    for key, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(key)
+    for delta, keys in by_delta.items():
+        queryset(keys).update(**{field: F(field) + delta})
+
+
+def m2m_deltas(through, source_field, target_field, instance, action, reverse, pk_set):
+    """
+    Return ``(source_deltas, target_deltas)`` for an m2m_changed event
+
+    ``source_field``/``target_field`` are the through-table columns for the
+    model that declares the ManyToManyField and the related model.  Removals
+    are resolved against the through table on ``pre_remove``/``pre_clear``
+    because Django reports requested, not existing, ids for them.
+    """
+    if action == 'post_add':
+        sign = 1
+        pairs = [(s, instance.pk) for s in pk_set] if reverse else [(instance.pk, t) for t in pk_set]
+    elif action in ('pre_remove', 'pre_clear'):
+        sign = -1
+        rows = through.objects.filter(**{target_field if reverse else source_field: instance.pk})
+        if action == 'pre_remove':
+            rows = rows.filter(**{f'{source_field if reverse else target_field}__in': pk_set})
+        pairs = list(rows.values_list(source_field, target_field))
+    else:
+        return {}, {}
+
+    sources, targets = Counter(), Counter()
+    for source_id, target_id in pairs:
+        sources[source_id] += sign
+        targets[target_id] += sign
+    return sources, targets
+
+
+def apply_post_likes(instance, action, reverse, pk_set):
+    sources, _ = m2m_deltas(Post.likes.through, 'post_id', 'user_id', instance, action, reverse, pk_set)
+    _bump(lambda keys: Post.objects.filter(pk__in=keys), 'likes_count', sources)
+
+
+def apply_comment_likes(instance, action, reverse, pk_set):
+    sources, _ = m2m_deltas(Comment.likes.through, 'comment_id', 'user_id', instance, action, reverse, pk_set)
+    _bump(lambda keys: Comment.objects.filter(pk__in=keys), 'likes_count', sources)
+
+
+def apply_follows(instance, action, reverse, pk_set):
+    sources, targets = m2m_deltas(Profile.followers.through, 'profile_id', 'user_id', instance, action, reverse, pk_set)
+    _bump(lambda keys: Profile.objects.filter(pk__in=keys), 'followers_count', sources)
+    _bump(lambda keys: Profile.objects.filter(user_id__in=keys), 'following_count', targets)
+
+
+def apply_comment(post_id, delta):
+    Post.objects.filter(pk=post_id).update(comments_count=F('comments_count') + delta)
+
+
+def _count(queryset, group_field, outer_field='pk'):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{group_field: OuterRef(outer_field)})
+            .order_by()
+            .values(group_field)
+            .annotate(total=Count('*'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def counter_specs():
+    """
+    ``(model, field, expression)`` for every stored counter
+    """
+    return [
+        (Post, 'likes_count', _count(Post.likes.through.objects.all(), 'post_id')),
+        (Post, 'comments_count', _count(Comment.objects.all(), 'post_id')),
+        (Comment, 'likes_count', _count(Comment.likes.through.objects.all(), 'comment_id')),
+        (Profile, 'followers_count', _count(Profile.followers.through.objects.all(), 'profile_id')),
+        (Profile, 'following_count', _count(Profile.followers.through.objects.all(), 'user_id', 'user_id')),
+    ]
+
+
+def reconcile(dry_run=False):
+    """
+    Repair drifted counters in bulk and return ``{'Model.field': drifted_rows}``
+    """
+    report = {}
+    for model, field, expression in counter_specs():
+        drifted = model.objects.annotate(actual=expression).filter(~Q(**{field: F('actual')}))
+        label = f'{model.__name__}.{field}'
+        if dry_run:
+            report[label] = drifted.count()
+        else:
+            report[label] = model.objects.filter(pk__in=drifted.values('pk')).update(**{field: expression})
+    return report
@@ -0,0 +1,127 @@
+# social_media/graph.py
+"""
+Follow graph queries.
+
+Edges are Follow rows, addressed here by user id on both ends.  Each user's
+following and follower lists are cached as sorted ``array('q')`` of user
+ids against that user's ``following``/``followers`` cache generations,
+which the follow receivers bump; membership is then a bisect and
+intersections a merge, so a page needs one adjacency read however many
+users it asks about.  Lists longer than GRAPH_ADJACENCY_MAX_IDS are not
+cached and the same questions go to the indexed follow table instead.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+
+from . import caching
+from .models import Follow
+
+FOLLOWING = 'following'
+FOLLOWERS = 'followers'
+
+
+def adjacency_max_ids():
+    return getattr(settings, 'GRAPH_ADJACENCY_MAX_IDS', 5000)
+
+
+def _edges(user_id, direction):
+    """
+    ``(edges, column)``: the user's edges in ``direction`` and the column
+    holding the user id at their other end
+    """
+    if direction == FOLLOWING:
+        return Follow.objects.filter(user_id=user_id), 'profile__user_id'
+    return Follow.objects.filter(profile__user_id=user_id), 'user_id'
+
+
+def adjacency(user_id, direction=FOLLOWING):
+    """
+    Sorted ``array('q')`` of the user ids ``user_id`` follows (or that follow
+    them), or None when the list is too long to cache
+    """
+    def load():
+        edges, column = _edges(user_id, direction)
+        limit = adjacency_max_ids()
+        ids = array('q', sorted(edges.values_list(column, flat=True)[:limit + 1]))
+        return ids if len(ids) <= limit else None
+
+    return caching.read_through(f'graph-{direction}', [user_id], [(direction, user_id)], load)
+
+
+def contains(sorted_ids, user_id):
+    index = bisect_left(sorted_ids, user_id)
+    return index < len(sorted_ids) and sorted_ids[index] == user_id
+
+
+def intersect(first, second):
+    """
+    Common ids of two sorted sequences, sorted
+    """
+    if len(first) > len(second):
+        first, second = second, first
+    if len(first) * 8 < len(second):
+        # Much smaller side: bisect into the larger one
+        return [user_id for user_id in first if contains(second, user_id)]
+    common, i, j = [], 0, 0
+    while i < len(first) and j < len(second):
+        if first[i] == second[j]:
+            common.append(first[i])
+            i += 1
+            j += 1
+        elif first[i] < second[j]:
+            i += 1
+        else:
+            j += 1
+    return common
+
+
+def ids(user_id, direction=FOLLOWING):
+    """
+    Sorted user ids at the other end of ``user_id``'s edges, cached or not
+    """
+    cached = adjacency(user_id, direction)
+    if cached is not None:
+        return cached
+    edges, column = _edges(user_id, direction)
+    return sorted(edges.values_list(column, flat=True))
+
+
+def members(user_id, user_ids, direction=FOLLOWING):
+    """
+    Which of ``user_ids`` ``user_id`` follows (or is followed by), as a set
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return set()
+    cached = adjacency(user_id, direction)
+    if cached is not None:
+        return {other_id for other_id in user_ids if contains(cached, other_id)}
+    edges, column = _edges(user_id, direction)
+    return set(edges.filter(**{f'{column}__in': user_ids}).values_list(column, flat=True))
+
+
+def is_following(follower_id, followed_id):
+    return followed_id in members(follower_id, [followed_id])
+
+
+def common_following(user_id, other_id):
+    """
+    Accounts both users follow
+    """
+    return intersect(ids(user_id), ids(other_id))
+
+
+def mutual_follows(user_id):
+    """
+    Accounts that follow ``user_id`` back
+    """
+    return intersect(ids(user_id), ids(user_id, FOLLOWERS))
+
+
+def followers_you_know(viewer_id, user_id):
+    """
+    Followers of ``user_id`` whom ``viewer_id`` follows
+    """
+    return intersect(ids(viewer_id), ids(user_id, FOLLOWERS))
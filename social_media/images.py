@@ -0,0 +1,316 @@
+# social_media/images.py
+"""
+Off-request image renditions.
+
+Saving a Post image or a Profile picture only stores the upload and queues
+an ImageJob (see the pre_save/post_save receivers).  The
+``process_images`` worker renders each upload into the fixed RENDITIONS, in
+WebP and JPEG, on a process pool: orientation is applied, then the pixels
+are re-encoded without EXIF, ICC or other metadata.  The stored names and
+sizes land in the model's renditions JSON column, tagged with the source
+they were made from, so a replaced upload never serves stale renditions.
+No transaction is held while images render, and a job that keeps failing
+stays in the queue marked failed.
+
+Templates (``{% picture %}``) and serializers (``rendition_url``) pick the
+smallest rendition at least as wide as the slot, falling back to the
+original until the worker has run.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import caching
+from .models import ImageJob, Post, Profile
+
+logger = logging.getLogger(__name__)
+
+# name -> (bounding box, crop to fill it)
+RENDITIONS = {
+    'thumb': ((150, 150), True),
+    'feed': ((640, 1280), False),
+    'full': ((1600, 1600), False),
+}
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+MAX_ATTEMPTS = 3
+
+# ImageJob.target -> (model, image field, renditions field)
+TARGETS = {
+    'post': (Post, 'image', 'image_renditions'),
+    'profile': (Profile, 'profile_picture', 'picture_renditions'),
+}
+
+
+def is_async():
+    return getattr(settings, 'IMAGE_RENDITIONS_ASYNC', True)
+
+
+def batch_size():
+    return getattr(settings, 'IMAGE_RENDITIONS_BATCH_SIZE', 20)
+
+
+def worker_count():
+    return getattr(settings, 'IMAGE_RENDITIONS_WORKERS', os.cpu_count() or 1)
+
+
+def render(data):
+    """
+    Encode every rendition of the image in ``data``
+
+    Pure function of the bytes so it can run in a worker process; returns
+    ``{name: {'width', 'height', format: bytes}}``.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        has_alpha = source.mode in ('RGBA', 'LA') or (source.mode == 'P' and 'transparency' in source.info)
+        source = source.convert('RGBA' if has_alpha else 'RGB')
+
+    results = {}
+    for name, (box, crop) in RENDITIONS.items():
+        if crop:
+            side = min(box[0], source.width, source.height)
+            image = ImageOps.fit(source, (side, side), Image.LANCZOS)
+        else:
+            image = source.copy()
+            image.thumbnail(box, Image.LANCZOS)
+        result = {'width': image.width, 'height': image.height}
+        for format_name, (pil_format, _, options) in FORMATS.items():
+            encoded = image
+            if pil_format == 'JPEG' and image.mode != 'RGB':
+                encoded = Image.new('RGB', image.size, (255, 255, 255))
+                encoded.paste(image, mask=image.getchannel('A'))
+            buffer = io.BytesIO()
+            # No exif/icc_profile arguments: the output carries pixels only
+            encoded.save(buffer, pil_format, **options)
+            result[format_name] = buffer.getvalue()
+        results[name] = result
+    return results
+
+
+def store(source_name, rendered):
+    """
+    Save rendered bytes next to each other under ``renditions/`` and return
+    the JSON stored on the model
+    """
+    stem = os.path.splitext(source_name)[0]
+    renditions = {'source': source_name}
+    for name, result in rendered.items():
+        entry = {'width': result['width'], 'height': result['height']}
+        for format_name, (_, extension, _) in FORMATS.items():
+            data = result[format_name]
+            stored = default_storage.save(f'renditions/{stem}-{name}.{extension}', ContentFile(data))
+            entry[format_name] = {'name': stored, 'bytes': len(data)}
+        renditions[name] = entry
+    return renditions
+
+
+def rendition_files(renditions):
+    return [
+        entry[format_name]['name']
+        for name, entry in (renditions or {}).items() if name in RENDITIONS
+        for format_name in FORMATS if format_name in entry
+    ]
+
+
+def delete_renditions(renditions):
+    for name in rendition_files(renditions):
+        try:
+            default_storage.delete(name)
+        except OSError:
+            pass
+
+
+def current(image, renditions):
+    """
+    ``renditions`` if they were made from the image currently stored
+    """
+    if image and renditions and renditions.get('source') == image.name:
+        return renditions
+    return None
+
+
+def choose(image, renditions, width, webp=True):
+    """
+    Storage name of the smallest rendition at least ``width`` wide (else the
+    largest), or None when there are no current renditions
+    """
+    renditions = current(image, renditions)
+    if renditions is None:
+        return None
+    entries = sorted(
+        (entry for name, entry in renditions.items() if name in RENDITIONS),
+        key=lambda entry: entry['width'],
+    )
+    if not entries:
+        return None
+    entry = next((entry for entry in entries if entry['width'] >= width), entries[-1])
+    return entry['webp' if webp and 'webp' in entry else 'jpeg']['name']
+
+
+def rendition_url(image, renditions, width, webp=True):
+    """
+    URL of the best rendition for a ``width``-pixel slot, or of the original
+    """
+    if not image:
+        return None
+    name = choose(image, renditions, width, webp)
+    return default_storage.url(name) if name else image.url
+
+
+def accepts_webp(request):
+    return request is not None and 'image/webp' in request.META.get('HTTP_ACCEPT', '')
+
+
+def requested_url(request, image, renditions, default_width):
+    """
+    Absolute ``rendition_url`` for an API request: the slot width comes from
+    ``?image_width`` and WebP is used when the client accepts it
+    """
+    width = default_width
+    if request is not None:
+        try:
+            width = max(1, int(request.GET.get('image_width', default_width)))
+        except ValueError:
+            pass
+    url = rendition_url(image, renditions, width, accepts_webp(request))
+    return request.build_absolute_uri(url) if request is not None and url else url
+
+
+def enqueue(target, object_id, source_name):
+    """
+    Queue rendering of ``source_name`` for a Post or Profile, or render it
+    once the transaction commits when IMAGE_RENDITIONS_ASYNC is off
+    """
+    if is_async():
+        # Re-saving the same source revives a job that failed earlier; a live
+        # claim is left alone so the worker holding it finishes undisturbed
+        ImageJob.objects.update_or_create(
+            target=target, object_id=object_id, source=source_name,
+            defaults={'attempts': 0, 'last_error': '', 'failed_at': None},
+        )
+    else:
+        transaction.on_commit(lambda: apply(target, object_id, source_name, render(read(source_name))))
+
+
+def read(source_name):
+    with default_storage.open(source_name) as handle:
+        return handle.read()
+
+
+def apply(target, object_id, source_name, rendered):
+    """
+    Store renditions and attach them to the object if it still has this
+    source; returns False (after removing the files) when it does not
+    """
+    model, image_field, renditions_field = TARGETS[target]
+    renditions = store(source_name, rendered)
+    queryset = model.objects.filter(pk=object_id, **{image_field: source_name})
+    previous = queryset.values_list(renditions_field, flat=True).first()
+    if not queryset.update(**{renditions_field: renditions}):
+        delete_renditions(renditions)
+        return False
+    if previous:
+        delete_renditions(previous)
+    if target == 'post':
+        caching.bump_posts([object_id])
+    else:
+        caching.bump('user', *model.objects.filter(pk=object_id).values_list('user_id', flat=True))
+    return True
+
+
+def claim_seconds():
+    return getattr(settings, 'IMAGE_RENDITIONS_CLAIM_SECONDS', 300)
+
+
+def _claim(limit):
+    """
+    Claim up to ``limit`` jobs for IMAGE_RENDITIONS_CLAIM_SECONDS in a short
+    transaction of its own
+
+    Rows are locked with SKIP LOCKED only while the claim is written, so
+    several workers can share the queue; a worker that dies mid-batch leaves
+    claims that lapse and are picked up again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            ImageJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now), failed_at__isnull=True)
+            .order_by('id')[:limit]
+        )
+        if jobs:
+            ImageJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                claimed_until=now + timedelta(seconds=claim_seconds()),
+            )
+    return jobs
+
+
+def process_batch(limit=None, pool=None):
+    """
+    Render a batch of queued uploads; returns the number of jobs handled
+
+    Jobs are claimed in one short transaction, rendered (on ``pool`` when
+    given) and attached with no transaction open, then finished in a second
+    one: done jobs are deleted, failed ones released for a retry, and after
+    MAX_ATTEMPTS failures a job is marked failed and logged.
+    """
+    jobs = _claim(limit or batch_size())
+    if not jobs:
+        return 0
+
+    futures = {}
+    for job in jobs:
+        try:
+            data = read(job.source)
+        except (OSError, ValueError) as exc:
+            futures[job.pk] = exc
+            continue
+        futures[job.pk] = pool.submit(render, data) if pool else data
+
+    finished, retry, failed = [], [], []
+    for job in jobs:
+        outcome = futures[job.pk]
+        try:
+            if isinstance(outcome, Exception):
+                raise outcome
+            rendered = outcome.result() if pool else render(outcome)
+            apply(job.target, job.object_id, job.source, rendered)
+        except Exception as exc:
+            job.attempts += 1
+            job.last_error = f'{type(exc).__name__}: {exc}'[:500]
+            job.claimed_until = None
+            if job.attempts < MAX_ATTEMPTS:
+                retry.append(job)
+            else:
+                job.failed_at = timezone.now()
+                failed.append(job)
+                logger.error(
+                    'Giving up on renditions of %s %s (%s) after %s attempts: %s',
+                    job.target, job.object_id, job.source, job.attempts, job.last_error,
+                )
+            continue
+        finished.append(job.pk)
+
+    with transaction.atomic():
+        ImageJob.objects.filter(pk__in=finished).delete()
+        if retry or failed:
+            ImageJob.objects.bulk_update(retry + failed, ['attempts', 'last_error', 'claimed_until', 'failed_at'])
+    return len(jobs)
+
+
+def make_pool(workers=None):
+    workers = workers or worker_count()
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from social_media import query_plans
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN every registered hot query and fail if any falls back to a sequential scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Only check these queries (default: all)')
+        parser.add_argument('--database', default='default', help='Database alias to explain against')
+        parser.add_argument('--show-plans', action='store_true', help='Print every plan, not only failing ones')
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - set(query_plans.HOT_QUERIES)
+        if unknown:
+            raise CommandError(f'Unknown queries: {", ".join(sorted(unknown))}')
+        vendor = connections[options['database']].vendor
+        if vendor not in ('postgresql', 'sqlite'):
+            self.stdout.write(self.style.WARNING(f'No scan detection for {vendor}; plans are printed only'))
+
+        failed = []
+        for name, scanned, plan in query_plans.check(options['names'], options['database']):
+            if scanned:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'{name}: sequential scan of {", ".join(scanned)}'))
+            else:
+                self.stdout.write(f'{name}: ok')
+            if scanned or options['show_plans'] or vendor not in ('postgresql', 'sqlite'):
+                self.stdout.write(f'  {plan}'.replace('\n', '\n  '))
+        if failed:
+            raise CommandError(f'{len(failed)} hot queries scan whole tables: {", ".join(failed)}')
+        self.stdout.write(self.style.SUCCESS('Every hot query uses an index'))
@@ -0,0 +1,27 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from social_media import storage
+
+
+class Command(BaseCommand):
+    help = 'Delete content-addressed media blobs that are no longer referenced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=3600,
+                            help='Seconds a blob must have been unreferenced before it is removed')
+        parser.add_argument('--recount', action='store_true',
+                            help='Rebuild reference counts from posts, profiles and renditions first')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be removed')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, storage.ContentAddressedStorage):
+            raise CommandError('The default storage is not ContentAddressedStorage')
+
+        if options['recount']:
+            changed = storage.recount(dry_run=options['dry_run'])
+            self.stdout.write(f'Corrected {changed} reference counts')
+
+        removed, freed = storage.collect_garbage(default_storage, options['grace'], options['dry_run'])
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {removed} blobs ({freed / 1024 / 1024:.1f} MiB)'))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from social_media.synthetic import GraphGenerator
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic social graph (power-law followers, posts, comments, likes) in the local database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts-per-user', type=float, default=5.0, help='Mean posts per user')
+        parser.add_argument('--comments-per-post', type=float, default=2.0, help='Mean comments per post')
+        parser.add_argument('--likes-per-post', type=float, default=5.0, help='Mean likes per post')
+        parser.add_argument('--follows-per-user', type=float, default=20.0, help='Mean accounts followed per user')
+        parser.add_argument('--follow-alpha', type=float, default=1.2,
+                            help='Pareto shape of account popularity; lower means a heavier tail')
+        parser.add_argument('--max-follows', type=int, default=2000)
+        parser.add_argument('--days', type=int, default=30, help='Spread post timestamps over this many days')
+        parser.add_argument('--prefix', default='synth', help='Username prefix for generated accounts')
+        parser.add_argument('--password', default='benchmark')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--skip-timelines', action='store_true',
+                            help='Do not rebuild home timelines afterwards (run rebuild_timelines later)')
+
+    def handle(self, *args, **options):
+        generator = GraphGenerator(
+            users=options['users'],
+            posts_per_user=options['posts_per_user'],
+            comments_per_post=options['comments_per_post'],
+            likes_per_post=options['likes_per_post'],
+            follows_per_user=options['follows_per_user'],
+            follow_alpha=options['follow_alpha'],
+            max_follows=options['max_follows'],
+            days=options['days'],
+            prefix=options['prefix'],
+            password=options['password'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        summary = generator.run(rebuild_timelines=not options['skip_timelines'])
+        self.stdout.write(self.style.SUCCESS(
+            'Generated graph: ' + ', '.join(f'{count} {name}' for name, count in summary.items())
+        ))
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from social_media import metrics
+
+
+class Command(BaseCommand):
+    help = 'Print p50/p95/p99 latency, DB time, serializer time and query counts per view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Emit the raw report as JSON')
+        parser.add_argument('--reset', action='store_true', help='Delete the collected snapshots after reporting')
+
+    def handle(self, *args, **options):
+        report = metrics.report(include_snapshots=True)
+        database = metrics.database_report(include_snapshots=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps({'views': report, 'database': database}, indent=2))
+        elif not report:
+            self.stdout.write('No metrics recorded yet.')
+        else:
+            header = f"{'view':<28} {'series':<14} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>9}"
+            self.stdout.write(header)
+            self.stdout.write('-' * len(header))
+            for view_name, series in report.items():
+                for name, summary in series.items():
+                    self.stdout.write(
+                        f"{view_name:<28} {name:<14} {summary['count']:>7} "
+                        f"{_fmt(summary['p50']):>8} {_fmt(summary['p95']):>8} {_fmt(summary['p99']):>8} "
+                        f"{_fmt(summary['max']):>9}"
+                    )
+
+        if database and not options['json']:
+            self.stdout.write('')
+            for alias, stats in database.items():
+                figures = ', '.join(f'{key}={value}' for key, value in sorted(stats.items()))
+                self.stdout.write(f'database {alias}: {figures}')
+
+        if options['reset']:
+            metrics.clear_snapshots()
+            self.stdout.write(self.style.SUCCESS('Snapshots cleared'))
+
+
+def _fmt(value):
+    return '-' if value is None else f'{value:g}'
@@ -0,0 +1,44 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from social_media import images
+
+
+class Command(BaseCommand):
+    help = 'Render queued post images and profile pictures into their renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Rendering processes (default: IMAGE_RENDITIONS_WORKERS or the CPU count)')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        pool = images.make_pool(options['workers'])
+        total = 0
+        try:
+            while self.running:
+                jobs = images.process_batch(options['batch_size'], pool)
+                total += jobs
+                if jobs:
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'Processed {jobs} images')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} images'))
+
+    def _stop(self, signum, frame):
+        self.running = False
@@ -0,0 +1,49 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from social_media import notifications
+
+
+class Command(BaseCommand):
+    help = 'Drain queued notification events and new-post fan-out jobs into Notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        total_events = total_created = 0
+        while self.running:
+            events, created = notifications.process_batch(options['batch_size'])
+            total_events += events
+            total_created += created
+            if events and options['verbosity'] > 1:
+                self.stdout.write(f'Processed {events} events, created {created} notifications')
+
+            job, notified = notifications.process_fanout_chunk()
+            total_created += notified
+            if job is not None and options['verbosity'] > 1:
+                self.stdout.write(
+                    f'Fan-out of post {job.post_id}: {job.delivered}/{job.total_followers} followers'
+                    + (' (done)' if job.completed_at else '')
+                )
+
+            if events or job is not None:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {total_events} events, created {total_created} notifications'
+        ))
+
+    def _stop(self, signum, frame):
+        self.running = False
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from social_media import post_search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild hashtag links and the post search index from post text'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = post_search.rebuild(batch_size=options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} posts'))
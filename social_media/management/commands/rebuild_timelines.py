@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from social_media import timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuild precomputed home timelines from the follow graph'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only rebuild these users (default: everyone)')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        total = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            timeline.rebuild(user_id)
+            total += 1
+            if total % 1000 == 0:
+                self.stdout.write(f'Rebuilt {total} timelines...')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} timelines'))
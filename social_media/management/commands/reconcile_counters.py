@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from social_media import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized like/comment/follow counters that have drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows have drifted')
+
+    def handle(self, *args, **options):
+        report = counters.reconcile(dry_run=options['dry_run'])
+        verb = 'drifted' if options['dry_run'] else 'repaired'
+        for label, rows in report.items():
+            self.stdout.write(f'{label}: {rows} {verb}')
+        self.stdout.write(self.style.SUCCESS(f'{sum(report.values())} rows {verb}'))
@@ -0,0 +1,76 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from social_media.benchmark import SCENARIOS, Benchmark, HttpBenchmark, compare
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the views and API endpoints through the Django test client, '
+        'or over HTTP against a running server with --url'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--sample-users', type=int, default=50, help='Distinct users to act as')
+        parser.add_argument('--prefix', default=None, help='Only act as users whose username starts with this')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            choices=[scenario.name for scenario in SCENARIOS], help='Run only these scenarios')
+        parser.add_argument('--include-writes', action='store_true',
+                            help='Also run the like, follow and create-post scenarios (likes and follows are '
+                                 'undone right after, created posts deleted when the scenario ends)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--label', default=None, help='Free-form label stored with the results, e.g. a commit')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Baseline JSON file from an earlier run')
+        parser.add_argument('--url', help='Send requests to the server at this base URL instead, e.g. '
+                                          'gunicorn social_media_project.wsgi against an ASGI server')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once with --url')
+
+    def handle(self, *args, **options):
+        kwargs = {}
+        benchmark_class = Benchmark
+        if options['url']:
+            benchmark_class = HttpBenchmark
+            kwargs = {'base_url': options['url'], 'concurrency': options['concurrency']}
+        try:
+            benchmark = benchmark_class(
+                **kwargs,
+                requests=options['requests'],
+                sample_users=options['sample_users'],
+                warmup=options['warmup'],
+                include_writes=options['include_writes'],
+                only=options['scenarios'],
+                seed=options['seed'],
+                prefix=options['prefix'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{'scenario':<18} {'reqs':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8}")
+        results = benchmark.run(log=self._log)
+        results['label'] = options['label']
+
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(results, handle, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as handle:
+                baseline = json.load(handle)
+            self.stdout.write(f"\nCompared with {baseline.get('label') or options['compare']}:")
+            for name, changes in compare(results, baseline).items():
+                parts = []
+                for key, (old, new, change) in changes.items():
+                    parts.append(f'{key} {old} -> {new}' + (f' ({change:+}%)' if change is not None else ''))
+                self.stdout.write(f'{name:<18} ' + ', '.join(parts))
+
+    def _log(self, name, result):
+        self.stdout.write(
+            f"{name:<18} {result['requests']:>6} {result['throughput_rps'] or 0:>8} "
+            f"{result['p50_ms'] or 0:>8} {result['p95_ms'] or 0:>8} {result['p99_ms'] or 0:>8} "
+            f"{result['mean_queries'] or 0:>8}"
+        )
@@ -0,0 +1,371 @@
+# social_media/metrics.py
+"""
+Per-endpoint request metrics.
+
+QueryMetricsMiddleware records query count, DB time, serializer time and
+total latency for every request, keyed by URL name, into fixed-bucket
+histograms held in process memory.  Each process periodically writes its
+histograms to METRICS_SNAPSHOT_DIR so the ``metrics_report`` command can merge
+them across gunicorn workers; fixed buckets make merging a plain sum.  The
+directory defaults to one under the system temp directory keyed by the
+default database, so projects sharing a machine do not read each other's
+snapshots, and snapshots of processes that have exited are removed as they
+are read.
+
+Snapshots also carry each process's database connection figures: psycopg
+pool statistics (checkouts, waits, wait time, pool size) when pooling is
+on, otherwise how many connections the process had to open.  Summed across
+processes they show how many connections the deployment holds against the
+database's limit.
+"""
+import bisect
+import contextvars
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+# Upper bounds; the last bucket is open-ended
+MS_BUCKETS = [0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 2000, 5000, 10000]
+COUNT_BUCKETS = [0, 1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20, 25, 30, 40, 50, 75, 100, 150, 200, 500, 1000]
+
+SERIES = {
+    'latency_ms': MS_BUCKETS,
+    'db_ms': MS_BUCKETS,
+    'serializer_ms': MS_BUCKETS,
+    'queries': COUNT_BUCKETS,
+}
+PERCENTILES = (50, 95, 99)
+
+
+class Histogram:
+    def __init__(self, bounds, counts=None, total=0.0, maximum=0.0):
+        self.bounds = bounds
+        self.counts = counts or [0] * (len(bounds) + 1)
+        self.total = total
+        self.maximum = maximum
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def percentile(self, pct):
+        """
+        Upper bound of the bucket holding the ``pct``-th percentile, capped
+        at the largest observed value
+        """
+        count = self.count
+        if not count:
+            return None
+        rank = pct / 100 * count
+        seen = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= rank:
+                return min(self.bounds[index], self.maximum) if index < len(self.bounds) else self.maximum
+        return self.maximum
+
+    def to_dict(self):
+        return {'counts': self.counts, 'total': self.total, 'max': self.maximum}
+
+    @classmethod
+    def from_dict(cls, bounds, data):
+        return cls(bounds, list(data['counts']), data['total'], data['max'])
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.serializer_ms = 0.0
+        self.serializer_depth = 0
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+_lock = threading.Lock()
+_histograms = {}
+_connections_opened = Counter()
+_last_flush = time.monotonic()
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def start_request():
+    record = RequestMetrics()
+    return record, _current.set(record)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """
+    ``connection.execute_wrapper`` hook counting queries and DB time
+    """
+    record = _current.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record.queries += 1
+        record.db_ms += (time.perf_counter() - start) * 1000
+
+
+def instrument(connection):
+    """
+    Install ``query_wrapper`` on ``connection`` for good
+
+    Installed when the connection opens rather than per request, because
+    async views run their queries on ``sync_to_async`` threads with their own
+    connections; the wrapper finds the request through the context variable,
+    which those threads inherit.
+    """
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+@contextmanager
+def serializer_timer():
+    """
+    Time serialization, counting only the outermost serializer of a nesting
+    """
+    record = _current.get()
+    if record is None:
+        yield
+        return
+    record.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.serializer_depth -= 1
+        if record.serializer_depth == 0:
+            record.serializer_ms += (time.perf_counter() - start) * 1000
+
+
+def observe(view_name, record, latency_ms):
+    values = {
+        'latency_ms': latency_ms,
+        'db_ms': record.db_ms,
+        'serializer_ms': record.serializer_ms,
+        'queries': record.queries,
+    }
+    with _lock:
+        series = _histograms.get(view_name)
+        if series is None:
+            series = _histograms[view_name] = {name: Histogram(bounds) for name, bounds in SERIES.items()}
+        for name, value in values.items():
+            series[name].observe(value)
+    _maybe_flush()
+
+
+def connection_opened(alias):
+    with _lock:
+        _connections_opened[alias] += 1
+
+
+def database_stats():
+    """
+    ``{alias: {...}}`` for this process: checkouts and the psycopg pool's
+    statistics when the alias is pooled, else the connections opened so far
+    """
+    stats = {}
+    for connection in connections.all(initialized_only=True):
+        pool = getattr(connection, 'pool', None)
+        entry = {
+            'pooled': pool is not None,
+            'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE'),
+            # Django connects on every checkout from a pool
+            'checkouts' if pool is not None else 'connections_opened': _connections_opened[connection.alias],
+        }
+        if pool is not None:
+            entry.update(pool.get_stats())
+        stats[connection.alias] = entry
+    return stats
+
+
+def state_dir(name):
+    """
+    Default directory for the per-process files of ``name``: under the system
+    temp directory and keyed by the default database, so every process of
+    one deployment shares it and nothing else does
+    """
+    database = connections['default'].settings_dict
+    identity = '|'.join(str(database.get(key) or '') for key in ('ENGINE', 'HOST', 'PORT', 'NAME'))
+    digest = hashlib.sha256(identity.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'social_media_{name}-{digest}')
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _snapshot_dir():
+    return getattr(settings, 'METRICS_SNAPSHOT_DIR', None) or state_dir('metrics')
+
+
+def snapshot():
+    with _lock:
+        return {
+            view_name: {name: histogram.to_dict() for name, histogram in series.items()}
+            for view_name, series in _histograms.items()
+        }
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def flush():
+    """
+    Write this process's histograms to the shared snapshot directory
+    """
+    global _last_flush
+    _last_flush = time.monotonic()
+    directory = _snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as handle:
+        json.dump({'views': snapshot(), 'database': database_stats()}, handle)
+    os.replace(tmp_path, path)
+
+
+def _maybe_flush():
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 30)
+    if interval is not None and time.monotonic() - _last_flush >= interval:
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _merge_into(merged, data):
+    for view_name, series in data.items():
+        target = merged.setdefault(view_name, {name: Histogram(bounds) for name, bounds in SERIES.items()})
+        for name, bounds in SERIES.items():
+            if name in series:
+                target[name].merge(Histogram.from_dict(bounds, series[name]))
+
+
+def _read_snapshots():
+    """
+    Every other live process's snapshot; those of exited processes are
+    removed
+    """
+    directory = _snapshot_dir()
+    own_path = os.path.join(directory, f'{os.getpid()}.json')
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        name, extension = os.path.splitext(filename)
+        if extension != '.json' or path == own_path:
+            continue
+        if name.isdigit() and not process_alive(int(name)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            continue
+        # Older snapshots hold the views only
+        yield data if 'views' in data else {'views': data, 'database': {}}
+
+
+def collect(include_snapshots=False):
+    """
+    Return ``{view_name: {series: Histogram}}`` for this process, optionally
+    merged with the snapshots written by every other process
+    """
+    merged = {}
+    if include_snapshots:
+        for data in _read_snapshots():
+            _merge_into(merged, data['views'])
+    _merge_into(merged, snapshot())
+    return merged
+
+
+def database_report(include_snapshots=False):
+    """
+    Connection figures per alias summed over processes, plus ``processes``
+    and, for pools, ``mean_wait_ms`` per checkout
+    """
+    per_process = [database_stats()]
+    if include_snapshots:
+        per_process += [data['database'] for data in _read_snapshots()]
+    result = {}
+    for stats in per_process:
+        for alias, entry in stats.items():
+            total = result.setdefault(alias, {'processes': 0})
+            total['processes'] += 1
+            for key, value in entry.items():
+                if key in ('pooled', 'conn_max_age') or not isinstance(value, (int, float)):
+                    total.setdefault(key, value)
+                else:
+                    total[key] = total.get(key, 0) + value
+    for total in result.values():
+        if total.get('requests_num'):
+            total['mean_wait_ms'] = round(total.get('requests_wait_ms', 0) / total['requests_num'], 3)
+    return result
+
+
+def clear_snapshots():
+    directory = _snapshot_dir()
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                os.remove(os.path.join(directory, filename))
+
+
+def report(include_snapshots=False):
+    """
+    Summarize histograms as ``{view_name: {series: {count, mean, p50, ...}}}``
+    """
+    result = {}
+    for view_name, series in sorted(collect(include_snapshots).items()):
+        result[view_name] = {}
+        for name, histogram in series.items():
+            count = histogram.count
+            summary = {
+                'count': count,
+                'mean': round(histogram.total / count, 3) if count else None,
+                'max': round(histogram.maximum, 3),
+            }
+            for pct in PERCENTILES:
+                summary[f'p{pct}'] = histogram.percentile(pct)
+            result[view_name][name] = summary
+    return result
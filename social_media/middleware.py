@@ -0,0 +1,55 @@
+# social_media/middleware.py
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+
+
+class QueryMetricsMiddleware:
+    """
+    Record query count, DB time, serializer time and latency per URL name
+
+    Queries are counted by the wrapper ``metrics.instrument`` installs on
+    every connection.
+    """
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not metrics.enabled():
+            return self.get_response(request)
+
+        record, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self._observe(request, record, start)
+        return response
+
+    async def __acall__(self, request):
+        if not metrics.enabled():
+            return await self.get_response(request)
+
+        record, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self._observe(request, record, start)
+        return response
+
+    def _observe(self, request, record, start):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match and match.view_name else 'unresolved'
+        metrics.observe(view_name, record, (time.perf_counter() - start) * 1000)
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.2 on 2026-10-18 02:42
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, group_field, outer_field='pk'):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{group_field: OuterRef(outer_field)})
+            .order_by()
+            .values(group_field)
+            .annotate(total=Count('*'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('social_media', 'Post')
+    Comment = apps.get_model('social_media', 'Comment')
+    Profile = apps.get_model('social_media', 'Profile')
+    Post.objects.update(
+        likes_count=_count(Post.likes.through.objects.all(), 'post_id'),
+        comments_count=_count(Comment.objects.all(), 'post_id'),
+    )
+    Comment.objects.update(likes_count=_count(Comment.likes.through.objects.all(), 'comment_id'))
+    Profile.objects.update(
+        followers_count=_count(Profile.followers.through.objects.all(), 'profile_id'),
+        following_count=_count(Profile.followers.through.objects.all(), 'user_id', 'user_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_media', '0002_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
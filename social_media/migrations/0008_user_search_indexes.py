@@ -0,0 +1,44 @@
+from django.db import migrations
+
+# auth_user belongs to django.contrib.auth, so these expression indexes are
+# created with raw SQL rather than Meta.indexes.  PostgreSQL only: other
+# databases use the in-process index in social_media/search.py.
+CREATE_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS user_username_trgm_idx ON auth_user '
+    'USING gin (lower(username) gin_trgm_ops)',
+    # search.FullName compiles to exactly this expression; keep them in step
+    "CREATE INDEX IF NOT EXISTS user_full_name_trgm_idx ON auth_user "
+    "USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)",
+    'CREATE INDEX IF NOT EXISTS user_username_prefix_idx ON auth_user (lower(username) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS user_first_name_prefix_idx ON auth_user (lower(first_name) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS user_last_name_prefix_idx ON auth_user (lower(last_name) text_pattern_ops)',
+]
+DROP_INDEXES = [
+    'DROP INDEX IF EXISTS user_username_trgm_idx',
+    'DROP INDEX IF EXISTS user_full_name_trgm_idx',
+    'DROP INDEX IF EXISTS user_username_prefix_idx',
+    'DROP INDEX IF EXISTS user_first_name_prefix_idx',
+    'DROP INDEX IF EXISTS user_last_name_prefix_idx',
+]
+
+
+def _run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_media', '0007_notification_inbox_index'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE_INDEXES), _run(DROP_INDEXES)),
+    ]
@@ -0,0 +1,52 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+# The auto-created Profile.followers table becomes the Follow model without
+# touching its rows; created_at and the graph indexes are then added to it.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_media', '0011_media_blob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Follow',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follower_edges', to='social_media.profile')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='following_edges', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'social_media_profile_followers',
+                        'unique_together': {('profile', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='profile',
+                    name='followers',
+                    field=models.ManyToManyField(blank=True, related_name='following', through='social_media.Follow', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['user', 'profile'], name='follow_following_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['profile', '-created_at'], name='follow_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.2 on 2026-10-18 03:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+# The likes tables are auto-created for Post.likes and Comment.likes, so
+# their (user, target) indexes for "which of these did I like" are raw SQL.
+LIKE_INDEXES = [
+    ('post_like_user_idx', 'social_media_post_likes', 'user_id, post_id'),
+    ('comment_like_user_idx', 'social_media_comment_likes', 'user_id, comment_id'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_media', '0012_follow_edges'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fanoutjob',
+            index=models.Index(condition=models.Q(('completed_at__isnull', True)), fields=['id'], name='fanout_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-created_at', '-id'], name='notif_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'sender', 'notification_type'], name='notif_dedupe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['recipient', 'notification_type', 'group_started_at'], name='notif_open_group_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='post_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['followers_count'], name='profile_followers_count_idx'),
+        ),
+    ] + [
+        migrations.RunSQL(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})',
+            f'DROP INDEX IF EXISTS {name}',
+        )
+        for name, table, columns in LIKE_INDEXES
+    ]
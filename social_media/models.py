@@ -1,84 +1,172 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from PIL import Image
-import os
 
-class Profile(models.Model):
+class CounterFieldsMixin:
+    """
+    Denormalized counters are only ever written with atomic F() updates from
+    signals.py, and ``derived_fields`` only by background workers, so a plain
+    save() must not write back a stale in-memory value
+    """
+    counter_fields = ()
+    derived_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            skipped = set(self.counter_fields) | set(self.derived_fields)
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+class TrackedFieldsMixin:
+    """
+    Remember the stored values of ``tracked_fields`` as rows are loaded and
+    saved, so receivers can see what a save changed without re-reading the row
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if name in cls.tracked_fields
+        }
+        return instance
+
+    def _current_value(self, name):
+        value = getattr(self, name)
+        # FieldFile -> the stored name
+        return getattr(value, 'name', value)
+
+    def is_tracked(self, name):
+        return name in getattr(self, '_loaded_values', {})
+
+    def loaded_value(self, name):
+        return getattr(self, '_loaded_values', {}).get(name)
+
+    def _reset_tracking(self, names=None):
+        names = self.tracked_fields if names is None else [name for name in self.tracked_fields if name in names]
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{name: self._current_value(name) for name in names},
+        }
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._reset_tracking()
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        self._reset_tracking(fields)
+
+class Profile(TrackedFieldsMixin, CounterFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(max_length=500, blank=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', default='profile_pics/default.jpg')
-    followers = models.ManyToManyField(User, related_name='following', blank=True)
+    # Written by the image worker, see images.py
+    picture_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    followers = models.ManyToManyField(User, through='Follow', related_name='following', blank=True)
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+    following_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    counter_fields = ('followers_count', 'following_count')
+    derived_fields = ('picture_renditions',)
+    tracked_fields = ('profile_picture',)
+
+    class Meta:
+        indexes = [
+            # Pull-mode (high-follower) accounts for the hybrid timeline
+            models.Index(fields=['followers_count'], name='profile_followers_count_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if self.profile_picture:
-            img = Image.open(self.profile_picture.path)
-            if img.height > 300 or img.width > 300:
-                output_size = (300, 300)
-                img.thumbnail(output_size)
-                img.save(self.profile_picture.path)
+class Follow(models.Model):
+    """
+    A follow edge: ``user`` follows the owner of ``profile``
 
-    @property
-    def followers_count(self):
-        return self.followers.count()
+    The table behind Profile.followers (the auto-created through table it
+    replaced), so ``profile.followers`` and ``user.following`` keep working;
+    graph.py answers the graph questions.
+    """
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='follower_edges')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following_edges')
+    created_at = models.DateTimeField(default=timezone.now)
 
-    @property
-    def following_count(self):
-        return self.user.following.count()
+    class Meta:
+        db_table = 'social_media_profile_followers'
+        unique_together = [('profile', 'user')]
+        indexes = [
+            # Who a user follows, answered from the index alone
+            models.Index(fields=['user', 'profile'], name='follow_following_idx'),
+            models.Index(fields=['profile', '-created_at'], name='follow_recent_idx'),
+        ]
 
-class Post(models.Model):
+    def __str__(self):
+        return f"{self.user_id} follows profile {self.profile_id}"
+
+class Post(TrackedFieldsMixin, CounterFieldsMixin, models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField(max_length=2000)
     image = models.ImageField(upload_to='post_images/', blank=True, null=True)
+    # Written by the image worker, see images.py
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     hashtags = models.CharField(max_length=200, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('likes_count', 'comments_count')
+    derived_fields = ('image_renditions',)
+    tracked_fields = ('image',)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Profile pages, timeline backfill and pull-author merges
+            models.Index(fields=['author', '-created_at', '-id'], name='post_author_created_idx'),
+            # Keyset pages of /api/posts/
+            models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.author.username} - {self.content[:50]}..."
 
-    @property
-    def likes_count(self):
-        return self.likes.count()
-
-    @property
-    def comments_count(self):
-        return self.comments.count()
-
-class Comment(models.Model):
+class Comment(CounterFieldsMixin, models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField(max_length=500)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     likes = models.ManyToManyField(User, related_name='liked_comments', blank=True)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('likes_count',)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Comment lists and the latest-N comments embedded per post
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.author.username} - {self.content[:30]}..."
 
-    @property
-    def likes_count(self):
-        return self.likes.count()
-
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('like_post', 'Like Post'),
         ('like_comment', 'Like Comment'),
         ('comment', 'Comment'),
         ('follow', 'Follow'),
+        ('new_post', 'New Post'),
     ]
     
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
@@ -88,9 +176,205 @@ class Notification(models.Model):
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=timezone.now)
+    # Aggregated notifications: ``sender`` is the latest actor, ``created_at``
+    # the latest activity and ``recent_actors`` the newest actor ids first,
+    # capped for display; ``actors`` holds every actor id while the group
+    # is open so a repeat actor is never counted twice
+    actor_count = models.PositiveIntegerField(default=1)
+    recent_actors = models.JSONField(default=list, blank=True)
+    actors = models.JSONField(default=list, blank=True)
+    group_started_at = models.DateTimeField(default=timezone.now)
+
+    VERBS = {
+        'like_post': 'liked your post',
+        'like_comment': 'liked your comment',
+        'comment': 'commented on your post',
+        'follow': 'started following you',
+        'new_post': 'published a new post',
+    }
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'is_read', '-created_at'], name='notif_recipient_read_idx'),
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notif_inbox_idx'),
+            # Duplicate checks when delivering ungrouped notifications
+            models.Index(fields=['recipient', 'sender', 'notification_type'], name='notif_dedupe_idx'),
+            # Unread groups still open for aggregation
+            models.Index(
+                fields=['recipient', 'notification_type', 'group_started_at'], condition=models.Q(is_read=False),
+                name='notif_open_group_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.sender.username} {self.notification_type} - {self.recipient.username}"
+
+    @property
+    def summary(self):
+        """
+        "alice and 41 others liked your post"
+        """
+        verb = self.VERBS.get(self.notification_type, self.notification_type)
+        others = self.actor_count - 1
+        if others <= 0:
+            return f"{self.sender.username} {verb}"
+        return f"{self.sender.username} and {others} other{'s' if others > 1 else ''} {verb}"
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at', '-post']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-post'], name='timeline_owner_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.owner.username} <- post {self.post_id}"
+
+class NotificationEvent(models.Model):
+    """
+    A queued notification, turned into a Notification by the
+    process_notifications worker (see notifications.py)
+    """
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"queued {self.notification_type} {self.sender_id} -> {self.recipient_id}"
+
+class FanoutJob(models.Model):
+    """
+    Resumable new-post notification fan-out; ``last_follower_id`` is the
+    keyset cursor of the last committed chunk
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='fanout_job')
+    total_followers = models.PositiveIntegerField(default=0)
+    delivered = models.PositiveIntegerField(default=0)
+    last_follower_id = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(completed_at__isnull=True), name='fanout_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"fan-out of post {self.post_id}: {self.delivered}/{self.total_followers}"
+
+class Hashtag(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return f"#{self.name}"
+
+class PostHashtag(models.Model):
+    """
+    A post under a hashtag; ``created_at`` is copied from the post so tag
+    feeds page through ``hashtag_feed_idx`` alone
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='hashtag_links')
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='post_links')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at', '-post']
+        constraints = [
+            models.UniqueConstraint(fields=['hashtag', 'post'], name='unique_post_hashtag'),
+        ]
+        indexes = [
+            models.Index(fields=['hashtag', '-created_at', '-post'], name='hashtag_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.hashtag_id} <- post {self.post_id}"
+
+class PostTerm(models.Model):
+    """
+    Inverted index posting: ``term`` appears ``frequency`` times in a post
+    (see post_search.py)
+    """
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    frequency = models.PositiveSmallIntegerField(default=1)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['term', '-created_at', '-post']
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'post'], name='unique_post_term'),
+        ]
+        indexes = [
+            models.Index(fields=['term', '-created_at', '-post'], name='post_term_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> post {self.post_id}"
+
+class ImageJob(models.Model):
+    """
+    An uploaded image waiting for the process_images worker to render its
+    renditions (see images.py)
+    """
+    TARGETS = [
+        ('post', 'Post image'),
+        ('profile', 'Profile picture'),
+    ]
+
+    target = models.CharField(max_length=10, choices=TARGETS)
+    object_id = models.PositiveBigIntegerField()
+    source = models.CharField(max_length=255)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Set while a worker renders the job; a lapsed claim is picked up again
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    # Set once the job has failed MAX_ATTEMPTS times; it is kept for inspection
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['target', 'object_id', 'source'], name='unique_image_job'),
+        ]
+
+    def __str__(self):
+        return f"render {self.target} {self.object_id}: {self.source}"
+
+class MediaBlob(models.Model):
+    """
+    A content-addressed media file and how many fields and renditions use
+    it (see storage.py); unreferenced blobs are removed by gc_media
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    released_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['ref_count', 'released_at'], name='media_blob_gc_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
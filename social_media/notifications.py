@@ -0,0 +1,331 @@
+# social_media/notifications.py
+"""
+Queued notification pipeline.
+
+Signal receivers only record a NotificationEvent row (one bulk INSERT per
+signal); the ``process_notifications`` worker drains the queue in batches,
+drops duplicates against each other and against existing notifications with
+a single query, and writes the survivors with one bulk_create.  Likes,
+comments and follows are aggregated into one row per recipient and target
+("alice and 41 others liked your post"), so inbox size grows with the number
+of groups rather than the number of events.  With
+NOTIFICATIONS_ASYNC = False events are delivered inline instead, which is
+what tests and single-process development setups want.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import routers, streaming, timeline
+from .models import FanoutJob, Notification, NotificationEvent, Profile
+
+logger = logging.getLogger(__name__)
+
+AGGREGATED_TYPES = ('like_post', 'like_comment', 'comment', 'follow')
+
+
+def is_async():
+    return getattr(settings, 'NOTIFICATIONS_ASYNC', True)
+
+
+def batch_size():
+    return getattr(settings, 'NOTIFICATIONS_BATCH_SIZE', 500)
+
+
+def fanout_chunk_size():
+    return getattr(settings, 'NOTIFICATIONS_FANOUT_CHUNK_SIZE', 1000)
+
+
+def aggregation_enabled():
+    return getattr(settings, 'NOTIFICATION_AGGREGATION', True)
+
+
+def aggregation_window():
+    return timedelta(seconds=getattr(settings, 'NOTIFICATION_AGGREGATION_WINDOW', 6 * 60 * 60))
+
+
+def recent_actors_limit():
+    return getattr(settings, 'NOTIFICATION_RECENT_ACTORS', 10)
+
+
+def event_key(event):
+    return (event.recipient_id, event.sender_id, event.notification_type, event.post_id, event.comment_id)
+
+
+def enqueue(events):
+    """
+    Queue (or, in synchronous mode, deliver) unsaved NotificationEvents
+    """
+    events = [event for event in events if event.recipient_id != event.sender_id]
+    if not events:
+        return
+    if is_async():
+        NotificationEvent.objects.bulk_create(events, batch_size=batch_size())
+    else:
+        deliver(events)
+
+
+def deliver(events):
+    """
+    Turn events into Notifications; returns the number of rows created
+
+    Likes, comments and follows are folded into one aggregated row per
+    recipient, type and target while that row is unread and younger than
+    NOTIFICATION_AGGREGATION_WINDOW; other types get a row per event,
+    skipping exact duplicates.
+    """
+    events = [event for event in events if event.recipient_id != event.sender_id]
+    grouped, single = [], []
+    for event in events:
+        if aggregation_enabled() and event.notification_type in AGGREGATED_TYPES:
+            grouped.append(event)
+        else:
+            single.append(event)
+    with transaction.atomic():
+        return _deliver_single(single) + _deliver_grouped(grouped)
+
+
+def _deliver_single(events):
+    pending = {}
+    for event in events:
+        pending.setdefault(event_key(event), event)
+    if not pending:
+        return 0
+
+    existing = Notification.objects.filter(
+        recipient_id__in={key[0] for key in pending},
+        sender_id__in={key[1] for key in pending},
+        notification_type__in={key[2] for key in pending},
+    ).values_list('recipient_id', 'sender_id', 'notification_type', 'post_id', 'comment_id')
+    for key in existing:
+        pending.pop(key, None)
+
+    notifications = [
+        Notification(
+            recipient_id=event.recipient_id,
+            sender_id=event.sender_id,
+            notification_type=event.notification_type,
+            post_id=event.post_id,
+            comment_id=event.comment_id,
+            created_at=event.created_at,
+            recent_actors=[event.sender_id],
+        )
+        for event in pending.values()
+    ]
+    Notification.objects.bulk_create(notifications, batch_size=batch_size())
+    invalidate_inboxes({notification.recipient_id for notification in notifications})
+    return len(notifications)
+
+
+def group_key(item):
+    """
+    Aggregation key of an event or notification: comments group per post
+    """
+    if item.notification_type == 'comment':
+        return (item.recipient_id, item.notification_type, item.post_id, None)
+    return (item.recipient_id, item.notification_type, item.post_id, item.comment_id)
+
+
+def _deliver_grouped(events):
+    if not events:
+        return 0
+    by_group = {}
+    for event in sorted(events, key=lambda event: event.created_at):
+        by_group.setdefault(group_key(event), []).append(event)
+
+    # Open groups are locked so concurrent workers add to, not overwrite, them
+    open_groups = {}
+    for notification in (
+        Notification.objects.select_for_update()
+        .filter(
+            recipient_id__in={key[0] for key in by_group},
+            notification_type__in={key[1] for key in by_group},
+            is_read=False,
+            group_started_at__gte=timezone.now() - aggregation_window(),
+        )
+        .order_by('created_at')
+    ):
+        open_groups[group_key(notification)] = notification
+
+    to_create, to_update = [], []
+    for key, group_events in by_group.items():
+        group = open_groups.get(key)
+        known = set(group.actors or group.recent_actors or [group.sender_id]) if group else set()
+        fresh = []
+        for event in group_events:
+            if event.sender_id not in known:
+                known.add(event.sender_id)
+                fresh.append(event)
+        if not fresh:
+            continue
+
+        latest = fresh[-1]
+        newest_first = [event.sender_id for event in reversed(fresh)]
+        if group is None:
+            to_create.append(Notification(
+                recipient_id=latest.recipient_id,
+                sender_id=latest.sender_id,
+                notification_type=latest.notification_type,
+                post_id=latest.post_id,
+                comment_id=latest.comment_id,
+                created_at=latest.created_at,
+                actor_count=len(fresh),
+                recent_actors=newest_first[:recent_actors_limit()],
+                actors=newest_first,
+                group_started_at=timezone.now(),
+            ))
+        else:
+            group.actor_count += len(fresh)
+            group.recent_actors = (newest_first + list(group.recent_actors or [group.sender_id]))[:recent_actors_limit()]
+            group.actors = newest_first + list(group.actors or known.difference(newest_first))
+            group.sender_id = latest.sender_id
+            group.comment_id = latest.comment_id
+            group.created_at = latest.created_at
+            to_update.append(group)
+
+    Notification.objects.bulk_create(to_create, batch_size=batch_size())
+    Notification.objects.bulk_update(
+        to_update, ['actor_count', 'recent_actors', 'actors', 'sender', 'comment', 'created_at'],
+        batch_size=batch_size(),
+    )
+    invalidate_inboxes({notification.recipient_id for notification in to_create + to_update})
+    return len(to_create)
+
+
+def inbox_cache_key(user_id):
+    return f'user_notifications_{user_id}'
+
+
+def unread_count_cache_key(user_id):
+    return f'unread_notifications_count_{user_id}'
+
+
+def cache_timeout():
+    return getattr(settings, 'NOTIFICATIONS_CACHE_TIMEOUT', 300)
+
+
+def invalidate_inboxes(user_ids):
+    """
+    Drop the cached inboxes of ``user_ids`` and tell their open streams once
+    the change commits
+
+    Deleting earlier would let a request that reads the inbox before the
+    commit cache the old rows again.
+    """
+    keys = []
+    for user_id in user_ids:
+        keys += [inbox_cache_key(user_id), unread_count_cache_key(user_id)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+        streaming.publish_inboxes(user_ids)
+
+
+def unread_count(user):
+    """
+    Read-through cached count of unread notifications
+    """
+    key = unread_count_cache_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        with routers.primary():
+            count = Notification.objects.filter(recipient=user, is_read=False).count()
+        cache.set(key, count, cache_timeout())
+    return count
+
+
+def mark_read(user, ids=None):
+    """
+    Mark ``user``'s unread notifications (optionally only ``ids``) read with
+    a single UPDATE; returns the number of rows changed
+    """
+    unread = Notification.objects.filter(recipient=user, is_read=False)
+    if ids is not None:
+        unread = unread.filter(pk__in=ids)
+    updated = unread.update(is_read=True)
+    if updated:
+        invalidate_inboxes([user.pk])
+    return updated
+
+
+def process_batch(limit=None):
+    """
+    Deliver up to ``limit`` queued events; returns ``(events, notifications)``
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED where the
+    database supports it, so several workers can drain the queue at once.
+    """
+    limit = limit or batch_size()
+    with transaction.atomic():
+        events = list(NotificationEvent.objects.select_for_update(skip_locked=True).order_by('id')[:limit])
+        if not events:
+            return 0, 0
+        created = deliver(events)
+        NotificationEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+    return len(events), created
+
+
+def start_fanout(post):
+    """
+    Record a new-post fan-out job; in synchronous mode run it to completion
+    """
+    total = Profile.objects.filter(user_id=post.author_id).values_list('followers_count', flat=True).first() or 0
+    job = FanoutJob.objects.create(post=post, total_followers=total)
+    if not is_async():
+        while run_fanout_chunk(job):
+            pass
+    return job
+
+
+def run_fanout_chunk(job):
+    """
+    Deliver the next chunk of ``job``; returns the number of followers notified
+
+    The notifications and the advanced cursor are committed together, so an
+    interrupted fan-out resumes after the last complete chunk without gaps
+    or duplicates.
+    """
+    post = job.post
+    chunk = next(timeline.follower_id_chunks(post.author_id, fanout_chunk_size(), after=job.last_follower_id), [])
+    with transaction.atomic():
+        if chunk:
+            Notification.objects.bulk_create(
+                [
+                    Notification(recipient_id=follower_id, sender_id=post.author_id,
+                                 notification_type='new_post', post_id=post.pk, created_at=post.created_at,
+                                 recent_actors=[post.author_id])
+                    for follower_id in chunk if follower_id != post.author_id
+                ],
+                batch_size=batch_size(),
+            )
+            job.last_follower_id = chunk[-1]
+            job.delivered += len(chunk)
+        else:
+            job.completed_at = timezone.now()
+        job.save(update_fields=['last_follower_id', 'delivered', 'completed_at'])
+    if chunk:
+        invalidate_inboxes(chunk)
+        logger.info('Fan-out of post %s: %s/%s followers', post.pk, job.delivered, job.total_followers)
+    return len(chunk)
+
+
+def process_fanout_chunk():
+    """
+    Advance the oldest unfinished fan-out job by one chunk
+
+    Returns ``(job, followers_notified)``, or ``(None, 0)`` when idle.
+    """
+    with transaction.atomic():
+        job = (
+            FanoutJob.objects.select_for_update(skip_locked=True)
+            .select_related('post')
+            .filter(completed_at__isnull=True)
+            .order_by('id')
+            .first()
+        )
+        if job is None:
+            return None, 0
+        return job, run_fanout_chunk(job)
@@ -0,0 +1,204 @@
+# social_media/pagination.py
+"""
+Keyset (cursor) pagination on ``(created_at, id)``.
+
+Pages are fetched with ``WHERE (created_at, id) < (:key)`` plus ``LIMIT``
+instead of ``COUNT(*)`` and ``OFFSET``, so every page costs the same no matter
+how deep the reader is.  Cursors are opaque url-safe tokens shared by the HTML
+feed and the DRF list endpoints.
+"""
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk, direction=NEXT):
+    payload = json.dumps([created_at.isoformat(), pk, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Return ``((created_at, pk), direction)`` for a cursor token
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, pk, direction = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(token)
+    if created_at is None or direction not in (NEXT, PREVIOUS):
+        raise InvalidCursor(token)
+    return (created_at, pk), direction
+
+
+def keyset_filter(queryset, key=None, direction=NEXT, descending=True,
+                  created_field='created_at', pk_field='id'):
+    """
+    Restrict and order ``queryset`` to the rows after ``key`` in ``direction``
+
+    Rows come back in fetch order: for a PREVIOUS page that is the reverse
+    of display order, so callers flip the slice afterwards.
+    """
+    forward = direction == NEXT
+    newest_first = descending == forward
+    if key is not None:
+        created_at, pk = key
+        op = 'lt' if newest_first else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{created_field}__{op}': created_at})
+            | Q(**{created_field: created_at, f'{pk_field}__{op}': pk})
+        )
+    if newest_first:
+        return queryset.order_by(f'-{created_field}', f'-{pk_field}')
+    return queryset.order_by(created_field, pk_field)
+
+
+class KeysetPage:
+    """
+    A page of rows plus the cursors for its neighbours
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def build_page(rows, page_size, key, direction, row_key):
+    """
+    Turn ``page_size + 1`` fetched rows into a KeysetPage
+
+    ``row_key`` maps a row to its ``(created_at, pk)`` pair.
+    """
+    has_more = len(rows) > page_size
+    rows = list(rows[:page_size])
+    if direction == PREVIOUS:
+        rows.reverse()
+
+    if direction == NEXT:
+        has_next, has_previous = has_more, key is not None
+    else:
+        has_next, has_previous = key is not None, has_more
+
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(*row_key(rows[-1]), NEXT)
+    if rows and has_previous:
+        previous_cursor = encode_cursor(*row_key(rows[0]), PREVIOUS)
+    return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+def paginate(queryset, cursor=None, page_size=20, descending=True,
+             created_field='created_at', pk_field='id'):
+    """
+    Return a KeysetPage of ``queryset`` starting at ``cursor``
+
+    Raises InvalidCursor for a malformed token.
+    """
+    key, direction = decode_cursor(cursor) if cursor else (None, NEXT)
+    rows = list(keyset_filter(queryset, key, direction, descending, created_field, pk_field)[:page_size + 1])
+
+    def row_key(row):
+        return getattr(row, created_field), getattr(row, pk_field)
+
+    return build_page(rows, page_size, key, direction, row_key)
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    DRF pagination class backed by ``paginate``
+    """
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    descending = True
+    created_field = 'created_at'
+    pk_field = 'id'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page = paginate(
+                queryset,
+                request.query_params.get(self.cursor_query_param),
+                self.get_page_size(request),
+                descending=self.descending,
+                created_field=self.created_field,
+                pk_field=self.pk_field,
+            )
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return self.page.object_list
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class OldestFirstCursorPagination(KeysetCursorPagination):
+    descending = False
+
+
+class PostLinkCursorPagination(KeysetCursorPagination):
+    """
+    Pages rows that point at posts (``post_id``) with a copied ``created_at``
+    """
+    pk_field = 'post_id'
@@ -0,0 +1,213 @@
+# social_media/post_search.py
+"""
+Hashtags and keyword search over posts.
+
+Tags are parsed from ``Post.hashtags`` and ``#words`` in the content into
+Hashtag/PostHashtag rows; words go into PostTerm, an inverted index of
+``(term, post, frequency)`` postings.  Both are written from the Post
+``post_save`` receiver, diffing against the stored rows on edits, and go
+away with the post through ON DELETE CASCADE.
+
+Keyword queries match every term.  Each term's postings are read newest
+first through ``post_term_recent_idx`` and capped at
+POST_SEARCH_CANDIDATE_LIMIT, the shortest list drives the intersection and
+matches are ranked by term frequency, then recency.  Queries made only of
+very common words therefore search the most recent postings rather than
+the whole table.
+"""
+import math
+import re
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Hashtag, Post, PostHashtag, PostTerm
+
+WORD_RE = re.compile(r'\w+')
+CONTENT_TAG_RE = re.compile(r'#(\w+)')
+MAX_LENGTH = 64
+STOP_WORDS = frozenset(
+    'a an and are as at be but by for from has have i in is it its me my of on or so '
+    'that the this to was we were will with you your'.split()
+)
+
+
+def candidate_limit():
+    return getattr(settings, 'POST_SEARCH_CANDIDATE_LIMIT', 2000)
+
+
+def max_terms():
+    return getattr(settings, 'POST_SEARCH_MAX_TERMS', 5)
+
+
+def normalize_tag(tag):
+    return tag.lstrip('#').lower()
+
+
+def parse_hashtags(hashtags, content=''):
+    """
+    Normalized tag names from the hashtags field (``#`` optional) and from
+    ``#words`` in the content, in order of first appearance
+    """
+    names = [match.lower() for match in WORD_RE.findall(hashtags or '')]
+    names += [match.lower() for match in CONTENT_TAG_RE.findall(content or '')]
+    return [name for name in dict.fromkeys(names) if len(name) <= MAX_LENGTH]
+
+
+def tokenize(text):
+    return [
+        word for word in (match.lower() for match in WORD_RE.findall(text or ''))
+        if 1 < len(word) <= MAX_LENGTH and word not in STOP_WORDS
+    ]
+
+
+def term_frequencies(post):
+    frequencies = {}
+    for term in tokenize(post.content) + tokenize(post.hashtags):
+        frequencies[term] = min(frequencies.get(term, 0) + 1, 32767)
+    return frequencies
+
+
+def _hashtag_ids(names):
+    Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+    return dict(Hashtag.objects.filter(name__in=names).values_list('name', 'id'))
+
+
+def _sync_hashtags(post, created):
+    names = parse_hashtags(post.hashtags, post.content)
+    existing = {} if created else dict(
+        PostHashtag.objects.filter(post=post).values_list('hashtag__name', 'id')
+    )
+    removed = [link_id for name, link_id in existing.items() if name not in names]
+    if removed:
+        PostHashtag.objects.filter(pk__in=removed).delete()
+    added = [name for name in names if name not in existing]
+    if added:
+        ids = _hashtag_ids(added)
+        PostHashtag.objects.bulk_create(
+            [PostHashtag(post=post, hashtag_id=ids[name], created_at=post.created_at) for name in added],
+            ignore_conflicts=True,
+        )
+
+
+def _sync_terms(post, created):
+    frequencies = term_frequencies(post)
+    existing = {} if created else {
+        posting.term: posting for posting in PostTerm.objects.filter(post=post).only('id', 'term', 'frequency')
+    }
+    removed = [posting.pk for term, posting in existing.items() if term not in frequencies]
+    if removed:
+        PostTerm.objects.filter(pk__in=removed).delete()
+    changed = []
+    for term, frequency in frequencies.items():
+        posting = existing.get(term)
+        if posting is not None and posting.frequency != frequency:
+            posting.frequency = frequency
+            changed.append(posting)
+    if changed:
+        PostTerm.objects.bulk_update(changed, ['frequency'])
+    PostTerm.objects.bulk_create(
+        [PostTerm(term=term, post=post, frequency=frequency, created_at=post.created_at)
+         for term, frequency in frequencies.items() if term not in existing],
+        ignore_conflicts=True,
+    )
+
+
+def index_post(post, created=False):
+    """
+    Bring a post's hashtag links and term postings in line with its text
+    """
+    with transaction.atomic():
+        _sync_hashtags(post, created)
+        _sync_terms(post, created)
+
+
+def rebuild(batch_size=1000, log=None):
+    """
+    Reindex every post, e.g. after bulk_create (which skips signals)
+    """
+    indexed = 0
+    last_id = 0
+    while True:
+        posts = list(
+            Post.objects.filter(pk__gt=last_id).order_by('pk')
+            .only('id', 'content', 'hashtags', 'created_at')[:batch_size]
+        )
+        if not posts:
+            return indexed
+        post_ids = [post.pk for post in posts]
+        with transaction.atomic():
+            PostHashtag.objects.filter(post_id__in=post_ids).delete()
+            PostTerm.objects.filter(post_id__in=post_ids).delete()
+            names = {post.pk: parse_hashtags(post.hashtags, post.content) for post in posts}
+            ids = _hashtag_ids({name for tags in names.values() for name in tags})
+            PostHashtag.objects.bulk_create(
+                [PostHashtag(post_id=post.pk, hashtag_id=ids[name], created_at=post.created_at)
+                 for post in posts for name in names[post.pk]],
+                batch_size=batch_size,
+            )
+            PostTerm.objects.bulk_create(
+                [PostTerm(term=term, post_id=post.pk, frequency=frequency, created_at=post.created_at)
+                 for post in posts for term, frequency in term_frequencies(post).items()],
+                batch_size=batch_size,
+            )
+        indexed += len(posts)
+        last_id = post_ids[-1]
+        if log:
+            log(f'indexed {indexed} posts')
+
+
+def tag_postings(tag):
+    """
+    PostHashtag rows of a tag for keyset pagination on ``(created_at, post_id)``,
+    or None for an unknown tag
+    """
+    hashtag_id = Hashtag.objects.filter(name=normalize_tag(tag)).values_list('id', flat=True).first()
+    if hashtag_id is None:
+        return None
+    return PostHashtag.objects.filter(hashtag_id=hashtag_id)
+
+
+def search_post_ids(query, limit=20, offset=0):
+    """
+    Ids of posts containing every term of ``query``, best matches first
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:max_terms()]
+    if not terms:
+        return []
+    cap = candidate_limit()
+
+    postings, complete = {}, {}
+    for term in terms:
+        rows = (
+            PostTerm.objects.filter(term=term)
+            .order_by('-created_at', '-post_id')
+            .values_list('post_id', 'frequency', 'created_at')[:cap]
+        )
+        postings[term] = {post_id: (frequency, created_at) for post_id, frequency, created_at in rows}
+        if not postings[term]:
+            return []
+        complete[term] = len(postings[term]) < cap
+
+    driver = min(terms, key=lambda term: len(postings[term]))
+    candidates = set(postings[driver])
+    for term in terms:
+        if term == driver or not candidates:
+            continue
+        if complete[term]:
+            candidates &= postings[term].keys()
+        else:
+            # Older postings fell outside the capped read; check the
+            # candidates directly
+            verified = dict(
+                PostTerm.objects.filter(term=term, post_id__in=candidates).values_list('post_id', 'frequency')
+            )
+            postings[term] = {post_id: (frequency, None) for post_id, frequency in verified.items()}
+            candidates &= verified.keys()
+
+    def rank(post_id):
+        score = sum(1 + math.log(postings[term][post_id][0]) for term in terms)
+        return score, postings[driver][post_id][1], post_id
+
+    ranked = sorted(candidates, key=rank, reverse=True)
+    return ranked[offset:offset + limit]
@@ -0,0 +1,102 @@
+# social_media/query_plans.py
+"""
+Plan checks for the hot queries.
+
+HOT_QUERIES rebuilds, with placeholder ids, the queries the views, signals
+and workers run on every request or batch.  ``check`` EXPLAINs each one and
+reports any that reads a whole table: ``Seq Scan`` on PostgreSQL, a
+``SCAN`` without an index on SQLite.  On PostgreSQL sequential scans are
+disabled for the EXPLAIN, so small development tables still show whether
+an index *can* serve the query rather than what the planner prefers today.
+``manage.py check_query_plans`` fails when any query would scan.
+"""
+import re
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import search
+from .models import (
+    Comment, FanoutJob, Follow, Hashtag, Notification, Post, PostHashtag, PostTerm, Profile, TimelineEntry,
+)
+
+PostLike = Post.likes.through
+CommentLike = Comment.likes.through
+
+# name -> queryset factory
+HOT_QUERIES = {
+    'post-list': lambda: Post.objects.order_by('-created_at', '-id')[:21],
+    'profile-posts': lambda: Post.objects.filter(author_id=1).order_by('-created_at', '-id'),
+    'pull-author-posts': lambda: Post.objects.filter(author_id__in=[1, 2]).order_by('-created_at', '-id')[:11],
+    'home-timeline': lambda: TimelineEntry.objects.filter(owner_id=1).order_by('-created_at', '-post_id')[:11],
+    'comment-list': lambda: Comment.objects.filter(post_id=1).order_by('created_at', 'id')[:21],
+    'notification-inbox': lambda: Notification.objects.filter(recipient_id=1).order_by('-created_at', '-id')[:21],
+    'notification-unread': lambda: Notification.objects.filter(recipient_id=1, is_read=False).values('id'),
+    'notification-dedupe': lambda: Notification.objects.filter(
+        recipient_id__in=[1, 2], sender_id__in=[1, 2], notification_type__in=['follow'],
+    ).values_list('recipient_id', 'sender_id', 'notification_type', 'post_id', 'comment_id'),
+    'notification-open-groups': lambda: Notification.objects.filter(
+        recipient_id__in=[1, 2], notification_type__in=['like_post'], is_read=False,
+        group_started_at__gte=timezone.now(),
+    ),
+    'post-notifications': lambda: Notification.objects.filter(post_id=1).values('id'),
+    'post-like-exists': lambda: PostLike.objects.filter(post_id=1, user_id=1).values('id'),
+    'liked-posts': lambda: PostLike.objects.filter(user_id=1, post_id__in=[1, 2]).values_list('post_id'),
+    'liked-comments': lambda: CommentLike.objects.filter(user_id=1, comment_id__in=[1, 2]).values_list('comment_id'),
+    'following': lambda: Follow.objects.filter(user_id=1).values_list('profile__user_id'),
+    'followers': lambda: Follow.objects.filter(profile__user_id=1, user_id__gt=0).order_by('user_id').values_list('user_id')[:1000],
+    'pull-accounts': lambda: Profile.objects.filter(followers_count__gte=10000).values_list('user_id'),
+    'hashtag': lambda: Hashtag.objects.filter(name='python').values('id'),
+    'tag-feed': lambda: PostHashtag.objects.filter(hashtag_id=1).order_by('-created_at', '-post_id')[:21],
+    'post-terms': lambda: PostTerm.objects.filter(term='python').order_by('-created_at', '-post_id')[:2000],
+    'fanout-pending': lambda: FanoutJob.objects.filter(completed_at__isnull=True).order_by('id')[:1],
+    'stream-posts': lambda: Post.objects.filter(
+        created_at__gte=timezone.now(), author__profile__follower_edges__user_id__in=[1, 2],
+    ).values_list('id', 'author_id', 'created_at', 'author__profile__follower_edges__user_id'),
+    'user-search': lambda: search.matching_users('ann')[:10],
+}
+
+# name -> the only vendors the query runs on; the rest are checked everywhere
+VENDOR_QUERIES = {
+    'user-search': {'postgresql'},
+}
+
+SQLITE_SCAN_RE = re.compile(r'\bSCAN (\w+)(?!\w| USING)')
+POSTGRES_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+
+
+def scanned_tables(plan, vendor):
+    """
+    Tables the plan reads in full
+    """
+    if vendor == 'postgresql':
+        return POSTGRES_SCAN_RE.findall(plan)
+    if vendor == 'sqlite':
+        return [table for table in SQLITE_SCAN_RE.findall(plan) if table != 'CONSTANT']
+    return []
+
+
+def explain(queryset, using='default'):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return queryset.using(using).explain()
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.using(using).explain()
+
+
+def check(names=None, using='default'):
+    """
+    ``[(name, scanned tables, plan)]`` for the hot queries, in registry order
+    """
+    vendor = connections[using].vendor
+    results = []
+    for name, factory in HOT_QUERIES.items():
+        if names and name not in names:
+            continue
+        if vendor not in VENDOR_QUERIES.get(name, {vendor}):
+            continue
+        plan = explain(factory(), using)
+        results.append((name, scanned_tables(plan, vendor), plan))
+    return results
@@ -0,0 +1,161 @@
+# social_media/routers.py
+"""
+Read-replica routing.
+
+Writes always go to ``default``.  Reads go to a replica only while a
+request marked by ``ReplicaMiddleware`` as read-only is running: a GET or
+HEAD from a user who has not written within REPLICA_PIN_SECONDS.  Each such
+request sticks to one randomly chosen alias from DATABASE_REPLICAS, and
+falls back to ``default`` for the rest of the request once it writes,
+inside an atomic block, or inside ``primary()``.  Any write by an
+authenticated user pins them to ``default`` for REPLICA_PIN_SECONDS so
+they read their own likes, comments and follows back (read-your-writes).
+Management commands and workers never read from a replica.
+
+The pin is kept in the cache, so it is shared by every process only when
+the cache is (Redis in production).
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Replica alias serving the current request, or None to read from default
+_read_alias = ContextVar('replica_read_alias', default=None)
+# Whether the current request has written
+_wrote = ContextVar('replica_wrote', default=False)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+
+def _pin_key(user_id):
+    return f'db-pin:{user_id}'
+
+
+def pin(user_id):
+    """
+    Read ``user_id``'s requests from the primary for REPLICA_PIN_SECONDS
+    """
+    cache.set(_pin_key(user_id), 1, pin_seconds())
+
+
+def is_pinned(user_id):
+    return cache.get(_pin_key(user_id)) is not None
+
+
+async def apin(user_id):
+    await cache.aset(_pin_key(user_id), 1, pin_seconds())
+
+
+async def ais_pinned(user_id):
+    return await cache.aget(_pin_key(user_id)) is not None
+
+
+@contextmanager
+def primary():
+    """
+    Read from ``default`` inside the block, e.g. to fill a shared cache that
+    must not hold lagging replica data
+    """
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    ``DATABASE_ROUTERS`` entry sending read-only request traffic to replicas
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or _wrote.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaMiddleware:
+    """
+    Route a read-only request's queries to a replica and pin users who write
+
+    Must come after AuthenticationMiddleware: the session and user are loaded
+    from the primary before the replica is chosen.
+    """
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _choose(self, request, pinned):
+        aliases = replicas()
+        if aliases and request.method in SAFE_METHODS and not pinned:
+            return random.choice(aliases)
+        return None
+
+    def _writer_id(self, request):
+        # Read after the view: login and registration authenticate the user
+        # during the request
+        user = getattr(request, 'user', None)
+        return user.pk if user is not None and user.is_authenticated else None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        user = getattr(request, 'user', None)
+        pinned = user is not None and user.is_authenticated and is_pinned(user.pk)
+        alias_token = _read_alias.set(self._choose(request, pinned))
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            wrote = _wrote.get() or request.method not in SAFE_METHODS
+        finally:
+            _read_alias.reset(alias_token)
+            _wrote.reset(wrote_token)
+        if wrote and replicas():
+            writer_id = self._writer_id(request)
+            if writer_id:
+                pin(writer_id)
+        return response
+
+    async def __acall__(self, request):
+        user = await request.auser() if hasattr(request, 'auser') else None
+        pinned = user is not None and user.is_authenticated and await ais_pinned(user.pk)
+        alias_token = _read_alias.set(self._choose(request, pinned))
+        wrote_token = _wrote.set(False)
+        try:
+            response = await self.get_response(request)
+            wrote = _wrote.get() or request.method not in SAFE_METHODS
+        finally:
+            _read_alias.reset(alias_token)
+            _wrote.reset(wrote_token)
+        if wrote and replicas():
+            # request.user may still be the lazy, synchronously loaded user
+            writer_id = await sync_to_async(self._writer_id)(request)
+            if writer_id:
+                await apin(writer_id)
+        return response
@@ -0,0 +1,231 @@
+# social_media/search.py
+"""
+Ranked, typeahead-friendly user search.
+
+On PostgreSQL, matching runs on pg_trgm GIN indexes and ``text_pattern_ops``
+prefix indexes over ``auth_user`` (see migration 0008), ranked by trigram
+similarity with a boost for prefix matches.  Other databases use an
+in-process prefix + trigram index that is built lazily and kept current
+from the User signals.  Either way the hits, their profile picture and
+follower count are then loaded with a single query.
+"""
+import bisect
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, CharField, FloatField, Func, Lookup, Q, Value, When
+from django.db.models.functions import Greatest, Lower
+
+MIN_SIMILARITY = 0.3
+
+
+def backend():
+    name = getattr(settings, 'USER_SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        name = 'postgres' if connection.vendor == 'postgresql' else 'memory'
+    return name
+
+
+def normalize(query):
+    return ' '.join(query.lower().split())
+
+
+def trigrams(text):
+    """
+    pg_trgm-style trigrams: each word padded with two leading and one
+    trailing space
+    """
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+class TrigramMatch(Lookup):
+    """
+    ``lhs % rhs``: the pg_trgm similarity operator, which can use a GIN
+    ``gin_trgm_ops`` index (unlike ``similarity(...) > x``)
+    """
+    lookup_name = 'trigram_match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} %% {rhs}', lhs_params + rhs_params
+
+
+class FullName(Func):
+    """
+    ``lower(first_name || ' ' || last_name)``, spelled exactly like the
+    ``user_full_name_trgm_idx`` expression so the planner can match it.
+    ``Concat`` would compile to ``COALESCE(...) || COALESCE(...)``, which
+    no index expression matches.
+    """
+    template = 'LOWER(%(expressions)s)'
+    arg_joiner = " || ' ' || "
+    output_field = CharField()
+
+    def __init__(self, **extra):
+        super().__init__('first_name', 'last_name', **extra)
+
+
+def matching_users(query):
+    """
+    Users matching the normalized ``query``, best first, on PostgreSQL
+    """
+    # ``query`` is already lower-case; matching on lower(...) lets the
+    # text_pattern_ops indexes serve the prefix LIKEs
+    full_name = FullName()
+    return (
+        User.objects.annotate(
+            username_lower=Lower('username'),
+            first_name_lower=Lower('first_name'),
+            last_name_lower=Lower('last_name'),
+        )
+        .filter(
+            Q(username_lower__startswith=query)
+            | Q(first_name_lower__startswith=query)
+            | Q(last_name_lower__startswith=query)
+            | TrigramMatch(Lower('username'), query)
+            | TrigramMatch(full_name, query)
+        )
+        .annotate(
+            rank=Greatest(TrigramSimilarity(Lower('username'), query), TrigramSimilarity(full_name, query))
+            + Case(
+                When(username_lower=query, then=Value(2.0)),
+                When(username_lower__startswith=query, then=Value(1.0)),
+                When(Q(first_name_lower__startswith=query) | Q(last_name_lower__startswith=query), then=Value(0.5)),
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+        .order_by('-rank', 'username')
+    )
+
+
+def _postgres_search(query, limit, exclude_user_id):
+    users = matching_users(query)
+    if exclude_user_id is not None:
+        users = users.exclude(pk=exclude_user_id)
+    return list(users.values_list('pk', flat=True)[:limit])
+
+
+class InProcessIndex:
+    """
+    Prefix + trigram index over usernames and names for non-Postgres setups
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built = False
+        self.documents = {}
+        self.prefixes = []
+        self.postings = {}
+
+    def _terms(self, user_id):
+        username, first_name, last_name = self.documents[user_id]
+        return [(username, 'username'), *((term, 'name') for term in (first_name, last_name) if term)]
+
+    def _add(self, user_id, username, first_name, last_name):
+        self.documents[user_id] = (username.lower(), first_name.lower(), last_name.lower())
+        for term, _ in self._terms(user_id):
+            bisect.insort(self.prefixes, (term, user_id))
+        for gram in trigrams(' '.join(self.documents[user_id])):
+            self.postings.setdefault(gram, set()).add(user_id)
+
+    def _remove(self, user_id):
+        if user_id not in self.documents:
+            return
+        for entry in self._terms(user_id):
+            index = bisect.bisect_left(self.prefixes, (entry[0], user_id))
+            if index < len(self.prefixes) and self.prefixes[index] == (entry[0], user_id):
+                del self.prefixes[index]
+        for gram in trigrams(' '.join(self.documents[user_id])):
+            self.postings.get(gram, set()).discard(user_id)
+        del self.documents[user_id]
+
+    def _build(self):
+        rows = User.objects.values_list('pk', 'username', 'first_name', 'last_name').iterator(chunk_size=5000)
+        for row in rows:
+            self._add(*row)
+        self.built = True
+
+    def update(self, user):
+        with self.lock:
+            if self.built:
+                self._remove(user.pk)
+                self._add(user.pk, user.username, user.first_name, user.last_name)
+
+    def remove(self, user_id):
+        with self.lock:
+            if self.built:
+                self._remove(user_id)
+
+    def reset(self):
+        with self.lock:
+            self.__init__()
+
+    def search(self, query, limit, exclude_user_id=None):
+        with self.lock:
+            if not self.built:
+                self._build()
+            scores = {}
+
+            index = bisect.bisect_left(self.prefixes, (query,))
+            while index < len(self.prefixes) and self.prefixes[index][0].startswith(query):
+                term, user_id = self.prefixes[index]
+                username = self.documents[user_id][0]
+                if username == query:
+                    boost = 2.0
+                elif username.startswith(query):
+                    boost = 1.0
+                else:
+                    boost = 0.5
+                scores[user_id] = max(scores.get(user_id, 0), boost)
+                index += 1
+
+            query_grams = trigrams(query)
+            shared = set()
+            for gram in query_grams:
+                shared.update(self.postings.get(gram, ()))
+            for user_id in shared:
+                username, first_name, last_name = self.documents[user_id]
+                similarity = max(
+                    len(query_grams & grams) / len(query_grams | grams)
+                    for grams in (trigrams(username), trigrams(f'{first_name} {last_name}'))
+                    if grams
+                )
+                if similarity >= MIN_SIMILARITY or user_id in scores:
+                    scores[user_id] = scores.get(user_id, 0) + similarity
+
+            scores.pop(exclude_user_id, None)
+            ranked = sorted(scores, key=lambda user_id: (-scores[user_id], self.documents[user_id][0]))
+            return ranked[:limit]
+
+
+memory_index = InProcessIndex()
+
+
+def search_user_ids(query, limit=10, exclude_user_id=None):
+    """
+    Ranked ids of users matching ``query`` by prefix or trigram similarity
+    """
+    query = normalize(query)
+    if not query:
+        return []
+    if backend() == 'postgres':
+        return _postgres_search(query, limit, exclude_user_id)
+    return memory_index.search(query, limit, exclude_user_id)
+
+
+def search_users(query, limit=10, exclude_user_id=None):
+    """
+    Ranked Users with their profiles joined in, in one query after matching
+    """
+    ids = search_user_ids(query, limit, exclude_user_id)
+    users = User.objects.select_related('profile').in_bulk(ids)
+    return [users[user_id] for user_id in ids if user_id in users]
@@ -1,24 +1,39 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 from .models import Profile, Post, Comment, Notification
+from . import images, metrics
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedSerializerMixin:
+    """
+    Report serialization time to the request metrics
+    """
+    def to_representation(self, instance):
+        with metrics.serializer_timer():
+            return super().to_representation(instance)
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'date_joined']
         read_only_fields = ['id', 'date_joined']
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     followers_count = serializers.ReadOnlyField()
     following_count = serializers.ReadOnlyField()
+    profile_picture_url = serializers.SerializerMethodField()
     
     class Meta:
         model = Profile
-        fields = ['user', 'bio', 'profile_picture', 'followers_count', 'following_count', 'created_at', 'updated_at']
+        fields = ['user', 'bio', 'profile_picture', 'profile_picture_url', 'followers_count', 'following_count', 'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
 
-class CommentSerializer(serializers.ModelSerializer):
+    def get_profile_picture_url(self, obj):
+        return images.requested_url(self.context.get('request'), obj.profile_picture, obj.picture_renditions, 150)
+
+class CommentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     likes_count = serializers.ReadOnlyField()
     
@@ -27,21 +42,62 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = ['id', 'author', 'content', 'likes_count', 'created_at', 'updated_at']
         read_only_fields = ['id', 'author', 'created_at', 'updated_at']
 
-class PostSerializer(serializers.ModelSerializer):
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Load comment authors in the same query as the comments
+        """
+        return queryset.select_related('author')
+
+class PostSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     likes_count = serializers.ReadOnlyField()
     comments_count = serializers.ReadOnlyField()
-    comments = CommentSerializer(many=True, read_only=True)
+    comments = serializers.SerializerMethodField()
+    image_url = serializers.SerializerMethodField()
     
     class Meta:
         model = Post
-        fields = ['id', 'author', 'content', 'image', 'hashtags', 'likes_count', 'comments_count', 'comments', 'created_at', 'updated_at']
+        fields = ['id', 'author', 'content', 'image', 'image_url', 'hashtags', 'likes_count', 'comments_count', 'comments', 'created_at', 'updated_at']
         read_only_fields = ['id', 'author', 'created_at', 'updated_at']
 
-class NotificationSerializer(serializers.ModelSerializer):
+    @staticmethod
+    def setup_eager_loading(queryset, comments_limit=None):
+        """
+        Fetch authors, comments and comment authors in a fixed number of queries
+
+        With ``comments_limit`` only the latest N comments of each post are
+        prefetched (one windowed query for the whole page) and exposed as
+        ``latest_comments``; likes and comments counts are stored columns.
+        """
+        queryset = queryset.select_related('author')
+        comments = CommentSerializer.setup_eager_loading(Comment.objects.all())
+        if comments_limit is None:
+            return queryset.prefetch_related(Prefetch('comments', queryset=comments))
+        if comments_limit <= 0:
+            comments = comments.none()
+        else:
+            comments = comments.annotate(
+                recency=Window(RowNumber(), partition_by=F('post_id'), order_by=[F('created_at').desc(), F('id').desc()])
+            ).filter(recency__lte=comments_limit).order_by('created_at', 'id')
+        return queryset.prefetch_related(Prefetch('comments', queryset=comments, to_attr='latest_comments'))
+
+    def get_image_url(self, obj):
+        """
+        Smallest rendition that fits the feed (or ``?image_width``)
+        """
+        return images.requested_url(self.context.get('request'), obj.image, obj.image_renditions, 640)
+
+    def get_comments(self, obj):
+        comments = getattr(obj, 'latest_comments', None)
+        if comments is None:
+            comments = obj.comments.all()
+        return CommentSerializer(comments, many=True, context=self.context).data
+
+class NotificationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     
     class Meta:
         model = Notification
-        fields = ['id', 'sender', 'notification_type', 'post', 'comment', 'is_read', 'created_at']
-        read_only_fields = ['id', 'sender', 'created_at']
\ No newline at end of file
+        fields = ['id', 'sender', 'notification_type', 'post', 'comment', 'actor_count', 'recent_actors', 'summary', 'is_read', 'created_at']
+        read_only_fields = ['id', 'sender', 'actor_count', 'recent_actors', 'summary', 'created_at']
\ No newline at end of file
@@ -1,10 +1,13 @@
 # social_media/signals.py
-from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from .models import Profile, Post, Comment, Notification
-import os
+from django.core.files.storage import default_storage
+from .models import Profile, Post, Comment, Notification, NotificationEvent, TimelineEntry
+from . import caching, counters, images, metrics, notifications, post_search, search, streaming, timeline, trending
 
 
 @receiver(post_save, sender=User)
@@ -18,226 +21,388 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def update_user_search_index(sender, instance, **kwargs):
     """
-    Save user profile when user is saved
+    Keep the in-process user search index in step with usernames and names
     """
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
+    search.memory_index.update(instance)
+
+
+@receiver(post_delete, sender=User)
+def remove_user_from_search_index(sender, instance, **kwargs):
+    search.memory_index.remove(instance.pk)
 
 
 @receiver(post_save, sender=Post)
 def post_created_notification(sender, instance, created, **kwargs):
     """
-    Create notifications for followers when a new post is created
+    Start the chunked new-post notification fan-out to the author's followers
+    """
+    if created:
+        notifications.start_fanout(instance)
+
+
+@receiver(post_save, sender=Post)
+def push_post_to_timelines(sender, instance, created, **kwargs):
+    """
+    Fan a new post out to the precomputed home timelines of the author's followers
+    """
+    if created:
+        timeline.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def push_post_to_streams(sender, instance, created, **kwargs):
+    """
+    Tell followers with an open event stream about a new post
     """
     if created:
-        # Get all followers of the post author
-        followers = instance.author.profile.followers.all()
-        
-        # Create notifications for each follower
-        notifications_to_create = []
-        for follower in followers:
-            if follower != instance.author:  # Don't notify self
-                notifications_to_create.append(
-                    Notification(
-                        recipient=follower,
-                        sender=instance.author,
-                        notification_type='follow',  # You might want to add 'new_post' type
-                        post=instance
-                    )
-                )
-        
-        if notifications_to_create:
-            Notification.objects.bulk_create(notifications_to_create)
+        streaming.publish_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def index_post_content(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Keep the post's hashtag links and search postings in step with its text
+    """
+    if update_fields is not None and not {'content', 'hashtags'} & set(update_fields):
+        return
+    post_search.index_post(instance, created=created)
+
+
+@receiver(post_save, sender=Post)
+def record_trending_post(sender, instance, created, **kwargs):
+    """
+    Count a new post towards its hashtags' trending scores once it commits
+    """
+    if created:
+        transaction.on_commit(lambda: trending.record_post(instance))
 
 
 @receiver(m2m_changed, sender=Post.likes.through)
-def post_like_notification(sender, instance, action, pk_set, **kwargs):
+def post_like_notification(sender, instance, action, reverse, pk_set, **kwargs):
     """
-    Create notification when someone likes a post
+    Queue a notification when someone likes a post
     """
     if action == 'post_add':
-        for user_id in pk_set:
-            liker = User.objects.get(pk=user_id)
-            if liker != instance.author:  # Don't notify if user likes their own post
-                # Check if notification already exists to avoid duplicates
-                if not Notification.objects.filter(
-                    recipient=instance.author,
-                    sender=liker,
-                    notification_type='like_post',
-                    post=instance
-                ).exists():
-                    Notification.objects.create(
-                        recipient=instance.author,
-                        sender=liker,
-                        notification_type='like_post',
-                        post=instance
-                    )
+        if reverse:
+            # user.liked_posts.add(post, ...): instance is the liker
+            pairs = [(instance.pk, post_id, author_id) for post_id, author_id in
+                     Post.objects.filter(pk__in=pk_set).values_list('id', 'author_id')]
+        else:
+            pairs = [(user_id, instance.pk, instance.author_id) for user_id in pk_set]
+        notifications.enqueue([
+            NotificationEvent(recipient_id=author_id, sender_id=liker_id, notification_type='like_post', post_id=post_id)
+            for liker_id, post_id, author_id in pairs
+        ])
 
 
 @receiver(m2m_changed, sender=Comment.likes.through)
-def comment_like_notification(sender, instance, action, pk_set, **kwargs):
+def comment_like_notification(sender, instance, action, reverse, pk_set, **kwargs):
     """
-    Create notification when someone likes a comment
+    Queue a notification when someone likes a comment
     """
     if action == 'post_add':
-        for user_id in pk_set:
-            liker = User.objects.get(pk=user_id)
-            if liker != instance.author:  # Don't notify if user likes their own comment
-                # Check if notification already exists to avoid duplicates
-                if not Notification.objects.filter(
-                    recipient=instance.author,
-                    sender=liker,
-                    notification_type='like_comment',
-                    comment=instance
-                ).exists():
-                    Notification.objects.create(
-                        recipient=instance.author,
-                        sender=liker,
-                        notification_type='like_comment',
-                        comment=instance
-                    )
+        if reverse:
+            pairs = [(instance.pk, comment_id, author_id) for comment_id, author_id in
+                     Comment.objects.filter(pk__in=pk_set).values_list('id', 'author_id')]
+        else:
+            pairs = [(user_id, instance.pk, instance.author_id) for user_id in pk_set]
+        notifications.enqueue([
+            NotificationEvent(recipient_id=author_id, sender_id=liker_id, notification_type='like_comment', comment_id=comment_id)
+            for liker_id, comment_id, author_id in pairs
+        ])
 
 
 @receiver(post_save, sender=Comment)
 def comment_created_notification(sender, instance, created, **kwargs):
     """
-    Create notification when someone comments on a post
+    Queue a notification when someone comments on a post
     """
     if created:
-        if instance.author != instance.post.author:  # Don't notify if user comments on their own post
-            # Check if notification already exists to avoid duplicates
-            if not Notification.objects.filter(
-                recipient=instance.post.author,
-                sender=instance.author,
+        notifications.enqueue([
+            NotificationEvent(
+                recipient_id=instance.post.author_id,
+                sender_id=instance.author_id,
                 notification_type='comment',
-                post=instance.post,
-                comment=instance
-            ).exists():
-                Notification.objects.create(
-                    recipient=instance.post.author,
-                    sender=instance.author,
-                    notification_type='comment',
-                    post=instance.post,
-                    comment=instance
-                )
+                post_id=instance.post_id,
+                comment_id=instance.pk,
+            )
+        ])
 
 
 @receiver(m2m_changed, sender=Profile.followers.through)
-def follow_notification(sender, instance, action, pk_set, **kwargs):
+def follow_notification(sender, instance, action, reverse, pk_set, **kwargs):
     """
-    Create notification when someone follows a user
+    Queue a notification when someone follows a user
     """
     if action == 'post_add':
-        for follower_id in pk_set:
-            follower = User.objects.get(pk=follower_id)
-            if follower != instance.user:  # Don't notify if user follows themselves
-                # Check if notification already exists to avoid duplicates
-                if not Notification.objects.filter(
-                    recipient=instance.user,
-                    sender=follower,
-                    notification_type='follow'
-                ).exists():
-                    Notification.objects.create(
-                        recipient=instance.user,
-                        sender=follower,
-                        notification_type='follow'
-                    )
+        if reverse:
+            # user.following.add(profile, ...): instance is the follower
+            pairs = [(instance.pk, user_id) for user_id in
+                     Profile.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)]
+        else:
+            pairs = [(follower_id, instance.user_id) for follower_id in pk_set]
+        notifications.enqueue([
+            NotificationEvent(recipient_id=followed_id, sender_id=follower_id, notification_type='follow')
+            for follower_id, followed_id in pairs
+        ])
+
+
+@receiver(m2m_changed, sender=Profile.followers.through)
+def sync_timeline_on_follow(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Backfill a timeline on follow and prune it on unfollow
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if action == 'pre_clear':
+        if reverse:
+            caching.bump('timeline', instance.pk)
+            TimelineEntry.objects.filter(owner=instance).exclude(post__author=instance).delete()
+        else:
+            caching.bump('timeline', *instance.followers.values_list('id', flat=True))
+            TimelineEntry.objects.filter(
+                owner__following=instance, post__author_id=instance.user_id
+            ).delete()
+        return
+
+    if reverse:
+        # user.following.add(profile, ...): instance is the follower
+        pairs = [(instance.pk, list(Profile.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)))]
+    else:
+        # profile.followers.add(user, ...): instance is the followed profile
+        pairs = [(follower_id, [instance.user_id]) for follower_id in pk_set]
+
+    for follower_id, author_ids in pairs:
+        if action == 'post_add':
+            timeline.backfill(follower_id, author_ids)
+        else:
+            timeline.remove_authors(follower_id, author_ids)
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def update_post_likes_count(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep Post.likes_count in step with the likes table
+    """
+    counters.apply_post_likes(instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def record_trending_likes(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Count new likes towards the liked posts' and their hashtags' trending
+    scores once they commit, so rolled-back likes never count
+    """
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        posts = [(*row, 1) for row in Post.objects.filter(pk__in=pk_set).values_list('id', 'hashtags', 'content')]
+    else:
+        posts = [(instance.pk, instance.hashtags, instance.content, len(pk_set))]
+    transaction.on_commit(lambda: trending.record_likes(posts))
+
+
+@receiver(m2m_changed, sender=Comment.likes.through)
+def update_comment_likes_count(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep Comment.likes_count in step with the likes table
+    """
+    counters.apply_comment_likes(instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=Profile.followers.through)
+def update_follow_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep Profile.followers_count and following_count in step with the follow table
+    """
+    counters.apply_follows(instance, action, reverse, pk_set)
+
+
+@receiver(post_save, sender=Comment)
+def increment_comments_count(sender, instance, created, **kwargs):
+    """
+    Count a new comment on its post
+    """
+    if created:
+        counters.apply_comment(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comments_count(sender, instance, **kwargs):
+    """
+    Uncount a deleted comment
+    """
+    counters.apply_comment(instance.post_id, -1)
+
+
+IMAGE_FIELDS = {Post: 'image', Profile: 'profile_picture'}
+DEFAULT_PROFILE_PICTURE = Profile._meta.get_field('profile_picture').default
+
+
+def release_image(name):
+    """
+    Give back a stored image; the default profile picture is shared by
+    design and never released
+    """
+    if name and name != DEFAULT_PROFILE_PICTURE:
+        default_storage.delete(name)
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Profile)
+def detect_new_upload(sender, instance, **kwargs):
+    """
+    Note freshly uploaded images: FileField commits them after pre_save
+    """
+    field = IMAGE_FIELDS[sender]
+    image = getattr(instance, field)
+    instance._new_upload = bool(image) and not image._committed
+    if instance._new_upload and instance.pk is not None and not instance.is_tracked(field):
+        # Built by hand rather than loaded, so nothing was tracked: read the
+        # name being replaced while it is still stored
+        instance._loaded_values = {
+            **getattr(instance, '_loaded_values', {}),
+            field: sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first(),
+        }
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Profile)
+def sync_image_references(sender, instance, created, **kwargs):
+    """
+    When the image changed, release the one it replaced and queue the new
+    one's renditions
+
+    The previous name comes from the value tracked at load time, so saves
+    that leave the image alone cost no query and no image work.
+    """
+    field = IMAGE_FIELDS[sender]
+    image = getattr(instance, field)
+    new_upload, instance._new_upload = getattr(instance, '_new_upload', False), False
+    if created:
+        previous = None
+    elif instance.is_tracked(field):
+        previous = instance.loaded_value(field)
+    else:
+        previous = image.name
+    if not new_upload and (created or (previous or '') == (image.name or '')):
+        return
+
+    # Re-uploading identical bytes maps to the same blob but still took a
+    # reference, so the previous one is released either way
+    release_image(previous)
+    renditions = instance.image_renditions if sender is Post else instance.picture_renditions
+    if image and image.name != DEFAULT_PROFILE_PICTURE and images.current(image, renditions) is None:
+        images.enqueue('post' if sender is Post else 'profile', instance.pk, image.name)
 
 
 @receiver(post_delete, sender=Post)
 def delete_post_image(sender, instance, **kwargs):
     """
-    Delete associated image file when a post is deleted
+    Release the post's image and renditions when a post is deleted
     """
+    images.delete_renditions(instance.image_renditions)
     if instance.image:
-        if os.path.isfile(instance.image.path):
-            try:
-                os.remove(instance.image.path)
-                print(f"Deleted post image: {instance.image.path}")
-            except Exception as e:
-                print(f"Error deleting post image: {e}")
+        release_image(instance.image.name)
 
 
 @receiver(pre_delete, sender=Profile)
 def delete_profile_picture(sender, instance, **kwargs):
     """
-    Delete profile picture when profile is deleted (except default)
+    Release the profile picture and its renditions when a profile is deleted
     """
-    if instance.profile_picture and 'default.jpg' not in instance.profile_picture.name:
-        if os.path.isfile(instance.profile_picture.path):
-            try:
-                os.remove(instance.profile_picture.path)
-                print(f"Deleted profile picture: {instance.profile_picture.path}")
-            except Exception as e:
-                print(f"Error deleting profile picture: {e}")
+    images.delete_renditions(instance.picture_renditions)
+    if instance.profile_picture:
+        release_image(instance.profile_picture.name)
 
 
-@receiver(post_save, sender=Profile)
-def delete_old_profile_picture(sender, instance, created, **kwargs):
+@receiver(post_save, sender=User)
+def invalidate_user_cache(sender, instance, update_fields=None, **kwargs):
     """
-    Delete old profile picture when a new one is uploaded (not when created)
+    Expire cached reads that show the user; logins only touch last_login
     """
-    if not created:  # Only run for updates, not creation
-        try:
-            # Get the old instance from database
-            old_profile = Profile.objects.get(pk=instance.pk)
-            if old_profile.profile_picture != instance.profile_picture:
-                if old_profile.profile_picture and 'default.jpg' not in old_profile.profile_picture.name:
-                    if os.path.isfile(old_profile.profile_picture.path):
-                        os.remove(old_profile.profile_picture.path)
-                        print(f"Deleted old profile picture: {old_profile.profile_picture.path}")
-        except Profile.DoesNotExist:
-            pass
-        except Exception as e:
-            print(f"Error deleting old profile picture: {e}")
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        caching.bump('user', instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_cache(sender, instance, **kwargs):
+    caching.bump('user', instance.user_id)
 
 
 @receiver(post_save, sender=Post)
-def clear_user_posts_cache(sender, instance, **kwargs):
+def invalidate_post_cache(sender, instance, created, **kwargs):
     """
-    Clear cached data when posts are created or updated
+    Expire cached reads of the post and of its author's posts
+
+    A constant number of generation stamps whatever the author's following:
+    fanned-out timelines are keyed on their newest entry instead, and readers
+    of pull authors check the ``authored`` stamp.
     """
-    # Clear user's posts cache
-    cache.delete(f'user_posts_{instance.author.id}')
-    cache.delete(f'user_posts_count_{instance.author.id}')
-    
-    # Clear home timeline cache for followers
-    followers = instance.author.profile.followers.all()
-    for follower in followers:
-        cache.delete(f'home_timeline_{follower.id}')
+    caching.bump_posts([instance.pk], [instance.author_id])
+    if created:
+        caching.bump('authored', instance.author_id)
 
 
 @receiver(post_delete, sender=Post)
-def clear_user_posts_cache_on_delete(sender, instance, **kwargs):
-    """
-    Clear cached data when posts are deleted
-    """
-    cache.delete(f'user_posts_{instance.author.id}')
-    cache.delete(f'user_posts_count_{instance.author.id}')
-    
-    followers = instance.author.profile.followers.all()
-    for follower in followers:
-        cache.delete(f'home_timeline_{follower.id}')
+def invalidate_post_cache_on_delete(sender, instance, **kwargs):
+    caching.bump_posts([instance.pk], [instance.author_id])
+    caching.bump('authored', instance.author_id)
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def invalidate_liked_posts_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        caching.bump_posts([instance.pk], [instance.author_id])
+    elif action == 'pre_clear':
+        caching.bump_posts(list(Post.objects.filter(likes=instance).values_list('id', flat=True)))
+    else:
+        caching.bump_posts(pk_set)
 
 
 @receiver(post_save, sender=Comment)
-def clear_post_comments_cache(sender, instance, **kwargs):
+@receiver(post_delete, sender=Comment)
+def invalidate_post_comments_cache(sender, instance, **kwargs):
     """
-    Clear post comments cache when a new comment is added
+    Expire the post's cached comments and comment count
     """
-    cache.delete(f'post_comments_{instance.post.id}')
-    cache.delete(f'post_comments_count_{instance.post.id}')
+    caching.bump_posts([instance.post_id])
 
 
-@receiver(post_delete, sender=Comment)
-def clear_post_comments_cache_on_delete(sender, instance, **kwargs):
+@receiver(m2m_changed, sender=Comment.likes.through)
+def invalidate_liked_comments_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        caching.bump_posts([instance.post_id])
+    else:
+        comments = Comment.objects.filter(likes=instance) if action == 'pre_clear' else Comment.objects.filter(pk__in=pk_set)
+        caching.bump_posts(set(comments.values_list('post_id', flat=True)))
+
+
+@receiver(m2m_changed, sender=Profile.followers.through)
+def invalidate_follow_cache(sender, instance, action, reverse, pk_set, **kwargs):
     """
-    Clear post comments cache when a comment is deleted
+    Expire both sides' cached profiles, whose follower counts changed, and
+    their cached follow graph adjacency
     """
-    cache.delete(f'post_comments_{instance.post.id}')
-    cache.delete(f'post_comments_count_{instance.post.id}')
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # user.following.add(profile, ...): instance is the follower
+        profiles = Profile.objects.filter(followers=instance) if action == 'pre_clear' else Profile.objects.filter(pk__in=pk_set)
+        follower_ids, followed_ids = [instance.pk], list(profiles.values_list('user_id', flat=True))
+    else:
+        follower_ids = list(instance.followers.values_list('id', flat=True)) if action == 'pre_clear' else list(pk_set)
+        followed_ids = [instance.user_id]
+    caching.bump('user', *follower_ids, *followed_ids)
+    caching.bump('following', *follower_ids)
+    caching.bump('followers', *followed_ids)
 
 
 @receiver(post_save, sender=Notification)
@@ -245,8 +410,8 @@ def clear_notifications_cache(sender, instance, **kwargs):
     """
     Clear user notifications cache when a new notification is created
     """
-    cache.delete(f'user_notifications_{instance.recipient.id}')
-    cache.delete(f'unread_notifications_count_{instance.recipient.id}')
+    cache.delete(f'user_notifications_{instance.recipient_id}')
+    cache.delete(f'unread_notifications_count_{instance.recipient_id}')
 
 
 @receiver(post_save, sender=Notification)
@@ -255,8 +420,8 @@ def mark_notification_cache_update(sender, instance, created, **kwargs):
     Update notification cache when notification is read/unread
     """
     if not created:  # Only for updates, not creation
-        cache.delete(f'user_notifications_{instance.recipient.id}')
-        cache.delete(f'unread_notifications_count_{instance.recipient.id}')
+        cache.delete(f'user_notifications_{instance.recipient_id}')
+        cache.delete(f'unread_notifications_count_{instance.recipient_id}')
 
 
 # Clean up notifications when related objects are deleted
@@ -287,12 +452,29 @@ def cleanup_user_data(sender, instance, **kwargs):
     # Delete notifications received by this user
     Notification.objects.filter(recipient=instance).delete()
     
-    # Clear all related cache
-    cache.delete(f'user_posts_{instance.id}')
-    cache.delete(f'user_posts_count_{instance.id}')
-    cache.delete(f'home_timeline_{instance.id}')
+    # Clear all related cache; the user's posts expire their own entries as
+    # they are deleted
+    caching.bump('user', instance.pk)
+    caching.bump('timeline', instance.pk)
     cache.delete(f'user_notifications_{instance.id}')
     cache.delete(f'unread_notifications_count_{instance.id}')
 
 
+@receiver(connection_created)
+def count_database_connection(sender, connection, **kwargs):
+    """
+    Count database connects (pool checkouts when pooled) for the metrics
+    report; with persistent connections they should be rare
+    """
+    metrics.connection_opened(connection.alias)
+
+
+@receiver(connection_created)
+def instrument_database_connection(sender, connection, **kwargs):
+    """
+    Count every query on the connection towards the request it serves
+    """
+    metrics.instrument(connection)
+
+
 print("Social media signals loaded successfully!")
\ No newline at end of file
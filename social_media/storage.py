@@ -0,0 +1,199 @@
+# social_media/storage.py
+"""
+Content-addressed, reference-counted media storage.
+
+Every upload and rendition is stored once under the SHA-256 of its bytes
+(``blobs/ab/cd/<digest>.<ext>``), however many posts, profiles or
+renditions use it.  MediaBlob counts the references: ``save`` takes one and
+``delete`` gives one back, so callers keep the usual storage API and a
+shared file is never removed under another user.  Unreferenced blobs are
+removed by ``manage.py gc_media`` after a grace period.
+
+Blob contents never change for a given name, so they are served with
+immutable, long-lived cache headers.
+"""
+import hashlib
+import os
+import tempfile
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.views import static
+
+from . import images
+from .models import MediaBlob
+
+BLOB_PREFIX = 'blobs/'
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+def acquire(name, size):
+    """
+    Take a reference to a blob, creating its MediaBlob row on first use
+    """
+    if MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, size=size, ref_count=1)
+    except IntegrityError:
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+
+def release(name):
+    MediaBlob.objects.filter(name=name, ref_count__gt=0).update(
+        ref_count=F('ref_count') - 1, released_at=timezone.now(),
+    )
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names files by content digest and counts
+    references instead of deleting shared files
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The real name is chosen from the content in _save
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        directory = self.path(BLOB_PREFIX)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    handle.write(chunk)
+                    size += len(chunk)
+            name = blob_name(digest.hexdigest(), os.path.splitext(name)[1])
+            # Reference first, then make sure the file exists: gc_media
+            # removes a file only while holding its zero-count row
+            acquire(name, size)
+            path = self.path(name)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return name
+
+    def delete(self, name):
+        if is_blob(name):
+            release(name)
+        else:
+            super().delete(name)
+
+    def remove_file(self, name):
+        """
+        Physically remove a blob; only gc_media should call this
+        """
+        super().delete(name)
+
+
+def immutable_max_age():
+    return getattr(settings, 'MEDIA_IMMUTABLE_MAX_AGE', 365 * 24 * 60 * 60)
+
+
+def serve(request, path, document_root=None, show_indexes=False):
+    """
+    ``django.views.static.serve`` that marks content-addressed blobs immutable
+    """
+    response = static.serve(request, path, document_root, show_indexes)
+    if is_blob(path) and response.status_code == 200:
+        response['Cache-Control'] = f'public, max-age={immutable_max_age()}, immutable'
+    return response
+
+
+def referenced_blobs():
+    """
+    ``{name: references}`` from post images, profile pictures and their
+    renditions, the ground truth the counters are rebuilt from
+    """
+    counts = Counter()
+    for model, image_field, renditions_field in images.TARGETS.values():
+        rows = model.objects.values_list(image_field, renditions_field).iterator(chunk_size=2000)
+        for name, renditions in rows:
+            counts[name] += 1
+            counts.update(images.rendition_files(renditions))
+    return {name: count for name, count in counts.items() if is_blob(name)}
+
+
+def recount(dry_run=False):
+    """
+    Reset every MediaBlob.ref_count to the references that exist; returns
+    the number of rows changed
+    """
+    references = referenced_blobs()
+    changed = []
+    for blob in MediaBlob.objects.only('id', 'name', 'ref_count').iterator(chunk_size=2000):
+        count = references.pop(blob.name, 0)
+        if blob.ref_count != count:
+            blob.ref_count = count
+            changed.append(blob)
+    missing = [MediaBlob(name=name, ref_count=count) for name, count in references.items()]
+    if not dry_run:
+        MediaBlob.objects.bulk_update(changed, ['ref_count'], batch_size=2000)
+        MediaBlob.objects.bulk_create(missing, batch_size=2000, ignore_conflicts=True)
+    return len(changed) + len(missing)
+
+
+def collect_garbage(storage, grace_seconds=3600, dry_run=False):
+    """
+    Remove blobs nobody has referenced for ``grace_seconds`` and blob files
+    with no MediaBlob row; returns ``(files removed, bytes freed)``
+    """
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+    removed = freed = 0
+    candidates = MediaBlob.objects.filter(ref_count__lte=0).filter(
+        Q(released_at__lt=cutoff) | Q(released_at__isnull=True, created_at__lt=cutoff)
+    ).values_list('pk', flat=True)
+    for pk in list(candidates.iterator(chunk_size=2000)):
+        with transaction.atomic():
+            # The row lock makes a concurrent upload of the same bytes wait,
+            # then recreate the row and rewrite the file
+            blob = MediaBlob.objects.select_for_update().filter(pk=pk, ref_count__lte=0).first()
+            if blob is None:
+                continue
+            if not dry_run:
+                storage.remove_file(blob.name)
+                blob.delete()
+        removed += 1
+        freed += blob.size
+
+    root = storage.path(BLOB_PREFIX)
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = BLOB_PREFIX + os.path.relpath(path, root).replace(os.sep, '/')
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime >= cutoff.timestamp() or MediaBlob.objects.filter(name=name).exists():
+                continue
+            if not dry_run:
+                storage.remove_file(name)
+            removed += 1
+            freed += stat.st_size
+    return removed, freed
@@ -0,0 +1,323 @@
+# social_media/streaming.py
+"""
+Server-sent event push of notification and feed updates.
+
+Each open ``/api/stream/`` connection subscribes its user to the
+process-local ``hub``.  ``publish`` hands an event to that user's
+subscriptions in this process.  Publishers run in request threads and
+workers and subscribers on the event loop, so delivery goes through
+``call_soon_threadsafe``.  Two events exist:
+
+- ``notifications``: the inbox changed; the stream sends the unread count
+- ``post``: an account the user follows published a post
+
+Only the process that made a change can publish it in-process, and
+notifications are usually written by the ``process_notifications`` worker
+and posts by whichever process served the request.  ``poller`` stands in
+for a cross-process broker: while a process has subscribers, it checks
+their unread notifications every STREAM_POLL_INTERVAL seconds with one
+grouped query and publishes the inboxes whose count, newest row or actor
+total changed, and reads the posts of the last STREAM_POST_LOOKBACK seconds
+by accounts they follow with a second query, publishing each post once.
+A client holds one idle connection instead of polling the inbox, and a
+process costs two queries per interval however many of its clients are
+connected.
+"""
+import asyncio
+import json
+import logging
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from . import graph
+from .models import Notification, Post
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATIONS = 'notifications'
+POST = 'post'
+
+
+def heartbeat_seconds():
+    return getattr(settings, 'STREAM_HEARTBEAT_SECONDS', 15)
+
+
+def poll_interval():
+    return getattr(settings, 'STREAM_POLL_INTERVAL', 2)
+
+
+def polling_enabled():
+    return getattr(settings, 'STREAM_DB_POLLING', True)
+
+
+def post_lookback():
+    return getattr(settings, 'STREAM_POST_LOOKBACK', 30)
+
+
+def queue_size():
+    return getattr(settings, 'STREAM_QUEUE_SIZE', 100)
+
+
+def retry_ms():
+    return getattr(settings, 'STREAM_RETRY_MS', 5000)
+
+
+class Subscription:
+    """
+    One stream's queue of ``(event, data)`` on the loop that reads it
+    """
+
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size())
+
+    def put(self, event, data):
+        try:
+            self.loop.call_soon_threadsafe(self._put, (event, data))
+        except RuntimeError:
+            # The loop has closed under a stream that did not unsubscribe
+            pass
+
+    def _put(self, message):
+        if self.queue.full():
+            # A slow client loses its oldest events, not the newest
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout):
+        """
+        Every queued message, waiting up to ``timeout`` seconds for the first;
+        an empty list on timeout
+        """
+        try:
+            messages = [await asyncio.wait_for(self.queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.queue.empty():
+            messages.append(self.queue.get_nowait())
+        return messages
+
+
+class Hub:
+    """
+    In-process pub/sub keyed by user id
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def user_ids(self):
+        with self._lock:
+            return set(self._subscriptions)
+
+    def publish(self, user_id, event, data=None):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event, data)
+
+
+hub = Hub()
+
+
+def publish_inboxes(user_ids):
+    """
+    Tell ``user_ids``' streams their inboxes changed, once the change commits
+    """
+    user_ids = set(user_ids) & hub.user_ids()
+    if user_ids:
+        transaction.on_commit(lambda: [hub.publish(user_id, NOTIFICATIONS) for user_id in user_ids])
+
+
+def publish_post(post):
+    """
+    Tell the author's followers with an open stream about a new post
+    """
+    subscribed = hub.user_ids()
+    if not subscribed:
+        return
+    followers = graph.members(post.author_id, subscribed, graph.FOLLOWERS)
+    # Marked before the commit, so the poller never publishes it a second time
+    poller.seen(post)
+    data = {'id': post.pk, 'author_id': post.author_id}
+    transaction.on_commit(lambda: [hub.publish(user_id, POST, data) for user_id in followers])
+
+
+class DatabasePoller:
+    """
+    Publishes inbox changes and new posts committed by other processes to
+    this process's subscribers
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.signatures = {}
+        self._task = None
+        self._lock = threading.Lock()
+        # Post id -> created_at of the posts already published, while they
+        # are inside the lookback window
+        self._posts = {}
+        self._since = None
+
+    def seen(self, post):
+        with self._lock:
+            self._posts[post.pk] = post.created_at
+
+    def poll(self):
+        """
+        Check the subscribed users' unread notifications and followed
+        accounts' posts once, and publish the inboxes that changed since the
+        last poll and the posts not published yet; returns the user ids whose
+        inbox changed
+        """
+        user_ids = self.hub.user_ids()
+        self.signatures = {user_id: self.signatures.get(user_id) for user_id in user_ids}
+        if not user_ids:
+            self._since = None
+            return set()
+        close_old_connections()
+        current = {
+            row['recipient_id']: (row['unread'], row['newest'], row['actors'])
+            for row in Notification.objects.filter(recipient_id__in=user_ids, is_read=False)
+            .values('recipient_id')
+            .annotate(unread=Count('id'), newest=Max('id'), actors=Sum('actor_count'))
+            .order_by()
+        }
+        changed = set()
+        for user_id in user_ids:
+            signature = current.get(user_id, (0, None, None))
+            # A user's first poll publishes too: their stream sent its first
+            # count before the poller knew where the inbox stood
+            if self.signatures[user_id] != signature:
+                changed.add(user_id)
+                self.hub.publish(user_id, NOTIFICATIONS, {'unread': signature[0]})
+            self.signatures[user_id] = signature
+        self.poll_posts(user_ids)
+        return changed
+
+    def poll_posts(self, user_ids):
+        """
+        Publish the recent posts of accounts ``user_ids`` follow that this
+        process has not published yet
+
+        Posts are read by creation time over a window rather than after the
+        highest id seen, so one that commits after a newer id is not missed.
+        Nothing from before polling started is sent.
+        """
+        now = timezone.now()
+        if self._since is None:
+            self._since = now
+        cutoff = max(self._since, now - timedelta(seconds=post_lookback()))
+        rows = list(
+            Post.objects.filter(created_at__gte=cutoff, author__profile__follower_edges__user_id__in=user_ids)
+            .values_list('id', 'author_id', 'created_at', 'author__profile__follower_edges__user_id')
+            .order_by('created_at', 'id')
+        )
+        with self._lock:
+            self._posts = {post_id: created_at for post_id, created_at in self._posts.items() if created_at >= cutoff}
+            published = set(self._posts)
+            for post_id, author_id, created_at, _ in rows:
+                self._posts[post_id] = created_at
+        for post_id, author_id, _, follower_id in rows:
+            if post_id not in published:
+                self.hub.publish(follower_id, POST, {'id': post_id, 'author_id': author_id})
+
+    async def run(self):
+        while self.hub.user_ids():
+            try:
+                await sync_to_async(self.poll)()
+            except Exception:
+                logger.exception('Stream poll failed')
+            await asyncio.sleep(poll_interval())
+
+    def ensure_running(self):
+        """
+        Start polling on the running loop unless it already is
+        """
+        if not polling_enabled():
+            return
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self.run())
+
+
+poller = DatabasePoller(hub)
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+def unread_count(user):
+    """
+    The cached unread count, without keeping a database connection open for
+    the life of the stream
+    """
+    from . import notifications
+    try:
+        return notifications.unread_count(user)
+    finally:
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+async def events(user, once=False):
+    """
+    Server-sent event lines for ``user``: the unread count first, then the
+    user's events as they are published, with a comment line as heartbeat
+
+    With ``once`` the stream ends after the first event, and the client's
+    reconnect delay makes it a plain poll.
+    """
+    yield f'retry: {retry_ms()}\n\n'
+    if once:
+        yield format_event(NOTIFICATIONS, {'unread': await sync_to_async(unread_count)(user)})
+        return
+
+    # Subscribed before the first count, so nothing published meanwhile is lost
+    subscription = hub.subscribe(user.pk)
+    poller.ensure_running()
+    try:
+        yield format_event(NOTIFICATIONS, {'unread': await sync_to_async(unread_count)(user)})
+        while True:
+            messages = await subscription.get(heartbeat_seconds())
+            if not messages:
+                yield ': keep-alive\n\n'
+                continue
+            inbox_changed, unread = False, None
+            for event, data in messages:
+                if event != NOTIFICATIONS:
+                    yield format_event(event, data)
+                    continue
+                inbox_changed = True
+                if data:
+                    # Counted by the poller straight from the database
+                    unread = data['unread']
+            if inbox_changed:
+                # Several inbox changes in one wake-up are sent as one count
+                if unread is None:
+                    unread = await sync_to_async(unread_count)(user)
+                yield format_event(NOTIFICATIONS, {'unread': unread})
+    finally:
+        hub.unsubscribe(subscription)
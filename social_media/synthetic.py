@@ -0,0 +1,177 @@
+# social_media/synthetic.py
+"""
+Synthetic social graph generator for load tests and benchmarks.
+
+Users get a Pareto-distributed popularity weight; each user follows a
+Pareto-distributed number of accounts picked in proportion to popularity, so
+a handful of accounts end up with most of the followers the way real graphs
+do.  Posts, comments and likes are written with bulk_create in fixed-size
+batches, which skips signals, so counters, the post search index and
+timelines are rebuilt at the end in bulk.
+"""
+import bisect
+import itertools
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import counters, post_search, timeline
+from .models import Comment, Follow, Post, Profile
+
+WORDS = (
+    'coffee morning weekend travel music code python django photo sunset city '
+    'friends family food running book movie game coast mountain launch idea '
+    'team build ship release night summer winter garden street art'
+).split()
+TAGS = ['#travel', '#food', '#music', '#tech', '#python', '#django', '#art', '#sports', '#news', '#photo']
+
+
+class GraphGenerator:
+    def __init__(self, users=1000, posts_per_user=5.0, comments_per_post=2.0, likes_per_post=5.0,
+                 follows_per_user=20.0, follow_alpha=1.2, max_follows=2000, days=30,
+                 prefix='synth', password='benchmark', batch_size=5000, seed=None, log=None):
+        self.users = users
+        self.posts_per_user = posts_per_user
+        self.comments_per_post = comments_per_post
+        self.likes_per_post = likes_per_post
+        self.follows_per_user = follows_per_user
+        self.follow_alpha = follow_alpha
+        self.max_follows = max_follows
+        self.days = days
+        self.prefix = prefix
+        self.password = password
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def _batches(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            batch = list(itertools.islice(iterator, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def _heavy_tail(self, mean, cap):
+        """
+        Pareto (shape 2) sample scaled so its mean is roughly ``mean``
+        """
+        return min(int(mean / 2 * self.random.paretovariate(2)), cap)
+
+    def _count(self, mean):
+        return int(self.random.expovariate(1 / mean)) if mean > 0 else 0
+
+    def _timestamp(self):
+        return self.now - timedelta(seconds=self.random.uniform(0, self.days * 86400))
+
+    def _text(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def create_users(self):
+        # Hashing is deliberately slow, so every synthetic user shares one hash
+        password = make_password(self.password)
+        start = User.objects.filter(username__startswith=self.prefix).count()
+        usernames = (f'{self.prefix}{index}' for index in range(start, start + self.users))
+        created = 0
+        for batch in self._batches(usernames):
+            User.objects.bulk_create(
+                [User(username=username, password=password, first_name=username.capitalize()) for username in batch],
+                batch_size=self.batch_size,
+            )
+            user_ids = User.objects.filter(username__in=batch).values_list('id', flat=True)
+            Profile.objects.bulk_create([Profile(user_id=user_id) for user_id in user_ids], batch_size=self.batch_size)
+            created += len(batch)
+            self.log(f'users: {created}/{self.users}')
+        self.user_ids = list(User.objects.filter(username__startswith=self.prefix).order_by('id').values_list('id', flat=True))
+        self.profile_ids = dict(Profile.objects.filter(user_id__in=self.user_ids).values_list('user_id', 'id'))
+
+    def create_follows(self):
+        weights = [self.random.paretovariate(self.follow_alpha) for _ in self.user_ids]
+        cumulative = list(itertools.accumulate(weights))
+        total = cumulative[-1]
+
+        def edges():
+            for follower_id in self.user_ids:
+                targets = set()
+                for _ in range(self._heavy_tail(self.follows_per_user, min(self.max_follows, len(self.user_ids) - 1))):
+                    followee_id = self.user_ids[bisect.bisect_left(cumulative, self.random.uniform(0, total))]
+                    if followee_id != follower_id:
+                        targets.add(followee_id)
+                for followee_id in targets:
+                    yield Follow(profile_id=self.profile_ids[followee_id], user_id=follower_id)
+
+        written = 0
+        for batch in self._batches(edges()):
+            Follow.objects.bulk_create(batch, ignore_conflicts=True)
+            written += len(batch)
+            self.log(f'follows: {written}')
+
+    def create_posts(self):
+        def posts():
+            for author_id in self.user_ids:
+                for _ in range(self._count(self.posts_per_user)):
+                    hashtags = ' '.join(self.random.sample(TAGS, self.random.randint(0, 3)))
+                    yield Post(author_id=author_id, content=self._text(self.random.randint(5, 40)),
+                               hashtags=hashtags, created_at=self._timestamp())
+
+        written = 0
+        for batch in self._batches(posts()):
+            Post.objects.bulk_create(batch)
+            written += len(batch)
+            self.log(f'posts: {written}')
+
+    def create_interactions(self):
+        PostLike = Post.likes.through
+        CommentLike = Comment.likes.through
+        posts = Post.objects.filter(author_id__in=self.user_ids).values_list('id', 'created_at')
+        written = 0
+        for batch in self._batches(posts.iterator(chunk_size=self.batch_size)):
+            comments, likes = [], []
+            for post_id, created_at in batch:
+                for _ in range(self._count(self.comments_per_post)):
+                    comments.append(Comment(
+                        post_id=post_id, author_id=self.random.choice(self.user_ids),
+                        content=self._text(self.random.randint(3, 15)),
+                        created_at=created_at + timedelta(minutes=self.random.randint(1, 600)),
+                    ))
+                likers = set(self.random.choice(self.user_ids) for _ in range(self._count(self.likes_per_post)))
+                likes.extend(PostLike(post_id=post_id, user_id=user_id) for user_id in likers)
+            Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+            PostLike.objects.bulk_create(likes, batch_size=self.batch_size, ignore_conflicts=True)
+
+            comment_ids = Comment.objects.filter(post_id__in=[post_id for post_id, _ in batch]).values_list('id', flat=True)
+            CommentLike.objects.bulk_create(
+                [CommentLike(comment_id=comment_id, user_id=self.random.choice(self.user_ids))
+                 for comment_id in comment_ids if self.random.random() < 0.3],
+                batch_size=self.batch_size, ignore_conflicts=True,
+            )
+            written += len(batch)
+            self.log(f'interactions: {written} posts')
+
+    def finish(self, rebuild_timelines=True):
+        self.log('reconciling counters')
+        counters.reconcile()
+        self.log('indexing posts')
+        post_search.rebuild(batch_size=self.batch_size)
+        if rebuild_timelines:
+            for index, user_id in enumerate(self.user_ids, 1):
+                timeline.rebuild(user_id)
+                if index % self.batch_size == 0:
+                    self.log(f'timelines: {index}/{len(self.user_ids)}')
+
+    def run(self, rebuild_timelines=True):
+        self.create_users()
+        self.create_follows()
+        self.create_posts()
+        self.create_interactions()
+        self.finish(rebuild_timelines)
+        return {
+            'users': len(self.user_ids),
+            'follows': Follow.objects.filter(user_id__in=self.user_ids).count(),
+            'posts': Post.objects.filter(author_id__in=self.user_ids).count(),
+            'comments': Comment.objects.filter(author_id__in=self.user_ids).count(),
+        }
@@ -0,0 +1,26 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from social_media import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(image, renditions, width, alt='', css_class='', style=''):
+    """
+    ``<picture>`` offering the smallest WebP and JPEG renditions at least
+    ``width`` pixels wide, or a plain ``<img>`` of the original until the
+    renditions exist
+    """
+    if not image:
+        return ''
+    jpeg = images.choose(image, renditions, width, webp=False)
+    if jpeg is None:
+        return format_html('<img src="{}" alt="{}" class="{}" style="{}" loading="lazy">', image.url, alt, css_class, style)
+    webp = images.choose(image, renditions, width, webp=True)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}"><img src="{}" alt="{}" class="{}" style="{}" loading="lazy"></picture>',
+        default_storage.url(webp), default_storage.url(jpeg), alt, css_class, style,
+    )
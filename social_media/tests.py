@@ -1,3 +1,1123 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from importlib.util import find_spec
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from social_media_project import settings as project_settings
+
+from . import (
+    actions, caching, counters, graph, images, metrics, notifications, pagination, post_search, query_plans, routers,
+    search, storage, streaming, timeline, trending,
+)
+from .benchmark import Benchmark
+from .models import (
+    Comment, FanoutJob, Follow, ImageJob, MediaBlob, Notification, NotificationEvent, Post, PostHashtag, Profile,
+    TimelineEntry,
+)
+
+
+@override_settings(METRICS_FLUSH_INTERVAL=None)
+class QueryMetricsTests(TransactionTestCase):
+    # Requests read from any replica configured in settings
+    databases = '__all__'
+
+    def setUp(self):
+        metrics.reset()
+        self.user = User.objects.create_user('alice')
+        Post.objects.create(author=self.user, content='hello')
+
+    def test_sync_view_queries_are_counted(self):
+        self.client.force_login(self.user)
+        self.client.get('/api/posts/')
+        self.assertGreater(metrics.report()['post-list-create']['queries']['max'], 0)
+
+    async def test_async_view_queries_are_counted(self):
+        await self.async_client.aforce_login(self.user)
+        for path in ('/api/async/feed/', '/api/async/profiles/alice/', '/api/async/search/users/?query=ali'):
+            response = await self.async_client.get(path)
+            self.assertEqual(response.status_code, 200)
+        await self.async_client.put(f'/api/async/users/{self.user.pk}/follow/')
+        report = await sync_to_async(metrics.report)()
+        for view_name in ('async-feed', 'async-profile', 'async-search-users', 'async-follow-user'):
+            self.assertGreater(report[view_name]['queries']['max'], 0, view_name)
+            self.assertGreater(report[view_name]['db_ms']['max'], 0, view_name)
+
+
+class MetricsSnapshotTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        metrics.reset()
+
+    def _write(self, pid, queries):
+        histogram = metrics.Histogram(metrics.COUNT_BUCKETS)
+        histogram.observe(queries)
+        with open(os.path.join(self.directory.name, f'{pid}.json'), 'w') as handle:
+            json.dump({'views': {'home': {'queries': histogram.to_dict()}}, 'database': {}}, handle)
+
+    def test_snapshots_of_exited_processes_are_pruned(self):
+        # The parent is alive; no process has a pid this large
+        self._write(os.getppid(), 3)
+        self._write(2 ** 30, 7)
+        with self.settings(METRICS_SNAPSHOT_DIR=self.directory.name):
+            report = metrics.report(include_snapshots=True)
+        self.assertEqual(report['home']['queries']['count'], 1)
+        self.assertEqual(report['home']['queries']['max'], 3)
+        self.assertEqual(os.listdir(self.directory.name), [f'{os.getppid()}.json'])
+
+    def test_default_directory_is_keyed_by_the_database(self):
+        directory = metrics.state_dir('metrics')
+        self.assertEqual(metrics.state_dir('metrics'), directory)
+        with mock.patch.dict(connections['default'].settings_dict, NAME='other_project'):
+            self.assertNotEqual(metrics.state_dir('metrics'), directory)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_x'], REPLICA_PIN_SECONDS=60)
+class ReplicaRouterTests(SimpleTestCase):
+    """
+    Routing decisions, which need no replica connection
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.router = routers.ReplicaRouter()
+        self.user = SimpleNamespace(pk=1, is_authenticated=True)
+
+    def _route(self, method, write=False):
+        seen = []
+
+        def view(request):
+            if write:
+                seen.append(self.router.db_for_write(Post))
+            seen.append(self.router.db_for_read(Post))
+            with routers.primary():
+                seen.append(self.router.db_for_read(Post))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)('/')
+        request.user = self.user
+        routers.ReplicaMiddleware(view)(request)
+        return seen
+
+    def test_reads_of_a_read_only_request_go_to_the_replica(self):
+        self.assertEqual(self._route('get'), ['replica_x', 'default'])
+        # Outside a request everything uses the primary
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_writes_go_to_the_primary_and_pin_the_writer(self):
+        self.assertEqual(self._route('get', write=True), ['default', 'default', 'default'])
+        self.assertTrue(routers.is_pinned(self.user.pk))
+        self.assertEqual(self._route('get'), ['default', 'default'])
+
+    def test_unsafe_methods_read_the_primary(self):
+        self.assertEqual(self._route('post'), ['default', 'default'])
+
+
+REPLICAS = settings.DATABASE_REPLICAS
+
+
+@skipUnless(REPLICAS, 'set DATABASE_REPLICA_URLS to run against a replica alias')
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Against the first configured replica, which tests mirror onto the test
+    database, so routing is visible in which connection ran a query
+    """
+    databases = {'default', *REPLICAS}
+
+    def setUp(self):
+        self.replica = REPLICAS[0]
+        self.enterContext(self.settings(DATABASE_REPLICAS=[self.replica]))
+        cache.clear()
+        self.user = User.objects.create_user('alice')
+        self.other = User.objects.create_user('bob')
+        Post.objects.create(author=self.other, content='hello')
+        self.client.force_login(self.user)
+
+    def test_replicas_mirror_the_test_database(self):
+        self.assertEqual(connections[self.replica].settings_dict['TEST']['MIRROR'], 'default')
+
+    def _get(self, path):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[self.replica]) as replica:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in primary], [query['sql'] for query in replica]
+
+    def test_reads_go_to_the_replica(self):
+        primary, replica = self._get('/api/posts/')
+        self.assertTrue(any('social_media_post' in sql for sql in replica))
+        self.assertFalse(any('social_media_post' in sql for sql in primary))
+
+    def test_writes_go_to_the_primary_and_pin_the_writer(self):
+        with CaptureQueriesContext(connections[self.replica]) as replica:
+            response = self.client.post('/api/posts/', {'content': 'mine'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(replica), 0)
+        self.assertTrue(Post.objects.filter(author=self.user, content='mine').exists())
+
+        primary, replica = self._get('/api/posts/')
+        self.assertEqual(replica, [])
+        self.assertTrue(any('social_media_post' in sql for sql in primary))
+
+    def test_cache_fills_read_the_primary(self):
+        Notification.objects.create(recipient=self.user, sender=self.other, notification_type='follow')
+        for path in ('/api/notifications/', '/api/notifications/unread-count/'):
+            primary, replica = self._get(path)
+            self.assertFalse(any('social_media_notification' in sql for sql in replica), path)
+            self.assertTrue(any('social_media_notification' in sql for sql in primary), path)
+        self.assertEqual(notifications.unread_count(self.user), 1)
+
+
+class InboxCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice')
+        self.other = User.objects.create_user('bob')
+        Notification.objects.create(recipient=self.user, sender=self.other, notification_type='follow')
+
+    def test_cached_count_is_dropped_when_the_change_commits(self):
+        self.assertEqual(notifications.unread_count(self.user), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications.mark_read(self.user)
+            # Another request reading now still sees the committed count
+            self.assertEqual(cache.get(notifications.unread_count_cache_key(self.user.pk)), 1)
+        self.assertEqual(notifications.unread_count(self.user), 0)
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class ActionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.post = Post.objects.create(author=self.bob, content='hello')
+
+    def test_replayed_like_is_counted_once(self):
+        for expected in (actions.CHANGED, actions.UNCHANGED):
+            self.assertEqual(actions.apply(self.alice, [('like_post', self.post.pk, True)]), [expected])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.bob, notification_type='like_post').count(), 1)
+
+        for expected in (actions.CHANGED, actions.UNCHANGED):
+            self.assertEqual(actions.apply(self.alice, [('like_post', self.post.pk, False)]), [expected])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_follow_results_and_counts(self):
+        results = actions.apply(self.alice, [
+            ('follow', self.bob.pk, True), ('follow', self.alice.pk, True), ('follow', 0, True),
+        ])
+        self.assertEqual(results, [actions.CHANGED, actions.INVALID, actions.NOT_FOUND])
+        self.assertEqual(actions.apply(self.alice, [('follow', self.bob.pk, True)]), [actions.UNCHANGED])
+        self.assertEqual(Profile.objects.get(user=self.bob).followers_count, 1)
+        self.assertEqual(Profile.objects.get(user=self.alice).following_count, 1)
+
+    def test_last_action_on_a_target_wins(self):
+        results = actions.apply(self.alice, [('like_post', self.post.pk, True), ('like_post', self.post.pk, False)])
+        self.assertEqual(results, [actions.UNCHANGED, actions.UNCHANGED])
+        self.assertFalse(self.post.likes.filter(pk=self.alice.pk).exists())
+
+
+@skipUnless(connection.features.has_select_for_update, 'needs row locks')
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class ConcurrentActionTests(TransactionTestCase):
+    def test_concurrent_likes_and_follows_apply_once(self):
+        alice = User.objects.create_user('alice')
+        bob = User.objects.create_user('bob')
+        post = Post.objects.create(author=bob, content='hello')
+        start = threading.Barrier(4)
+        results, errors = [], []
+
+        def act():
+            try:
+                start.wait()
+                results.extend(actions.apply(alice, [('like_post', post.pk, True), ('follow', bob.pk, True)]))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=act) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(results.count(actions.CHANGED), 2)
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+        self.assertEqual(Notification.objects.filter(recipient=bob, notification_type='like_post').count(), 1)
+        self.assertEqual(Profile.objects.get(user=bob).followers_count, 1)
+
+
+@override_settings(TRENDING_CHECKPOINT_INTERVAL=None)
+class TrendingCheckpointTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(self.settings(TRENDING_CHECKPOINT_DIR=self.directory))
+        trending.reset()
+        self.addCleanup(trending.reset)
+
+    def test_checkpoint_of_an_exited_process_is_adopted_once(self):
+        # Already running when the other process exits
+        trending._get_counters()
+        counter = trending.WindowedCounter()
+        counter.add('django', 5)
+        data = {'hashtags': counter.to_dict(), 'posts': trending.WindowedCounter().to_dict()}
+        with open(os.path.join(self.directory, f'{2 ** 30}.json'), 'w') as handle:
+            json.dump(data, handle)
+
+        first = trending.collect()['hashtags'].score('django')
+        self.assertGreater(first, 0)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertAlmostEqual(trending.collect()['hashtags'].score('django'), first, places=3)
+
+
+@override_settings(TRENDING_CHECKPOINT_INTERVAL=None)
+class TrendingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(self.settings(TRENDING_CHECKPOINT_DIR=directory.name))
+        trending.reset()
+        self.addCleanup(trending.reset)
+        self.alice = User.objects.create_user('alice')
+
+    def _score(self, kind, key):
+        return trending.collect()[kind].score(key)
+
+    def test_posts_and_likes_count_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.alice, content='hello #django')
+            self.assertEqual(self._score('hashtags', 'django'), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            post.likes.add(User.objects.create_user('bob'))
+        self.assertAlmostEqual(self._score('hashtags', 'django'), trending.POST_WEIGHT + trending.LIKE_WEIGHT)
+        self.assertAlmostEqual(self._score('posts', str(post.pk)), trending.LIKE_WEIGHT)
+        self.assertEqual(trending.report()['hashtags'][0][0], 'django')
+
+    def test_rolled_back_writes_are_not_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    post = Post.objects.create(author=self.alice, content='hello #django')
+                    post.likes.add(User.objects.create_user('bob'))
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(self._score('hashtags', 'django'), 0)
+
+    def test_sketch_never_undercounts_and_merges_by_addition(self):
+        sketch, other = trending.CountMinSketch(width=8), trending.CountMinSketch(width=8)
+        for index in range(50):
+            sketch.add(f'tag{index}')
+        self.assertGreaterEqual(sketch.estimate('tag0'), 1)
+        before = sketch.estimate('tag0')
+        other.add('tag0', 3)
+        sketch.merge(other)
+        self.assertEqual(sketch.estimate('tag0'), before + 3)
+
+    @override_settings(TRENDING_BUCKET_SECONDS=60, TRENDING_WINDOW_BUCKETS=2, TRENDING_HALF_LIFE=60)
+    def test_window_decays_and_expires_old_buckets(self):
+        counter = trending.WindowedCounter()
+        counter.add('old', 4, now=0)
+        counter.add('new', 1, now=60)
+        self.assertEqual(counter.score('old', now=60), 4)
+        self.assertEqual(counter.score('old', now=120), 2)
+        self.assertEqual(counter.top(5, now=120), [('new', 1.0)])
+
+
+def jpeg(width=400, height=300):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 10, 10)).save(buffer, 'JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class ImageJobTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(self.settings(MEDIA_ROOT=media.name, IMAGE_RENDITIONS_ASYNC=True))
+        self.user = User.objects.create_user('alice')
+
+    def test_rendered_job_is_attached_and_removed(self):
+        post = Post.objects.create(author=self.user, content='hello', image=jpeg())
+        self.assertEqual(images.process_batch(), 1)
+        post.refresh_from_db()
+        self.assertEqual(post.image_renditions['source'], post.image.name)
+        self.assertEqual(post.image_renditions['thumb']['width'], 150)
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_claimed_jobs_are_skipped_until_the_claim_lapses(self):
+        Post.objects.create(author=self.user, content='hello', image=jpeg())
+        ImageJob.objects.update(claimed_until=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(images.process_batch(), 0)
+        ImageJob.objects.update(claimed_until=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(images.process_batch(), 1)
+
+    def test_job_is_kept_as_failed_after_max_attempts(self):
+        job = ImageJob.objects.create(target='post', object_id=1, source='missing.jpg')
+        with self.assertLogs('social_media.images', 'ERROR') as logs:
+            for _ in range(images.MAX_ATTEMPTS):
+                self.assertEqual(images.process_batch(), 1)
+        self.assertEqual(images.process_batch(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, images.MAX_ATTEMPTS)
+        self.assertIsNotNone(job.failed_at)
+        self.assertIn('post 1 (missing.jpg)', logs.output[0])
+
+    def test_enqueue_revives_a_failed_job(self):
+        post = Post.objects.create(author=self.user, content='hello', image=jpeg())
+        ImageJob.objects.update(attempts=images.MAX_ATTEMPTS, last_error='boom', failed_at=timezone.now())
+        self.assertEqual(images.process_batch(), 0)
+
+        images.enqueue('post', post.pk, post.image.name)
+        job = ImageJob.objects.get()
+        self.assertEqual((job.attempts, job.last_error, job.failed_at), (0, '', None))
+        self.assertEqual(images.process_batch(), 1)
+        post.refresh_from_db()
+        self.assertEqual(post.image_renditions['source'], post.image.name)
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class GraphTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = (User.objects.create_user(name) for name in ('alice', 'bob', 'carol'))
+
+    def _follow(self, user, *others):
+        actions.apply(user, [('follow', other.pk, True) for other in others])
+
+    def _counts(self, user):
+        return Profile.objects.values_list('followers_count', 'following_count').get(user=user)
+
+    def test_follow_and_unfollow_keep_counters_and_cached_sets(self):
+        self.client.force_login(self.alice)
+        self.assertEqual(graph.members(self.alice.pk, [self.bob.pk, self.carol.pk]), set())
+        # The cached sets are expired once the follow commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.put(f'/api/users/{self.bob.pk}/follow/').status_code, 200)
+        self.assertEqual((self._counts(self.alice), self._counts(self.bob)), ((0, 1), (1, 0)))
+        self.assertEqual(graph.members(self.alice.pk, [self.bob.pk, self.carol.pk]), {self.bob.pk})
+        self.assertEqual(graph.members(self.bob.pk, [self.alice.pk], graph.FOLLOWERS), {self.alice.pk})
+        self.assertIsNotNone(Follow.objects.get(user=self.alice).created_at)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/users/{self.bob.pk}/follow/').status_code, 200)
+        self.assertEqual((self._counts(self.alice), self._counts(self.bob)), ((0, 0), (0, 0)))
+        self.assertFalse(graph.is_following(self.alice.pk, self.bob.pk))
+
+    def test_mutual_and_common_follows(self):
+        self._follow(self.alice, self.bob, self.carol)
+        self._follow(self.bob, self.alice, self.carol)
+        self._follow(self.carol, self.alice)
+        self.assertEqual(list(graph.common_following(self.alice.pk, self.bob.pk)), [self.carol.pk])
+        self.assertEqual(list(graph.mutual_follows(self.alice.pk)), [self.bob.pk, self.carol.pk])
+
+        self.client.force_login(self.bob)
+        relationship = self.client.get(f'/api/users/{self.alice.pk}/relationship/').json()
+        self.assertEqual((relationship['following'], relationship['followed_by']), (True, True))
+        self.assertEqual(relationship['followers_you_know'], {'count': 1, 'ids': [self.carol.pk]})
+        self.assertEqual(relationship['common_following'], {'count': 1, 'ids': [self.carol.pk]})
+
+    @override_settings(GRAPH_ADJACENCY_MAX_IDS=1)
+    def test_long_lists_are_answered_from_the_follow_table(self):
+        self._follow(self.alice, self.bob, self.carol)
+        self.assertIsNone(graph.adjacency(self.alice.pk))
+        self.assertEqual(graph.members(self.alice.pk, [self.bob.pk, self.carol.pk]), {self.bob.pk, self.carol.pk})
+        self.assertEqual(list(graph.ids(self.alice.pk)), sorted([self.bob.pk, self.carol.pk]))
+
+    def test_intersect(self):
+        self.assertEqual(graph.intersect([1, 3, 5, 7], [2, 3, 4, 7]), [3, 7])
+        self.assertEqual(graph.intersect([5], list(range(100))), [5])
+        self.assertEqual(graph.intersect([], [1]), [])
+
+
+class ProfilePictureTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(self.settings(MEDIA_ROOT=media.name, IMAGE_RENDITIONS_ASYNC=True))
+        self.user = User.objects.create_user('alice')
+
+    def test_save_without_a_new_picture_is_one_update(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.bio = 'hello'
+        with mock.patch.object(Image, 'open') as image_open, CaptureQueriesContext(connection) as queries:
+            profile.save()
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['UPDATE'])
+        image_open.assert_not_called()
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_user_saves_leave_the_profile_alone(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=['last_login'])
+            self.user.first_name = 'Alice'
+            self.user.save()
+        self.assertFalse([query for query in queries if 'social_media_profile' in query['sql']])
+
+    def test_replaced_picture_is_released(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.profile_picture = jpeg()
+        profile.save()
+        first = profile.profile_picture.name
+        self.assertTrue(default_storage.exists(first))
+
+        profile = Profile.objects.get(user=self.user)
+        profile.profile_picture = jpeg(200, 200)
+        profile.save()
+        self.assertNotEqual(profile.profile_picture.name, first)
+        self.assertEqual(MediaBlob.objects.get(name=first).ref_count, 0)
+        self.assertEqual(ImageJob.objects.get(source=profile.profile_picture.name).target, 'profile')
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class TimelineCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        actions.apply(self.bob, [('follow', self.alice.pk, True)])
+
+    def _ids(self, page):
+        return [post_id for _, post_id in page]
+
+    def test_fan_out_reaches_a_cached_first_page_without_a_generation_change(self):
+        first = Post.objects.create(author=self.alice, content='first')
+        self.assertEqual(self._ids(timeline.read_timeline_keys(self.bob)), [first.pk])
+        generation = caching.generations([('timeline', self.bob.pk)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = Post.objects.create(author=self.alice, content='second')
+        self.assertEqual(caching.generations([('timeline', self.bob.pk)]), generation)
+        self.assertEqual(self._ids(timeline.read_timeline_keys(self.bob)), [second.pk, first.pk])
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class ReadCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.post = Post.objects.create(author=self.alice, content='hello')
+        Comment.objects.create(post=self.post, author=self.bob, content='hi')
+        self.client.force_login(self.alice)
+
+    def _commenter_names(self, path):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(path)
+        data = response.json()
+        comments = data['comments'] if 'comments' in data else data['results']
+        return [comment['author']['first_name'] for comment in comments]
+
+    def test_cached_comments_follow_their_authors(self):
+        paths = [f'/api/posts/{self.post.pk}/', f'/api/posts/{self.post.pk}/comments/']
+        for path in paths:
+            self.assertEqual(self._commenter_names(path), [''])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.first_name = 'Bob'
+            self.bob.save()
+        for path in paths:
+            self.assertEqual(self._commenter_names(path), ['Bob'], path)
+
+
+class QueryPlanTests(TestCase):
+    def test_scan_detection(self):
+        sqlite_plan = '2 0 0 SCAN social_media_post\n3 0 0 SCAN auth_user USING INDEX x\n4 0 0 SCAN CONSTANT ROW'
+        self.assertEqual(query_plans.scanned_tables(sqlite_plan, 'sqlite'), ['social_media_post'])
+        postgres_plan = 'Nested Loop\n  ->  Seq Scan on auth_user\n  ->  Index Scan using post_created_idx on social_media_post'
+        self.assertEqual(query_plans.scanned_tables(postgres_plan, 'postgresql'), ['auth_user'])
+
+    @skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'No scan detection for this database')
+    def test_every_hot_query_uses_an_index(self):
+        out = io.StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('Every hot query uses an index', out.getvalue())
+
+    @skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'No scan detection for this database')
+    def test_a_scanning_query_fails_the_check(self):
+        queries = {**query_plans.HOT_QUERIES, 'by-content': lambda: Post.objects.filter(content='hello').order_by()}
+        with mock.patch.object(query_plans, 'HOT_QUERIES', queries), self.assertRaisesMessage(CommandError, 'by-content'):
+            call_command('check_query_plans', 'by-content', 'post-list', stdout=io.StringIO())
+        with self.assertRaisesMessage(CommandError, 'Unknown queries: nope'):
+            call_command('check_query_plans', 'nope')
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False, TIMELINE_FANOUT_THRESHOLD=2)
+class TimelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.celebrity, self.friend, self.bob, self.carol = (
+            User.objects.create_user(name) for name in ('celebrity', 'friend', 'bob', 'carol')
+        )
+        actions.apply(self.bob, [('follow', self.celebrity.pk, True), ('follow', self.friend.pk, True)])
+        actions.apply(self.carol, [('follow', self.celebrity.pk, True)])
+
+    def _post(self, author, content, minutes_ago):
+        return Post.objects.create(author=author, content=content, created_at=timezone.now() - timedelta(minutes=minutes_ago))
+
+    def test_pushed_and_pulled_posts_are_merged_newest_first(self):
+        posts = [
+            self._post(self.celebrity, 'c1', 5), self._post(self.friend, 'f1', 4),
+            self._post(self.celebrity, 'c2', 3), self._post(self.friend, 'f2', 2),
+        ]
+        # Only the account under the threshold is fanned out
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(owner=self.bob).values_list('post__content', flat=True)), {'f1', 'f2'},
+        )
+
+        seen, cursor = [], None
+        while True:
+            page = timeline.read_timeline(self.bob, cursor, per_page=3)
+            seen += [post.content for post in page]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(seen, [post.content for post in reversed(posts)])
+
+    def test_unfollow_removes_the_author_from_the_timeline(self):
+        self._post(self.friend, 'f1', 1)
+        actions.apply(self.bob, [('follow', self.friend.pk, False)])
+        self.assertEqual(list(timeline.read_timeline(self.bob)), [])
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice')
+        created_at = timezone.now()
+        # Equal timestamps are ordered by id
+        self.posts = [Post.objects.create(author=self.user, content=str(index), created_at=created_at) for index in range(5)]
+
+    def test_cursors_walk_forwards_and_back(self):
+        queryset = Post.objects.all()
+        first = pagination.paginate(queryset, page_size=2)
+        second = pagination.paginate(queryset, first.next_cursor, page_size=2)
+        last = pagination.paginate(queryset, second.next_cursor, page_size=2)
+        newest_first = [post.pk for post in reversed(self.posts)]
+        self.assertEqual([post.pk for page in (first, second, last) for post in page], newest_first)
+        self.assertFalse(first.has_previous())
+        self.assertFalse(last.has_next())
+
+        back = pagination.paginate(queryset, second.previous_cursor, page_size=2)
+        self.assertEqual([post.pk for post in back], newest_first[:2])
+        self.assertFalse(back.has_previous())
+
+    def test_malformed_cursor(self):
+        with self.assertRaises(pagination.InvalidCursor):
+            pagination.decode_cursor('not-a-cursor')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/posts/', {'cursor': 'not-a-cursor'}).status_code, 404)
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class CounterTests(TestCase):
+    def test_reconcile_repairs_drifted_counters(self):
+        alice, bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        post = Post.objects.create(author=alice, content='hello')
+        actions.apply(bob, [('like_post', post.pk, True), ('follow', alice.pk, True)])
+        Post.objects.filter(pk=post.pk).update(likes_count=7)
+        Profile.objects.filter(user=alice).update(followers_count=0)
+
+        report = counters.reconcile(dry_run=True)
+        self.assertEqual((report['Post.likes_count'], report['Profile.followers_count']), (1, 1))
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 7)
+
+        counters.reconcile()
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+        self.assertEqual(Profile.objects.get(user=alice).followers_count, 1)
+        self.assertEqual(set(counters.reconcile(dry_run=True).values()), {0})
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class PostSerializerTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.client.force_login(self.alice)
+
+    def _add_posts(self, count):
+        for index in range(count):
+            commenter = User.objects.create_user(f'commenter{Post.objects.count()}')
+            post = Post.objects.create(author=self.alice, content=f'post {index}')
+            for _ in range(3):
+                Comment.objects.create(post=post, author=commenter, content='hi')
+
+    def _list_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/posts/').status_code, 200)
+        return len(queries)
+
+    def test_post_list_queries_do_not_grow_with_posts_or_comments(self):
+        self._add_posts(2)
+        baseline = self._list_queries()
+        self._add_posts(5)
+        self.assertEqual(self._list_queries(), baseline)
+
+    def test_only_the_latest_comments_are_embedded(self):
+        post = Post.objects.create(author=self.alice, content='hello')
+        comments = [Comment.objects.create(post=post, author=self.alice, content=str(index)) for index in range(5)]
+        [result] = self.client.get('/api/posts/', {'comments': 2}).json()['results']
+        self.assertEqual(result['comments_count'], 5)
+        self.assertEqual([comment['id'] for comment in result['comments']], [comment.pk for comment in comments[-2:]])
+        [result] = self.client.get('/api/posts/', {'comments': 0}).json()['results']
+        self.assertEqual(result['comments'], [])
+
+
+@override_settings(NOTIFICATIONS_ASYNC=True, NOTIFICATION_AGGREGATION=False)
+class NotificationQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.post = Post.objects.create(author=self.alice, content='hello')
+
+    def test_like_request_only_queues_an_event(self):
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.put(f'/api/posts/{self.post.pk}/like/').status_code, 200)
+        self.assertEqual(NotificationEvent.objects.count(), 1)
+        self.assertFalse(Notification.objects.exists())
+
+        out = io.StringIO()
+        call_command('process_notifications', once=True, stdout=out)
+        self.assertIn('Processed 1 events, created 1 notifications', out.getvalue())
+        self.assertFalse(NotificationEvent.objects.exists())
+        self.assertEqual(Notification.objects.get().notification_type, 'like_post')
+
+    def test_duplicates_are_dropped_in_the_batch_and_against_existing_rows(self):
+        for liked in (True, False, True):
+            actions.apply(self.bob, [('like_post', self.post.pk, liked)])
+        self.assertEqual(notifications.process_batch(), (2, 1))
+        actions.apply(self.bob, [('like_post', self.post.pk, False)])
+        actions.apply(self.bob, [('like_post', self.post.pk, True)])
+        self.assertEqual(notifications.process_batch(), (1, 0))
+        self.assertEqual(Notification.objects.count(), 1)
+
+
+@override_settings(NOTIFICATIONS_ASYNC=True, NOTIFICATIONS_FANOUT_CHUNK_SIZE=2)
+class FanoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.followers = [User.objects.create_user(f'follower{index}') for index in range(5)]
+        for user in self.followers:
+            actions.apply(user, [('follow', self.alice.pk, True)])
+        self.post = Post.objects.create(author=self.alice, content='hello')
+
+    def _new_post_recipients(self):
+        return sorted(
+            Notification.objects.filter(notification_type='new_post', post=self.post).values_list('recipient_id', flat=True)
+        )
+
+    def test_fanout_runs_in_chunks_and_reports_progress(self):
+        job = self.post.fanout_job
+        self.assertEqual((job.total_followers, job.delivered), (5, 0))
+        job, notified = notifications.process_fanout_chunk()
+        self.assertEqual((notified, job.delivered, job.last_follower_id), (2, 2, self.followers[1].pk))
+        while notifications.process_fanout_chunk()[0] is not None:
+            pass
+        job.refresh_from_db()
+        self.assertEqual(job.delivered, 5)
+        self.assertIsNotNone(job.completed_at)
+        self.assertEqual(self._new_post_recipients(), [user.pk for user in self.followers])
+
+    def test_interrupted_chunk_is_redone_without_duplicates(self):
+        notifications.process_fanout_chunk()
+        with mock.patch.object(FanoutJob, 'save', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                notifications.process_fanout_chunk()
+        self.assertEqual(len(self._new_post_recipients()), 2)
+        while notifications.process_fanout_chunk()[0] is not None:
+            pass
+        self.assertEqual(self._new_post_recipients(), [user.pk for user in self.followers])
+
+
+class NotificationAggregationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.likers = [User.objects.create_user(f'liker{index}') for index in range(3)]
+        self.post = Post.objects.create(author=self.alice, content='hello')
+
+    def _like(self, user):
+        actions.apply(user, [('like_post', self.post.pk, True)])
+
+    def test_likes_of_a_post_share_one_notification(self):
+        for user in self.likers:
+            self._like(user)
+        self.assertEqual(NotificationEvent.objects.count(), 3)
+        self.assertEqual(notifications.process_batch(), (3, 1))
+
+        [notification] = Notification.objects.filter(recipient=self.alice)
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(notification.recent_actors, [user.pk for user in reversed(self.likers)])
+        self.assertEqual(notification.sender, self.likers[-1])
+
+    def test_read_group_is_not_reopened(self):
+        self._like(self.likers[0])
+        notifications.process_batch()
+        notifications.mark_read(self.alice)
+        self._like(self.likers[1])
+        notifications.process_batch()
+        self.assertEqual(Notification.objects.filter(recipient=self.alice, is_read=False).count(), 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.alice).count(), 2)
+
+    def test_early_actor_beyond_the_display_cap_is_counted_once(self):
+        likers = [User.objects.create_user(f'fan{index}') for index in range(12)]
+        for user in likers:
+            self._like(user)
+            notifications.process_batch()
+        actions.apply(likers[0], [('like_post', self.post.pk, False)])
+        self._like(likers[0])
+        notifications.process_batch()
+
+        [notification] = Notification.objects.filter(recipient=self.alice)
+        self.assertEqual(notification.actor_count, 12)
+        self.assertEqual(notification.recent_actors, [user.pk for user in reversed(likers)][:10])
+
+    def test_own_actions_are_not_notified(self):
+        self._like(self.alice)
+        self.assertFalse(NotificationEvent.objects.exists())
+
+
+class PostSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.client.force_login(self.alice)
+
+    def _tags(self, post):
+        return set(PostHashtag.objects.filter(post=post).values_list('hashtag__name', flat=True))
+
+    def test_tags_follow_edits_and_deletes(self):
+        post = Post.objects.create(author=self.alice, content='learning #Rust', hashtags='Python, #django')
+        self.assertEqual(self._tags(post), {'python', 'django', 'rust'})
+        post.content = 'learning'
+        post.save()
+        self.assertEqual(self._tags(post), {'python', 'django'})
+        post.delete()
+        self.assertFalse(PostHashtag.objects.exists())
+
+    def test_tag_feed_is_newest_first(self):
+        older = Post.objects.create(author=self.alice, content='#python one')
+        newer = Post.objects.create(author=self.alice, content='#python two')
+        Post.objects.create(author=self.alice, content='#rust three')
+        results = self.client.get('/api/tags/Python/posts/').json()['results']
+        self.assertEqual([post['id'] for post in results], [newer.pk, older.pk])
+        self.assertEqual(self.client.get('/api/tags/unknown/posts/').json()['results'], [])
+
+    def test_keyword_search_needs_every_term_and_ranks_by_frequency(self):
+        once = Post.objects.create(author=self.alice, content='django orm tips')
+        twice = Post.objects.create(author=self.alice, content='django django orm')
+        Post.objects.create(author=self.alice, content='flask tips')
+        self.assertEqual(post_search.search_post_ids('Django ORM'), [twice.pk, once.pk])
+        self.assertEqual(post_search.search_post_ids('django flask'), [])
+        self.assertEqual(post_search.search_post_ids('the'), [])
+        results = self.client.get('/api/posts/search/', {'q': 'orm', 'limit': 1, 'offset': 1}).json()['results']
+        self.assertEqual([post['id'] for post in results], [once.pk])
+
+    @override_settings(POST_SEARCH_CANDIDATE_LIMIT=1)
+    def test_terms_cut_off_by_the_candidate_cap_are_checked_directly(self):
+        match = Post.objects.create(author=self.alice, content='django orm')
+        Post.objects.create(author=self.alice, content='orm again')
+        self.assertEqual(post_search.search_post_ids('django orm'), [match.pk])
+
+
+class CacheGenerationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def _read(self):
+        def compute():
+            self.calls += 1
+            return self.calls
+        return caching.read_through('test', ['key'], [('post', 1), ('user', 2)], compute)
+
+    def test_bump_expires_entries_once_committed(self):
+        self.assertEqual((self._read(), self._read()), (1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            caching.bump('user', 2)
+            # Not yet: a reader inside the transaction still gets the old entry
+            self.assertEqual(self._read(), 1)
+        self.assertEqual(self._read(), 2)
+
+    def test_rolled_back_bump_changes_nothing(self):
+        self._read()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            caching.bump('post', 1)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self._read(), 1)
+
+    def test_lost_generation_never_resurrects_entries(self):
+        self._read()
+        cache.delete('gen:post:1')
+        self.assertEqual(self._read(), 2)
+
+
+class StorageTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = storage.ContentAddressedStorage(location=directory.name)
+
+    def _blob(self, name):
+        return MediaBlob.objects.get(name=name)
+
+    def test_identical_uploads_share_one_counted_file(self):
+        first = self.storage.save('a.jpg', ContentFile(b'same bytes'))
+        second = self.storage.save('b.JPG', ContentFile(b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertTrue(storage.is_blob(first))
+        self.assertEqual(self._blob(first).ref_count, 2)
+
+        self.storage.delete(first)
+        self.assertEqual(self._blob(first).ref_count, 1)
+        self.assertTrue(self.storage.exists(first))
+        self.assertEqual(storage.collect_garbage(self.storage, grace_seconds=0), (0, 0))
+
+        self.storage.delete(first)
+        self.assertEqual(storage.collect_garbage(self.storage, grace_seconds=0), (1, len(b'same bytes')))
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_grace_period_keeps_recently_released_blobs(self):
+        name = self.storage.save('a.jpg', ContentFile(b'bytes'))
+        self.storage.delete(name)
+        self.assertEqual(storage.collect_garbage(self.storage, grace_seconds=3600), (0, 0))
+        self.assertTrue(self.storage.exists(name))
+
+    def test_recount_restores_counts_from_references(self):
+        user = User.objects.create_user('alice')
+        with self.settings(IMAGE_RENDITIONS_ASYNC=True):
+            post = Post.objects.create(author=user, content='hello', image=storage.blob_name('0' * 64, '.jpg'))
+        MediaBlob.objects.create(name=post.image.name, ref_count=5)
+        self.assertEqual(storage.recount(), 1)
+        self.assertEqual(self._blob(post.image.name).ref_count, 1)
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class AsyncViewTests(TransactionTestCase):
+    # Requests read from any replica configured in settings
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.post = Post.objects.create(author=self.bob, content='hello')
+
+    async def test_anonymous_requests_are_refused(self):
+        response = await self.async_client.get('/api/async/feed/')
+        self.assertEqual(response.status_code, 403)
+
+    async def test_follow_then_feed(self):
+        await self.async_client.aforce_login(self.alice)
+        path = f'/api/async/users/{self.bob.pk}/follow/'
+        first, again = await self.async_client.put(path), await self.async_client.put(path)
+        self.assertEqual((first.json()['changed'], again.json()['changed']), (True, False))
+
+        feed = (await self.async_client.get('/api/async/feed/')).json()
+        self.assertEqual([post['id'] for post in feed['results']], [self.post.pk])
+        self.assertIsNone(feed['next'])
+
+        profile = (await self.async_client.get('/api/async/profiles/bob/')).json()
+        self.assertTrue(profile['is_following'])
+        self.assertEqual(profile['profile']['followers_count'], 1)
+        self.assertEqual((await self.async_client.get('/api/async/profiles/nobody/')).status_code, 404)
+
+    async def test_like_is_idempotent(self):
+        await self.async_client.aforce_login(self.alice)
+        path = f'/api/async/posts/{self.post.pk}/like/'
+        for _ in range(2):
+            self.assertEqual((await self.async_client.put(path)).status_code, 200)
+        await self.post.arefresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual((await self.async_client.put('/api/async/posts/0/like/')).status_code, 404)
+
+
+@override_settings(STREAM_DB_POLLING=False, NOTIFICATIONS_ASYNC=False)
+class StreamTests(TransactionTestCase):
+    # Requests read from any replica configured in settings
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        actions.apply(self.alice, [('follow', self.bob.pk, True)])
+        self.poller = streaming.DatabasePoller(streaming.hub)
+        self.enterContext(mock.patch.object(streaming, 'poller', self.poller))
+
+    async def _open(self):
+        await self.async_client.aforce_login(self.alice)
+        response = await self.async_client.get('/api/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        self.assertEqual(await anext(stream), b'event: notifications\ndata: {"unread":0}\n\n')
+        return stream
+
+    async def test_published_events_reach_the_stream(self):
+        stream = await self._open()
+        post = await sync_to_async(Post.objects.create)(author=self.bob, content='hello')
+        event = f'event: post\ndata: {{"id":{post.pk},"author_id":{self.bob.pk}}}\n\n'
+        self.assertEqual(await anext(stream), event.encode())
+        # The new-post notification
+        self.assertEqual(await anext(stream), b'event: notifications\ndata: {"unread":1}\n\n')
+        await stream.aclose()
+
+    async def test_disconnect_unsubscribes(self):
+        stream = await self._open()
+        self.assertIn(self.alice.pk, streaming.hub.user_ids())
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.01)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertNotIn(self.alice.pk, streaming.hub.user_ids())
+
+    async def _posts(self, subscription, timeout=1):
+        return [message for message in await subscription.get(timeout) if message[0] == streaming.POST]
+
+    async def test_poller_publishes_posts_written_elsewhere_once(self):
+        subscription = streaming.hub.subscribe(self.alice.pk)
+        self.addCleanup(streaming.hub.unsubscribe, subscription)
+        await sync_to_async(self.poller.poll)()
+        self.assertEqual(await subscription.get(1), [(streaming.NOTIFICATIONS, {'unread': 0})])
+
+        # bulk_create sends no signals, like a post saved by another process
+        followed, other = await sync_to_async(Post.objects.bulk_create)([
+            Post(author=self.bob, content='elsewhere'),
+            Post(author=self.alice, content='own post'),
+        ])
+        local = await sync_to_async(Post.objects.create)(author=self.bob, content='here')
+        self.assertEqual(await self._posts(subscription), [(streaming.POST, {'id': local.pk, 'author_id': self.bob.pk})])
+
+        for _ in range(2):
+            await sync_to_async(self.poller.poll)()
+        self.assertEqual(await self._posts(subscription), [(streaming.POST, {'id': followed.pk, 'author_id': self.bob.pk})])
+        self.assertEqual(await self._posts(subscription, 0.05), [])
+
+
+class BenchmarkTests(TestCase):
+    def test_write_scenarios_leave_no_posts_behind(self):
+        User.objects.create_user('alice')
+        benchmark = Benchmark(requests=3, warmup=1, include_writes=True, only=['create-post', 'like-post'])
+        results = benchmark.run()['results']
+        self.assertEqual(results['create-post']['requests'], 3)
+        self.assertEqual(results['create-post']['errors'], 0)
+        self.assertFalse(Post.objects.exists())
+
+    def test_server_errors_are_counted_not_raised(self):
+        User.objects.create_user('alice')
+        benchmark = Benchmark(requests=2, warmup=0, only=['post-list'])
+        with mock.patch('social_media.views.PostListCreateView.list', side_effect=RuntimeError):
+            result = benchmark.run()['results']['post-list']
+        self.assertEqual(result['errors'], 2)
+
+
+@override_settings(USER_SEARCH_BACKEND='memory')
+class UserSearchTests(TestCase):
+    def setUp(self):
+        search.memory_index.reset()
+        self.addCleanup(search.memory_index.reset)
+
+    def test_exact_then_username_prefix_then_name_prefix(self):
+        annie = User.objects.create_user('zed', first_name='Annie')
+        annabel = User.objects.create_user('annabel')
+        ann = User.objects.create_user('ann')
+        User.objects.create_user('bob')
+        self.assertEqual(search.search_user_ids('Ann'), [ann.pk, annabel.pk, annie.pk])
+
+    def test_prefix_matches_last_name(self):
+        smith = User.objects.create_user('js', first_name='Jane', last_name='Smith')
+        User.objects.create_user('other', last_name='Jones')
+        self.assertEqual(search.search_user_ids('smi'), [smith.pk])
+
+    def test_trigram_match_tolerates_typos(self):
+        jonathan = User.objects.create_user('jonathan')
+        self.assertEqual(search.search_user_ids('jonathon'), [jonathan.pk])
+        self.assertEqual(search.search_user_ids('xyzzy'), [])
+
+    def test_index_follows_user_changes(self):
+        user = User.objects.create_user('carol')
+        searcher = User.objects.create_user('carolyn')
+        self.assertEqual(search.search_user_ids('carol', exclude_user_id=searcher.pk), [user.pk])
+        user.username = 'dave'
+        user.save()
+        self.assertEqual(search.search_user_ids('carol', exclude_user_id=searcher.pk), [])
+        self.assertEqual(search.search_user_ids('dave'), [user.pk])
+        user.delete()
+        self.assertEqual(search.search_user_ids('dave'), [])
+
+    def test_full_name_compiles_to_the_index_expression(self):
+        sql = str(User.objects.annotate(full_name=search.FullName()).query)
+        self.assertIn('LOWER("auth_user"."first_name" || \' \' || "auth_user"."last_name")', sql)
+        self.assertNotIn('COALESCE', sql)
+
+    def test_user_search_plan_is_only_checked_on_postgres(self):
+        self.assertIn('user-search', query_plans.HOT_QUERIES)
+        checked = [name for name, _, _ in query_plans.check(['user-search'])]
+        self.assertEqual(checked, ['user-search'] if connection.vendor == 'postgresql' else [])
+
+
+class DatabasePoolSettingsTests(SimpleTestCase):
+    def setUp(self):
+        postgres = {'default': {'ENGINE': 'django.db.backends.postgresql'}}
+        self.enterContext(mock.patch.object(project_settings, 'DATABASES', postgres))
+
+    def _options(self, mode):
+        with mock.patch.object(project_settings, 'DB_POOL', mode):
+            return project_settings._database_pool_options()
+
+    def test_off_and_other_engines_do_not_pool(self):
+        self.assertIsNone(self._options('off'))
+        project_settings.DATABASES['default']['ENGINE'] = 'django.db.backends.sqlite3'
+        self.assertIsNone(self._options('on'))
+
+    def test_auto_warns_when_psycopg_pool_is_missing(self):
+        with mock.patch.dict(sys.modules, {'psycopg_pool': None}):
+            with self.assertWarnsRegex(RuntimeWarning, 'psycopg_pool is not installed'):
+                self.assertIsNone(self._options('auto'))
+            with self.assertRaises(ImportError):
+                self._options('on')
+
+    @skipUnless(find_spec('psycopg') and find_spec('psycopg_pool'), 'psycopg 3 and psycopg_pool are not installed')
+    def test_pool_options_follow_the_settings(self):
+        options = self._options('auto')
+        self.assertEqual(
+            {key: options[key] for key in ('min_size', 'max_size', 'timeout', 'max_idle')},
+            {
+                'min_size': project_settings.DB_POOL_MIN_SIZE,
+                'max_size': project_settings.DB_POOL_MAX_SIZE,
+                'timeout': project_settings.DB_POOL_TIMEOUT,
+                'max_idle': project_settings.DB_POOL_MAX_IDLE,
+            },
+        )
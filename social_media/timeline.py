@@ -0,0 +1,223 @@
+# social_media/timeline.py
+"""
+Precomputed home timelines.
+
+Every post id is pushed into a TimelineEntry row for each follower of its
+author when the post is created (fan-out on write), so reading the home feed
+is a single indexed range scan instead of a join over everyone the reader
+follows.  Authors with more than TIMELINE_FANOUT_THRESHOLD followers are not
+fanned out; their posts are pulled at read time and merged in (hybrid mode).
+
+The ids on each feed page are cached against the reader's ``timeline``
+generation, changed when follows and unfollows add or remove entries, and
+the ``authored`` generations of the pull authors they follow.  Fan-out does
+not change generations, which would cost one cache write per follower:
+only pages reaching the top of a timeline can gain its new entries, and
+those are keyed on the timeline's newest entry, one index-only lookup.
+Posts are loaded fresh, so edits and counters never wait for a cached page
+to expire.
+"""
+import heapq
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import caching, graph, pagination, routers
+from .models import Follow, Post, Profile, TimelineEntry
+
+
+def fanout_threshold():
+    return getattr(settings, 'TIMELINE_FANOUT_THRESHOLD', 10000)
+
+
+def backfill_size():
+    return getattr(settings, 'TIMELINE_BACKFILL_SIZE', 200)
+
+
+def batch_size():
+    return getattr(settings, 'TIMELINE_FANOUT_BATCH_SIZE', 1000)
+
+
+def pull_accounts_timeout():
+    return getattr(settings, 'TIMELINE_PULL_ACCOUNTS_TIMEOUT', 60)
+
+
+def follower_id_chunks(author_id, chunk_size=None, after=0):
+    """
+    Yield lists of the user ids following ``author_id``, in id order
+
+    Each chunk is its own keyset query on the follow table's
+    ``(profile_id, user_id)`` index, so iteration holds no long-lived cursor
+    and can resume from the last id of any chunk.
+    """
+    chunk_size = chunk_size or batch_size()
+    while True:
+        chunk = list(
+            Follow.objects.filter(profile__user_id=author_id, user_id__gt=after)
+            .order_by('user_id')
+            .values_list('user_id', flat=True)[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1]
+
+
+def is_pull_author(author_id):
+    """
+    High-follower authors are read on demand instead of fanned out
+    """
+    return Profile.objects.filter(user_id=author_id, followers_count__gte=fanout_threshold()).exists()
+
+
+def pull_accounts():
+    """
+    Sorted ids of every pull-mode account, cached for
+    TIMELINE_PULL_ACCOUNTS_TIMEOUT seconds
+    """
+    key = f'timeline-pull-accounts:{fanout_threshold()}'
+    accounts = cache.get(key)
+    if accounts is None:
+        with routers.primary():
+            accounts = array('q', sorted(
+                Profile.objects.filter(followers_count__gte=fanout_threshold()).values_list('user_id', flat=True)
+            ))
+        cache.set(key, accounts, pull_accounts_timeout())
+    return accounts
+
+
+def pull_author_ids(user):
+    """
+    Ids of the accounts ``user`` follows whose posts are merged at read time
+    """
+    following = graph.adjacency(user.pk)
+    if following is None:
+        return list(
+            Profile.objects.filter(followers=user, followers_count__gte=fanout_threshold())
+            .values_list('user_id', flat=True)
+        )
+    return graph.intersect(following, pull_accounts())
+
+
+def _write_entries(owner_ids, post_id, created_at):
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=owner_id, post_id=post_id, created_at=created_at) for owner_id in owner_ids],
+        ignore_conflicts=True,
+    )
+
+
+def fan_out_post(post):
+    """
+    Push a newly created post into its author's and followers' timelines
+    """
+    _write_entries([post.author_id], post.id, post.created_at)
+    if not is_pull_author(post.author_id):
+        for chunk in follower_id_chunks(post.author_id):
+            _write_entries(chunk, post.id, post.created_at)
+
+
+def backfill(follower_id, author_ids):
+    """
+    Copy the most recent posts of newly followed authors into a timeline
+    """
+    # Also changes which pull authors the timeline merges
+    caching.bump('timeline', follower_id)
+    pulled = set(
+        Profile.objects.filter(user_id__in=author_ids, followers_count__gte=fanout_threshold())
+        .values_list('user_id', flat=True)
+    )
+    # A pull author still sees their own posts in their own timeline
+    author_ids = [author_id for author_id in author_ids if author_id == follower_id or author_id not in pulled]
+    if not author_ids:
+        return
+    recent = (
+        Post.objects.filter(author_id__in=author_ids)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'created_at')[:backfill_size()]
+    )
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=follower_id, post_id=post_id, created_at=created_at) for post_id, created_at in recent],
+        ignore_conflicts=True,
+    )
+
+
+def remove_authors(follower_id, author_ids):
+    """
+    Drop posts of unfollowed authors from a timeline
+    """
+    caching.bump('timeline', follower_id)
+    TimelineEntry.objects.filter(owner_id=follower_id, post__author_id__in=author_ids).delete()
+
+
+def rebuild(user_id):
+    """
+    Recreate a single user's timeline from the follow graph
+    """
+    followed = Follow.objects.filter(user_id=user_id).values_list('profile__user_id', flat=True)
+    TimelineEntry.objects.filter(owner_id=user_id).delete()
+    backfill(user_id, [user_id, *followed])
+
+
+def _page_keys(user, key, direction, per_page, pulled_authors):
+    window = per_page + 1
+    pushed = pagination.keyset_filter(
+        TimelineEntry.objects.filter(owner=user), key, direction, pk_field='post_id'
+    ).values_list('created_at', 'post_id')[:window]
+    sources = [list(pushed)]
+    if pulled_authors:
+        sources.append(list(pagination.keyset_filter(
+            Post.objects.filter(author_id__in=pulled_authors), key, direction
+        ).values_list('created_at', 'id')[:window]))
+
+    keys = []
+    seen = set()
+    for row in heapq.merge(*sources, reverse=direction == pagination.NEXT):
+        if row[1] not in seen:
+            seen.add(row[1])
+            keys.append(row)
+    return pagination.build_page(keys[:window], per_page, key, direction, lambda row: row)
+
+
+def newest_entry(user_id):
+    """
+    ``(created_at, post_id)`` of the newest entry in a timeline, or None
+    """
+    return (
+        TimelineEntry.objects.filter(owner_id=user_id)
+        .order_by('-created_at', '-post_id')
+        .values_list('created_at', 'post_id')
+        .first()
+    )
+
+
+def read_timeline_keys(user, cursor=None, per_page=10):
+    """
+    Return a KeysetPage of ``(created_at, post_id)`` for ``user``'s home feed
+
+    Raises pagination.InvalidCursor for a malformed cursor.
+    """
+    key, direction = pagination.decode_cursor(cursor) if cursor else (None, pagination.NEXT)
+    generation = ('timeline', user.pk)
+    pulled_authors = pull_author_ids(user)
+    parts = [user.pk, cursor, per_page]
+    if key is None or direction == pagination.PREVIOUS:
+        # Fanned-out posts only ever land above the pages further down
+        parts.append(newest_entry(user.pk))
+    return caching.read_through(
+        'timeline', parts,
+        [generation, *(('authored', author_id) for author_id in pulled_authors)],
+        lambda: _page_keys(user, key, direction, per_page, pulled_authors),
+    )
+
+
+def read_timeline(user, cursor=None, per_page=10):
+    """
+    Return a KeysetPage of posts for ``user``'s home feed
+
+    Raises pagination.InvalidCursor for a malformed cursor.
+    """
+    page = read_timeline_keys(user, cursor, per_page)
+    posts = Post.objects.select_related('author__profile').in_bulk([post_id for _, post_id in page])
+    page.object_list = [posts[post_id] for _, post_id in page if post_id in posts]
+    return page
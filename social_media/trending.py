@@ -0,0 +1,385 @@
+# social_media/trending.py
+"""
+Trending hashtags and posts from a streaming, time-decayed aggregator.
+
+The Post and like receivers call ``record_post`` and ``record_likes``; no
+query runs to compute trends.  Each kind (hashtags, posts) is a
+WindowedCounter: a ring of TRENDING_BUCKET_SECONDS buckets, each holding a
+count-min sketch of that bucket's weights plus a bounded heap of its heavy
+hitters.  A score is the sum of the sketch estimates over the live buckets,
+each halved every TRENDING_HALF_LIFE seconds of age, and the top K is read
+from the union of the buckets' heavy hitters.
+
+State lives in process memory.  Like metrics.py, each process checkpoints
+itself to TRENDING_CHECKPOINT_DIR (by default a temp directory keyed by the
+database) every TRENDING_CHECKPOINT_INTERVAL seconds and at exit;
+``report`` merges every live checkpoint (sketches with the same dimensions
+merge by addition).  The checkpoints of processes that are gone are adopted
+by the next process that starts or reports, so a deploy does not reset the
+window and dead processes' files do not pile up.
+"""
+import atexit
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import process_alive, state_dir
+from .post_search import parse_hashtags
+
+SKETCH_WIDTH = 1024
+SKETCH_DEPTH = 4
+HEAVY_HITTERS = 100
+POST_WEIGHT = 1.0
+LIKE_WEIGHT = 1.0
+KINDS = ('hashtags', 'posts')
+REPORT_CACHE_KEY = 'trending_report'
+
+
+def enabled():
+    return getattr(settings, 'TRENDING_ENABLED', True)
+
+
+def bucket_seconds():
+    return getattr(settings, 'TRENDING_BUCKET_SECONDS', 300)
+
+
+def window_buckets():
+    return getattr(settings, 'TRENDING_WINDOW_BUCKETS', 12)
+
+
+def half_life():
+    return getattr(settings, 'TRENDING_HALF_LIFE', 1800)
+
+
+def cache_timeout():
+    return getattr(settings, 'TRENDING_CACHE_TIMEOUT', 30)
+
+
+class CountMinSketch:
+    """
+    Fixed-size frequency estimates that never under-count; the hashes are
+    stable across processes so sketches can be merged
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, rows=None):
+        self.width = width
+        self.depth = depth
+        self.rows = rows or [[0.0] * width for _ in range(depth)]
+
+    def _indexes(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return [(first + row * second) % self.width for row in range(self.depth)]
+
+    def add(self, key, amount=1.0):
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += amount
+            estimate = row[index] if estimate is None else min(estimate, row[index])
+        return estimate
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+    def merge(self, other):
+        for row, other_row in zip(self.rows, other.rows):
+            for index, value in enumerate(other_row):
+                if value:
+                    row[index] += value
+
+    def to_dict(self):
+        # Sparse: most cells of a short bucket are empty
+        return [{index: value for index, value in enumerate(row) if value} for row in self.rows]
+
+    @classmethod
+    def from_dict(cls, data, width=SKETCH_WIDTH):
+        rows = []
+        for cells in data:
+            row = [0.0] * width
+            for index, value in cells.items():
+                row[int(index)] = value
+            rows.append(row)
+        return cls(width, len(rows), rows)
+
+
+class TopK:
+    """
+    Heavy hitters by estimated count: a dict of the tracked keys plus a
+    min-heap with lazily discarded stale entries
+    """
+
+    def __init__(self, capacity=HEAVY_HITTERS):
+        self.capacity = capacity
+        self.counts = {}
+        self.heap = []
+
+    def offer(self, key, estimate):
+        if key not in self.counts and len(self.counts) >= self.capacity:
+            floor_key, floor = self._minimum()
+            if estimate <= floor:
+                return
+            del self.counts[floor_key]
+        self.counts[key] = estimate
+        heapq.heappush(self.heap, (estimate, key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, key) for key, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def _minimum(self):
+        while True:
+            count, key = self.heap[0]
+            if self.counts.get(key) == count:
+                return key, count
+            heapq.heappop(self.heap)
+
+
+class Bucket:
+    def __init__(self, start, sketch=None, top=None):
+        self.start = start
+        self.sketch = sketch or CountMinSketch()
+        self.top = top or TopK()
+
+    def add(self, key, amount):
+        self.top.offer(key, self.sketch.add(key, amount))
+
+
+class WindowedCounter:
+    """
+    Decayed counts over the last TRENDING_WINDOW_BUCKETS time buckets
+    """
+
+    def __init__(self):
+        self.buckets = {}
+
+    def _expire(self, now):
+        oldest = self._start(now) - (window_buckets() - 1) * bucket_seconds()
+        for start in [start for start in self.buckets if start < oldest]:
+            del self.buckets[start]
+
+    @staticmethod
+    def _start(now):
+        return int(now // bucket_seconds() * bucket_seconds())
+
+    def add(self, key, amount=1.0, now=None):
+        now = time.time() if now is None else now
+        start = self._start(now)
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            self._expire(now)
+            bucket = self.buckets[start] = Bucket(start)
+        bucket.add(key, amount)
+
+    def score(self, key, now=None):
+        now = time.time() if now is None else now
+        # A bucket ages from its end, so the current one counts in full
+        return sum(
+            0.5 ** (max(0, now - start - bucket_seconds()) / half_life()) * bucket.sketch.estimate(key)
+            for start, bucket in self.buckets.items()
+        )
+
+    def top(self, limit, now=None):
+        now = time.time() if now is None else now
+        self._expire(now)
+        candidates = {key for bucket in self.buckets.values() for key in bucket.top.counts}
+        scored = ((self.score(key, now), key) for key in candidates)
+        return [(key, round(score, 3)) for score, key in heapq.nlargest(limit, scored) if score > 0]
+
+    def merge(self, other):
+        for start, theirs in other.buckets.items():
+            ours = self.buckets.get(start)
+            if ours is None:
+                self.buckets[start] = theirs
+                continue
+            ours.sketch.merge(theirs.sketch)
+            for key in set(ours.top.counts) | set(theirs.top.counts):
+                ours.top.offer(key, ours.sketch.estimate(key))
+
+    def to_dict(self):
+        return {
+            str(start): {'sketch': bucket.sketch.to_dict(), 'top': dict(bucket.top.counts)}
+            for start, bucket in self.buckets.items()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        counter = cls()
+        for start, bucket_data in data.items():
+            bucket = Bucket(int(start), CountMinSketch.from_dict(bucket_data['sketch']))
+            for key, count in bucket_data['top'].items():
+                bucket.top.offer(key, count)
+            counter.buckets[bucket.start] = bucket
+        return counter
+
+
+_lock = threading.Lock()
+_counters = None
+_last_checkpoint = time.monotonic()
+
+
+def _checkpoint_dir():
+    return getattr(settings, 'TRENDING_CHECKPOINT_DIR', None) or state_dir('trending')
+
+
+def _own_path():
+    return os.path.join(_checkpoint_dir(), f'{os.getpid()}.json')
+
+
+def _load(path):
+    with open(path) as handle:
+        data = json.load(handle)
+    return {kind: WindowedCounter.from_dict(data.get(kind, {})) for kind in KINDS}
+
+
+def _adopt_orphans(counters):
+    """
+    Merge and remove the checkpoints of processes that no longer exist
+    """
+    directory = _checkpoint_dir()
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        name, extension = os.path.splitext(filename)
+        if extension != '.json' or not name.isdigit() or process_alive(int(name)):
+            continue
+        claimed = os.path.join(directory, f'{name}.adopting-{os.getpid()}')
+        try:
+            # Only one restarting process wins the rename
+            os.rename(os.path.join(directory, filename), claimed)
+            orphan = _load(claimed)
+        except (OSError, ValueError, KeyError):
+            continue
+        finally:
+            if os.path.exists(claimed):
+                os.remove(claimed)
+        for kind in KINDS:
+            counters[kind].merge(orphan[kind])
+
+
+def _get_counters():
+    global _counters
+    if _counters is None:
+        counters = {kind: WindowedCounter() for kind in KINDS}
+        try:
+            _adopt_orphans(counters)
+        except OSError:
+            pass
+        _counters = counters
+        atexit.register(checkpoint)
+    return _counters
+
+
+def _record(items, now=None):
+    if not enabled():
+        return
+    with _lock:
+        counters = _get_counters()
+        for kind, key, amount in items:
+            counters[kind].add(key, amount, now)
+    _maybe_checkpoint()
+
+
+def record_post(post, now=None):
+    """
+    A new post counts towards each of its hashtags
+    """
+    _record([('hashtags', tag, POST_WEIGHT) for tag in parse_hashtags(post.hashtags, post.content)], now)
+
+
+def record_likes(posts, now=None):
+    """
+    ``posts`` is ``[(post_id, hashtags, content, likes)]``; a like counts
+    towards the post and each of its hashtags
+    """
+    items = []
+    for post_id, hashtags, content, likes in posts:
+        items.append(('posts', str(post_id), LIKE_WEIGHT * likes))
+        items.extend(('hashtags', tag, LIKE_WEIGHT * likes) for tag in parse_hashtags(hashtags, content))
+    _record(items, now)
+
+
+def checkpoint():
+    """
+    Write this process's window to the shared checkpoint directory
+    """
+    global _last_checkpoint
+    _last_checkpoint = time.monotonic()
+    with _lock:
+        if _counters is None:
+            return
+        data = {kind: counter.to_dict() for kind, counter in _counters.items()}
+    directory = _checkpoint_dir()
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as handle:
+        json.dump(data, handle)
+    os.replace(tmp_path, _own_path())
+
+
+def _maybe_checkpoint():
+    interval = getattr(settings, 'TRENDING_CHECKPOINT_INTERVAL', 60)
+    if interval is not None and time.monotonic() - _last_checkpoint >= interval:
+        try:
+            checkpoint()
+        except OSError:
+            pass
+
+
+def reset():
+    global _counters
+    with _lock:
+        _counters = None
+    cache.delete(REPORT_CACHE_KEY)
+
+
+def collect():
+    """
+    This process's counters merged with every other process's checkpoint
+    """
+    with _lock:
+        counters = _get_counters()
+        try:
+            _adopt_orphans(counters)
+        except OSError:
+            pass
+        # Copied first, so the files read below are the live processes' only
+        own = {kind: WindowedCounter.from_dict(counter.to_dict()) for kind, counter in counters.items()}
+    merged = {kind: WindowedCounter() for kind in KINDS}
+    directory = _checkpoint_dir()
+    own_path = _own_path()
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            if not filename.endswith('.json') or path == own_path:
+                continue
+            try:
+                other = _load(path)
+            except (OSError, ValueError, KeyError):
+                continue
+            for kind in KINDS:
+                merged[kind].merge(other[kind])
+    for kind in KINDS:
+        merged[kind].merge(own[kind])
+    return merged
+
+
+def report(limit=10):
+    """
+    ``{'hashtags': [(tag, score)], 'posts': [(post_id, score)]}``, cached for
+    TRENDING_CACHE_TIMEOUT seconds
+    """
+    cached = cache.get(REPORT_CACHE_KEY)
+    if cached is None or cached['limit'] < limit:
+        counters = collect()
+        cached = {'limit': limit, **{kind: counters[kind].top(limit) for kind in KINDS}}
+        cache.set(REPORT_CACHE_KEY, cached, cache_timeout())
+    return {
+        'hashtags': cached['hashtags'][:limit],
+        'posts': [(int(post_id), score) for post_id, score in cached['posts'][:limit]],
+    }
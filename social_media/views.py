@@ -3,30 +3,28 @@ from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
+from django.conf import settings
+from django.core.cache import cache
 from django.http import JsonResponse
 from django.db.models import Q
-from django.core.paginator import Paginator
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from .models import Profile, Post, Comment, Notification
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from .models import Profile, Post, Comment, Notification, PostHashtag
 from .serializers import ProfileSerializer, PostSerializer, CommentSerializer, NotificationSerializer
 from .forms import UserRegistrationForm, PostForm, CommentForm, ProfileUpdateForm
+from .pagination import InvalidCursor, KeysetCursorPagination, OldestFirstCursorPagination, PostLinkCursorPagination
+from . import actions, caching, graph, images, metrics, notifications, post_search, routers, search, timeline, trending
 
 
 def home(request):
     if request.user.is_authenticated:
-        # Get posts from followed users
-        following_users = request.user.profile.user.following.all()
-        posts = Post.objects.filter(
-            Q(author__in=[profile.user for profile in following_users]) | 
-            Q(author=request.user)
-        ).distinct()
-        
-        paginator = Paginator(posts, 10)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        # Read the precomputed timeline instead of joining over followed users
+        try:
+            page_obj = timeline.read_timeline(request.user, request.GET.get('cursor'), per_page=10)
+        except InvalidCursor:
+            page_obj = timeline.read_timeline(request.user, per_page=10)
         
         return render(request, 'home.html', {'page_obj': page_obj})
     else:
@@ -48,14 +46,15 @@ def register(request):
 @login_required
 def profile(request, username):
     user = get_object_or_404(User, username=username)
-    profile = get_object_or_404(Profile, user=user)
-    posts = Post.objects.filter(author=user)
     
-    context = {
-        'profile': profile,
-        'posts': posts,
-        'is_following': request.user.profile.user in profile.followers.all() if request.user != user else False
-    }
+    def load():
+        profile = get_object_or_404(Profile.objects.select_related('user'), user=user)
+        posts = list(Post.objects.filter(author=user).select_related('author__profile'))
+        return {'profile': profile, 'posts': posts}
+    
+    # The page is shared by every viewer; only the follow button is per-viewer
+    context = caching.read_through('profile-page', [user.pk], [('user', user.pk), ('posts', user.pk)], load)
+    context['is_following'] = request.user != user and graph.is_following(request.user.pk, user.pk)
     return render(request, 'profile.html', context)
 
 @login_required
@@ -76,11 +75,7 @@ def search_users(request):
     query = request.GET.get('q')
     users = []
     if query:
-        users = User.objects.filter(
-            Q(username__icontains=query) | 
-            Q(first_name__icontains=query) | 
-            Q(last_name__icontains=query)
-        ).exclude(id=request.user.id)
+        users = search.search_users(query, limit=50, exclude_user_id=request.user.id)
     
     return render(request, 'search.html', {'users': users, 'query': query})
 # Profile API Views
@@ -95,12 +90,37 @@ class ProfileDetailView(generics.RetrieveUpdateAPIView):
         return profile
 
 # Post API Views
-class PostListCreateView(generics.ListCreateAPIView):
+def embedded_comments_limit(params):
+    """
+    Latest comments embedded per post, from ``?comments=N`` (bounded)
+    """
+    limit = getattr(settings, 'POST_LIST_COMMENTS_LIMIT', 3)
+    max_limit = getattr(settings, 'POST_LIST_MAX_COMMENTS_LIMIT', 20)
+    try:
+        limit = int(params.get('comments', limit))
+    except ValueError:
+        pass
+    return max(0, min(limit, max_limit))
+
+class EmbeddedCommentsMixin:
+    def get_comments_limit(self):
+        return embedded_comments_limit(self.request.query_params)
+    
+    def load_posts(self, post_ids):
+        """
+        Posts for ``post_ids`` in that order, eagerly loaded for PostSerializer
+        """
+        queryset = Post.objects.filter(pk__in=post_ids)
+        posts = PostSerializer.setup_eager_loading(queryset, comments_limit=self.get_comments_limit()).in_bulk()
+        return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+class PostListCreateView(EmbeddedCommentsMixin, generics.ListCreateAPIView):
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetCursorPagination
     
     def get_queryset(self):
-        return Post.objects.all()
+        return PostSerializer.setup_eager_loading(Post.objects.all(), comments_limit=self.get_comments_limit())
     
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -110,7 +130,19 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Post.objects.all()
+        return PostSerializer.setup_eager_loading(Post.objects.all())
+    
+    def retrieve(self, request, *args, **kwargs):
+        post_id = self.kwargs['pk']
+        author_id = caching.post_author_id(post_id)
+        if author_id is None:
+            return super().retrieve(request, *args, **kwargs)
+        data = caching.read_through(
+            'post-detail', [request.build_absolute_uri(), images.accepts_webp(request)],
+            [*caching.comment_deps(post_id), ('user', author_id)],
+            lambda: self.get_serializer(self.get_object()).data,
+        )
+        return Response(data)
     
     def perform_update(self, serializer):
         if serializer.instance.author != self.request.user:
@@ -122,36 +154,91 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
             raise PermissionError("You can only delete your own posts.")
         instance.delete()
 
+class TagFeedView(EmbeddedCommentsMixin, generics.ListAPIView):
+    """
+    Newest posts under a hashtag, paged through the hashtag feed index
+    """
+    serializer_class = PostSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = PostLinkCursorPagination
+    
+    def list(self, request, *args, **kwargs):
+        links = post_search.tag_postings(self.kwargs['tag'])
+        if links is None:
+            links = PostHashtag.objects.none()
+        post_ids = [link.post_id for link in self.paginate_queryset(links.only('post_id', 'created_at'))]
+        serializer = self.get_serializer(self.load_posts(post_ids), many=True)
+        return self.get_paginated_response(serializer.data)
+
+class PostSearchView(EmbeddedCommentsMixin, generics.GenericAPIView):
+    """
+    Posts containing every word of ``?q``, best matches first
+    (``?limit``, at most 50, and ``?offset``)
+    """
+    serializer_class = PostSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 50))
+            offset = max(0, int(request.query_params.get('offset', 0)))
+        except ValueError:
+            return Response({'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        post_ids = post_search.search_post_ids(query, limit=limit, offset=offset)
+        serializer = self.get_serializer(self.load_posts(post_ids), many=True)
+        return Response({'query': query, 'results': serializer.data}, status=status.HTTP_200_OK)
+
+class TrendingView(EmbeddedCommentsMixin, generics.GenericAPIView):
+    """
+    Trending hashtags and posts from the streaming aggregator (``?limit``,
+    at most 50); nothing here aggregates in the database
+    """
+    serializer_class = PostSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+        except ValueError:
+            limit = 10
+        report = trending.report(limit)
+        scores = dict(report['posts'])
+        posts = self.get_serializer(self.load_posts(list(scores)), many=True).data
+        return Response({
+            'hashtags': [{'tag': tag, 'score': score} for tag, score in report['hashtags']],
+            'posts': [{'score': scores[post['id']], 'post': post} for post in posts],
+        }, status=status.HTTP_200_OK)
+
 # Comment API Views
 class CommentListCreateView(generics.ListCreateAPIView):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OldestFirstCursorPagination
     
     def get_queryset(self):
         post_id = self.kwargs['post_id']
-        return Comment.objects.filter(post_id=post_id)
+        return CommentSerializer.setup_eager_loading(Comment.objects.filter(post_id=post_id))
+    
+    def list(self, request, *args, **kwargs):
+        data = caching.read_through(
+            'comment-list', [request.build_absolute_uri()], caching.comment_deps(self.kwargs['post_id']),
+            lambda: super(CommentListCreateView, self).list(request, *args, **kwargs).data,
+        )
+        return Response(data)
     
     def perform_create(self, serializer):
         post_id = self.kwargs['post_id']
         post = get_object_or_404(Post, id=post_id)
-        comment = serializer.save(author=self.request.user, post=post)
-        
-        # Create notification
-        if post.author != self.request.user:
-            Notification.objects.create(
-                recipient=post.author,
-                sender=self.request.user,
-                notification_type='comment',
-                post=post,
-                comment=comment
-            )
+        # The comment notification is queued by the post_save receiver
+        serializer.save(author=self.request.user, post=post)
 
 class CommentDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Comment.objects.all()
+        return CommentSerializer.setup_eager_loading(Comment.objects.all())
     
     def perform_update(self, serializer):
         if serializer.instance.author != self.request.user:
@@ -163,115 +250,192 @@ class CommentDetailView(generics.RetrieveUpdateDestroyAPIView):
             raise PermissionError("You can only delete your own comments.")
         instance.delete()
 
-# Like/Unlike API Views
-@api_view(['POST', 'DELETE'])
+# Like/Unlike and Follow/Unfollow API Views
+RELATION_MESSAGES = {
+    'like_post': {
+        'key': 'liked', 'added': 'Post liked successfully', 'present': 'Post already liked',
+        'removed': 'Post unliked successfully', 'absent': 'Post not liked',
+    },
+    'like_comment': {
+        'key': 'liked', 'added': 'Comment liked successfully', 'present': 'Comment already liked',
+        'removed': 'Comment unliked successfully', 'absent': 'Comment not liked',
+    },
+    'follow': {
+        'key': 'following', 'added': 'User followed successfully', 'present': 'Already following this user',
+        'removed': 'User unfollowed successfully', 'absent': 'Not following this user',
+        'invalid': 'You cannot follow yourself',
+    },
+}
+
+def relation_response(kind, method, result):
+    """
+    ``(body, status)`` answering a like or follow request with ``method``
+    whose action came out as ``result``
+    """
+    texts = RELATION_MESSAGES[kind]
+    state = method != 'DELETE'
+    if result == actions.NOT_FOUND:
+        return {'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND
+    if result == actions.INVALID:
+        return {'message': texts['invalid']}, status.HTTP_400_BAD_REQUEST
+    changed = result == actions.CHANGED
+    if method == 'POST' and not changed:
+        return {'message': texts['present']}, status.HTTP_400_BAD_REQUEST
+    if state:
+        message = texts['added' if changed else 'present']
+    else:
+        message = texts['removed' if changed else 'absent']
+    return {'message': message, texts['key']: state, 'changed': changed}, status.HTTP_200_OK
+
+def set_relation(request, kind, target_id):
+    """
+    PUT and DELETE set the relation idempotently; POST keeps its original
+    meaning and rejects a like or follow that already exists
+    """
+    [result] = actions.apply(request.user, [(kind, target_id, request.method != 'DELETE')])
+    body, code = relation_response(kind, request.method, result)
+    return Response(body, status=code)
+
+@api_view(['POST', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def like_post(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    
-    if request.method == 'POST':
-        if request.user not in post.likes.all():
-            post.likes.add(request.user)
-            # Create notification
-            if post.author != request.user:
-                Notification.objects.create(
-                    recipient=post.author,
-                    sender=request.user,
-                    notification_type='like_post',
-                    post=post
-                )
-            return Response({'message': 'Post liked successfully'}, status=status.HTTP_200_OK)
-        else:
-            return Response({'message': 'Post already liked'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    elif request.method == 'DELETE':
-        if request.user in post.likes.all():
-            post.likes.remove(request.user)
-            return Response({'message': 'Post unliked successfully'}, status=status.HTTP_200_OK)
-        else:
-            return Response({'message': 'Post not liked'}, status=status.HTTP_400_BAD_REQUEST)
+    return set_relation(request, 'like_post', post_id)
 
-@api_view(['POST', 'DELETE'])
+@api_view(['POST', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def like_comment(request, comment_id):
-    comment = get_object_or_404(Comment, id=comment_id)
-    
-    if request.method == 'POST':
-        if request.user not in comment.likes.all():
-            comment.likes.add(request.user)
-            # Create notification
-            if comment.author != request.user:
-                Notification.objects.create(
-                    recipient=comment.author,
-                    sender=request.user,
-                    notification_type='like_comment',
-                    comment=comment
-                )
-            return Response({'message': 'Comment liked successfully'}, status=status.HTTP_200_OK)
-        else:
-            return Response({'message': 'Comment already liked'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    elif request.method == 'DELETE':
-        if request.user in comment.likes.all():
-            comment.likes.remove(request.user)
-            return Response({'message': 'Comment unliked successfully'}, status=status.HTTP_200_OK)
-        else:
-            return Response({'message': 'Comment not liked'}, status=status.HTTP_400_BAD_REQUEST)
+    return set_relation(request, 'like_comment', comment_id)
 
-# Follow/Unfollow API Views
-@api_view(['POST', 'DELETE'])
+@api_view(['POST', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def follow_user(request, user_id):
-    user_to_follow = get_object_or_404(User, id=user_id)
-    
-    if user_to_follow == request.user:
-        return Response({'message': 'You cannot follow yourself'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    profile_to_follow, created = Profile.objects.get_or_create(user=user_to_follow)
+    return set_relation(request, 'follow', user_id)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch_actions(request):
+    """
+    Apply queued offline likes and follows in one call:
+    ``{"actions": [{"type": "like_post", "id": 1, "state": true}, ...]}``
+    """
+    items = request.data.get('actions') if isinstance(request.data, dict) else None
+    if not isinstance(items, list):
+        return Response({'error': 'actions must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > actions.batch_limit():
+        return Response({'error': f'at most {actions.batch_limit()} actions per call'}, status=status.HTTP_400_BAD_REQUEST)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            kind, target_id, state = item['type'], int(item['id']), item.get('state', True)
+        except (TypeError, KeyError, ValueError):
+            return Response({'error': f'action {index} needs a type and an integer id'}, status=status.HTTP_400_BAD_REQUEST)
+        if kind not in actions.KINDS or not isinstance(state, bool):
+            return Response({'error': f'action {index} has an unknown type or a non-boolean state'}, status=status.HTTP_400_BAD_REQUEST)
+        parsed.append((kind, target_id, state))
+    results = actions.apply(request.user, parsed)
+    return Response({'results': [
+        {'type': kind, 'id': target_id, 'state': state, 'result': result}
+        for (kind, target_id, state), result in zip(parsed, results)
+    ]}, status=status.HTTP_200_OK)
+
+# Notification API Views
+class NotificationListView(generics.ListAPIView):
+    serializer_class = NotificationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetCursorPagination
     
-    if request.method == 'POST':
-        if request.user not in profile_to_follow.followers.all():
-            profile_to_follow.followers.add(request.user)
-            # Create notification
-            Notification.objects.create(
-                recipient=user_to_follow,
-                sender=request.user,
-                notification_type='follow'
-            )
-            return Response({'message': 'User followed successfully'}, status=status.HTTP_200_OK)
-        else:
-            return Response({'message': 'Already following this user'}, status=status.HTTP_400_BAD_REQUEST)
+    def get_queryset(self):
+        # ``actors`` is only read while aggregating, and grows with popular posts
+        queryset = Notification.objects.filter(recipient=self.request.user).select_related('sender').defer('actors')
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            queryset = queryset.filter(is_read=False)
+        return queryset
     
-    elif request.method == 'DELETE':
-        if request.user in profile_to_follow.followers.all():
-            profile_to_follow.followers.remove(request.user)
-            return Response({'message': 'User unfollowed successfully'}, status=status.HTTP_200_OK)
-        else:
-            return Response({'message': 'Not following this user'}, status=status.HTTP_400_BAD_REQUEST)
+    def list(self, request, *args, **kwargs):
+        # Only the default first page is cached; the key is cleared on every
+        # change to the recipient's notifications
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        key = notifications.inbox_cache_key(request.user.pk)
+        data = cache.get(key)
+        if data is None:
+            with routers.primary():
+                data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, notifications.cache_timeout())
+        return Response(data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def unread_notifications_count(request):
+    return Response({'unread': notifications.unread_count(request.user)}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def mark_notifications_read(request):
+    ids = request.data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+            return Response({'message': 'ids must be a list of integers'}, status=status.HTTP_400_BAD_REQUEST)
+    updated = notifications.mark_read(request.user, ids)
+    return Response({'updated': updated}, status=status.HTTP_200_OK)
 
 # Search API Views
+def search_limit(params):
+    try:
+        return max(1, min(int(params.get('limit', 10)), 25))
+    except ValueError:
+        return 10
+
+def user_search_result(request, user, following):
+    profile = getattr(user, 'profile', None)
+    return {
+        'id': user.id,
+        'username': user.username,
+        'full_name': f"{user.first_name} {user.last_name}".strip(),
+        'profile_picture': images.requested_url(request, profile.profile_picture, profile.picture_renditions, 80) if profile else None,
+        'followers_count': profile.followers_count if profile else 0,
+        'is_following': user.id in following,
+    }
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def search_users_api(request):
     query = request.GET.get('query', '')
     if query:
-        users = User.objects.filter(
-            Q(username__icontains=query) | 
-            Q(first_name__icontains=query) | 
-            Q(last_name__icontains=query)
-        ).exclude(id=request.user.id)[:10]
-        
-        results = []
-        for user in users:
-            profile, created = Profile.objects.get_or_create(user=user)
-            results.append({
-                'id': user.id,
-                'username': user.username,
-                'full_name': f"{user.first_name} {user.last_name}".strip(),
-                'profile_picture': profile.profile_picture.url if profile.profile_picture else None,
-                'followers_count': profile.followers_count
-            })
-        
+        users = search.search_users(query, limit=search_limit(request.GET), exclude_user_id=request.user.id)
+        following = graph.members(request.user.id, [user.id for user in users])
+        results = [user_search_result(request, user, following) for user in users]
         return Response({'results': results}, status=status.HTTP_200_OK)
     
-    return Response({'results': []}, status=status.HTTP_200_OK)
\ No newline at end of file
+    return Response({'results': []}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def user_relationship(request, user_id):
+    """
+    How the requesting user and ``user_id`` are connected: follow state both
+    ways, followers in common and accounts both follow (``?limit`` ids each)
+    """
+    user = get_object_or_404(User, id=user_id)
+    try:
+        limit = max(0, min(int(request.GET.get('limit', 20)), 100))
+    except ValueError:
+        limit = 20
+    followers_you_know = graph.followers_you_know(request.user.id, user.id)
+    common_following = graph.common_following(request.user.id, user.id)
+    return Response({
+        'following': graph.is_following(request.user.id, user.id),
+        'followed_by': graph.is_following(user.id, request.user.id),
+        'followers_you_know': {'count': len(followers_you_know), 'ids': list(followers_you_know[:limit])},
+        'common_following': {'count': len(common_following), 'ids': list(common_following[:limit])},
+    }, status=status.HTTP_200_OK)
+
+# Metrics API Views
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_report(request):
+    include_snapshots = request.GET.get('all') in ('1', 'true')
+    return Response({
+        'views': metrics.report(include_snapshots=include_snapshots),
+        'database': metrics.database_report(include_snapshots=include_snapshots),
+    }, status=status.HTTP_200_OK)
\ No newline at end of file